@@ -733,7 +733,8 @@ class AnalysisTask(BaseAnalysisTask):
                 dtables = None
             return dtables
 
-        if not self.config.overwrite and os.path.exists(output_data):
+        if not self.config.overwrite and not self.get_config_param('incremental', False) and\
+           os.path.exists(output_data):
             self.log.info("Ouput file %s exists, skipping extract()" % output_data)
             try:
                 dtables = TableDict(output_data)
@@ -752,6 +753,25 @@ class AnalysisTask(BaseAnalysisTask):
                 self.log.warn("Failed to write table %s" % output_data)
         return dtables
 
+    def read_previous_tables(self):
+        """Read back the output tables from a previous run of this task
+
+        This is used by tasks that can add new input data to existing results.
+
+        Returns
+        -------
+        dtables : `TableDict` or `None`
+            The previous output, None unless config.incremental is set and
+            the output file exists
+        """
+        if not self.get_config_param('incremental', False):
+            return None
+        output_data = self.tablefile_name() + ".fits"
+        if not os.path.exists(output_data):
+            return None
+        self.log.info("Adding to existing output %s" % output_data)
+        return TableDict(output_data)
+
     def set_local_data(self, butler, data, **kwargs):
         """Set local data members if extract fails
 
@@ -234,6 +234,23 @@ def make_file_dict(butler, runlist, varlist=None):
 
 
 
+def get_file_keys(file_list):
+    """Get strings that identify a set of input files
+
+    Parameters
+    ----------
+    file_list : `list`
+        The filenames, or the `Butler` dataIDs
+
+    Returns
+    -------
+    o_list : `list`
+        The filenames, or string versions of the dataIDs
+    """
+    return [data_id if isinstance(data_id, str) else str(sorted(data_id.items()))
+            for data_id in file_list]
+
+
 def get_files_butler(butler, run_id, **kwargs):
     """Get a set of files out of a folder
 
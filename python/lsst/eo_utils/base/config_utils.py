@@ -39,6 +39,10 @@ class EOUtilOptions(pexConfig.Config):
                               default=False)
     batch_args = pexConfig.Field("Arguments to pass to batch command", str,
                                  default=DEFAULT_BATCH_ARGS)
+    nthreads = pexConfig.Field("Number of threads used to process amps in parallel", int,
+                               default=1)
+    nproc = pexConfig.Field("Number of processes used to fit amps in parallel", int,
+                            default=1)
 
     # Options for the data source
     data_source = pexConfig.Field("Data Source (glob | datacat | butler | butler_file)", str,
@@ -60,6 +64,8 @@ class EOUtilOptions(pexConfig.Config):
     indir = pexConfig.Field("Input directory name", str, default=DEFAULT_OUTDIR)
     outfile = pexConfig.Field("Output file name", str, default=None)
     overwrite = pexConfig.Field("Process even if output data already exists", bool, default=False)
+    incremental = pexConfig.Field("Only process new input data, and add it to existing output data",
+                                  bool, default=False)
 
     # Options for input data processing
     calib_dict = pexConfig.Field("Calibration Dictionary", str, default=DEFAULT_CALIB_FILE)
@@ -81,6 +87,8 @@ class EOUtilOptions(pexConfig.Config):
                             default=False)
     stat = pexConfig.Field("Statistic to use to stack images", str,
                            default=None)
+    stack_nsample = pexConfig.Field("Number of frames sampled for the median of running stacks",
+                                    int, default=11)
     subtract_mean = pexConfig.Field("Subtract the mean from all images frames", bool,
                                     default=False)
 
@@ -100,9 +108,18 @@ class EOUtilOptions(pexConfig.Config):
 
     # Other output options
     bitpix = pexConfig.Field("FITS bitpix value", int, default=DEFAULT_BITPIX)
+    compress = pexConfig.Field("Tile compression for calibration frames "
+                               "(None | GZIP_1 | GZIP_2 | RICE_1 | HCOMPRESS_1)", str,
+                               default=None)
+    quantize_level = pexConfig.Field("Quantization level for compressed float data, 0 is lossless",
+                                     float, default=None)
 
     # Options for Fe55 Tasks
     use_all = pexConfig.Field("Use all fe55 clusters", bool, default=False)
+    fe55_nsig = pexConfig.Field("Fe55 cluster detection threshold, in units of the pixel noise",
+                                float, default=4.)
+    fe55_max_npix = pexConfig.Field("Maximum number of pixels above threshold in a fe55 cluster",
+                                    int, default=25)
 
     # Options for Flat Tasks
     smoothing = pexConfig.Field("Smoothing for spline overscan correction", int, default=11000)
@@ -119,12 +136,22 @@ class EOUtilOptions(pexConfig.Config):
     num_profile_points = pexConfig.Field("Number of bins for profile plots",
                                          int, default=40)
 
+    # Options for PTC Tasks
+    ptc_max_mean = pexConfig.Field("Maximum mean signal for points used in PTC fits",
+                                   float, default=8.0e4)
+    ptc_nsig_clip = pexConfig.Field("Reject PTC points with residuals above this many sigma, "
+                                    "None for no rejection", float, default=None)
+
 
     # Options for BF Tasks
     maxLag = pexConfig.Field("Max lag for BF analysis", int, default=1)
     nSigmaClip = pexConfig.Field("Sigma clip for BF analysis", int, default=3)
     backgroundBinSize = pexConfig.Field("Background bin size for BF analysis", int, default=128)
 
+    # Options for Dust Tasks
+    max_defects = pexConfig.Field("Maximum number of defects per amp to use, strongest first, "
+                                  "0 for all", int, default=0)
+
     # Options for CTE Tasks
     overscans = pexConfig.Field("Number of overscan rows/columns to use", int, default=2)
     nframes = pexConfig.Field("Number of frames used to make superflat", int, default=5)
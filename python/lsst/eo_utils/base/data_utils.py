@@ -4,6 +4,8 @@ import os
 
 import h5py
 
+import numpy as np
+
 from astropy.io import fits
 from astropy.table import Table, Column
 from astropy.table import vstack as vstack_table
@@ -16,6 +18,9 @@ from .defaults import ALL_SLOTS
 HDF5_SUFFIXS = ['.hdf', '.h5', '.hd5', '.hdf5']
 FITS_SUFFIXS = ['.fit', '.fits']
 
+# Size of the grid cells used to index defects, in pixels
+DEFECT_INDEX_CELLSIZE = 64
+
 
 def create_dict_from_guard_rows(col_dict):
     """Create a dictionary of lists from a dictionary of guard values
@@ -129,6 +134,27 @@ class TableDict:
         """
         self._table_dict[key] = tab
 
+    def append_datatable(self, key, data):
+        """Append rows to a `Table`, making the `Table` if it does not exist
+
+        Parameters
+        ----------
+        key : `str`
+            Name of the table
+        data : `dict` or `Table`
+            The rows to append.  This is passed to the `Table` constructor.
+
+        Returns
+        -------
+        tab : `Table`
+            The updated table
+        """
+        tab = Table(data)
+        if key in self._table_dict:
+            tab = vstack_table([self._table_dict[key], tab])
+        self._table_dict[key] = tab
+        return tab
+
     def make_datatables(self, data):
         """Make a set of `Table` objects
 
@@ -323,6 +349,217 @@ def construct_bbox_dict(defect_table):
     return bbox_dict
 
 
+class DefectIndex:
+    """Spatial index of the defect bounding boxes in a defects table
+
+    The defects are sorted by slot, amp and the row and column of the
+    grid cell holding their lower corner.  All the defects for an amp are
+    then a contiguous slice of the sorted arrays, and the defects in a
+    band of cell rows are a contiguous slice of that.
+
+    Queries return the indices of the rows in the defects table.
+    """
+    def __init__(self, defect_table, index_table=None, **kwargs):
+        """C'tor
+
+        Parameters
+        ----------
+        defect_table : `Table`
+            Astropy table with the defects
+        index_table : `Table` or `None`
+            Table made by `to_table`, if `None` the index is built
+
+        Keywords
+        --------
+        cellsize : `int`
+            Size of the grid cells, in pixels
+        """
+        self._defect_table = defect_table
+        self._x_corner = np.asarray(defect_table['x_corner'], int)
+        self._y_corner = np.asarray(defect_table['y_corner'], int)
+        self._x_size = np.asarray(defect_table['x_size'], int)
+        self._y_size = np.asarray(defect_table['y_size'], int)
+
+        if index_table is None:
+            self.cellsize = kwargs.get('cellsize', DEFECT_INDEX_CELLSIZE)
+            slots = np.asarray(defect_table['slot'], int)
+            amps = np.asarray(defect_table['amp'], int)
+            cell_y = self._y_corner // self.cellsize
+            cell_x = self._x_corner // self.cellsize
+            self._rows = np.lexsort((cell_x, cell_y, amps, slots))
+            self._slots = slots[self._rows]
+            self._amps = amps[self._rows]
+            self._cell_y = cell_y[self._rows]
+            self._cell_x = cell_x[self._rows]
+        else:
+            self.cellsize = index_table.meta.get('CELLSIZE', DEFECT_INDEX_CELLSIZE)
+            self._rows = np.asarray(index_table['row'], int)
+            self._slots = np.asarray(index_table['slot'], int)
+            self._amps = np.asarray(index_table['amp'], int)
+            self._cell_y = np.asarray(index_table['cell_y'], int)
+            self._cell_x = np.asarray(index_table['cell_x'], int)
+
+        self._amp_keys = self._slots * 1000 + self._amps
+
+        # The largest defects set how far back from a region we have to look
+        self._max_x_cells = (self._x_size.max() // self.cellsize + 1) if self._x_size.size else 0
+        self._max_y_cells = (self._y_size.max() // self.cellsize + 1) if self._y_size.size else 0
+
+    def to_table(self):
+        """Return the index as a `Table` that can be stored with the defects"""
+        table = Table(dict(row=self._rows,
+                           slot=self._slots,
+                           amp=self._amps,
+                           cell_y=self._cell_y,
+                           cell_x=self._cell_x))
+        table.meta['CELLSIZE'] = self.cellsize
+        return table
+
+    def _amp_range(self, slot, amp):
+        """Return the range of the sorted arrays for one amp"""
+        if isinstance(slot, str):
+            slot = ALL_SLOTS.index(slot)
+        return np.searchsorted(self._amp_keys, [slot * 1000 + amp, slot * 1000 + amp + 1])
+
+    def rows(self, slot, amp):
+        """Return the rows for all the defects on one amp, in table order
+
+        Parameters
+        ----------
+        slot : `str` or `int`
+            Slot name or index
+        amp : `int`
+            Amp index
+
+        Returns
+        -------
+        rows : `array`
+            The row indices
+        """
+        imin, imax = self._amp_range(slot, amp)
+        return np.sort(self._rows[imin:imax])
+
+    def query_region(self, slot, amp, bbox):
+        """Return the rows for the defects overlapping a region
+
+        Parameters
+        ----------
+        slot : `str` or `int`
+            Slot name or index
+        amp : `int`
+            Amp index
+        bbox : `tuple`
+            ymin, xmin, ymax, xmax (exclusive) of the region
+
+        Returns
+        -------
+        rows : `array`
+            The row indices, in table order
+        """
+        ymin, xmin, ymax, xmax = bbox
+        imin, imax = self._amp_range(slot, amp)
+        cell_y = self._cell_y[imin:imax]
+        jmin, jmax = imin + np.searchsorted(cell_y, [ymin // self.cellsize - self._max_y_cells,
+                                                     (ymax - 1) // self.cellsize + 1])
+        cands = self._rows[jmin:jmax]
+        cell_x = self._cell_x[jmin:jmax]
+        cands = cands[(cell_x >= xmin // self.cellsize - self._max_x_cells) &
+                      (cell_x <= (xmax - 1) // self.cellsize)]
+        overlap = (self._x_corner[cands] < xmax) &\
+            (self._x_corner[cands] + self._x_size[cands] > xmin) &\
+            (self._y_corner[cands] < ymax) &\
+            (self._y_corner[cands] + self._y_size[cands] > ymin)
+        return np.sort(cands[overlap])
+
+    def nearest(self, slot, amp, pos, k=1):
+        """Return the rows for the defects closest to a position
+
+        Parameters
+        ----------
+        slot : `str` or `int`
+            Slot name or index
+        amp : `int`
+            Amp index
+        pos : `tuple`
+            y, x of the position
+        k : `int`
+            Number of defects to return
+
+        Returns
+        -------
+        rows : `array`
+            The row indices, nearest first
+        """
+        cands = self.rows(slot, amp)
+        dy = np.clip(self._y_corner[cands] - pos[0], 0, None) +\
+            np.clip(pos[0] - (self._y_corner[cands] + self._y_size[cands] - 1), 0, None)
+        dx = np.clip(self._x_corner[cands] - pos[1], 0, None) +\
+            np.clip(pos[1] - (self._x_corner[cands] + self._x_size[cands] - 1), 0, None)
+        return cands[np.argsort(dx*dx + dy*dy, kind='stable')[0:k]]
+
+    def top_k(self, slot, amp, k, colname, ascending=False):
+        """Return the rows for the k strongest defects on one amp
+
+        Parameters
+        ----------
+        slot : `str` or `int`
+            Slot name or index
+        amp : `int`
+            Amp index
+        k : `int`
+            Number of defects to return, 0 for all of them
+        colname : `str`
+            Column of the defects table used to rank the defects
+        ascending : `bool`
+            Rank the smallest values first
+
+        Returns
+        -------
+        rows : `array`
+            The row indices, strongest first
+        """
+        cands = self.rows(slot, amp)
+        vals = np.asarray(self._defect_table[colname])[cands]
+        order = np.argsort(vals if ascending else -vals, kind='stable')
+        if k:
+            order = order[0:k]
+        return cands[order]
+
+    def get_bboxes(self, rows):
+        """Return the bounding boxes for a set of defects
+
+        Parameters
+        ----------
+        rows : `array`
+            The row indices
+
+        Returns
+        -------
+        bboxes : `array`
+            (n, 4) array with ymin, xmin, ymax, xmax (exclusive) of each box
+        """
+        return np.stack([self._y_corner[rows], self._x_corner[rows],
+                         self._y_corner[rows] + self._y_size[rows],
+                         self._x_corner[rows] + self._x_size[rows]], axis=1)
+
+    def get_bbox_list(self, rows):
+        """Return the bounding boxes for a set of defects as `Box2I` objects
+
+        Parameters
+        ----------
+        rows : `array`
+            The row indices
+
+        Returns
+        -------
+        bbox_list : `list`
+            The bounding boxes
+        """
+        return [afwGeom.Box2I(afwGeom.Point2I(int(self._x_corner[row]), int(self._y_corner[row])),
+                              afwGeom.Extent2I(int(self._x_size[row]), int(self._y_size[row])))
+                for row in rows]
+
+
 def stack_summary_table(data, for_whom, **kwargs):
     """Stack together a bunch of tables into a summary table
 
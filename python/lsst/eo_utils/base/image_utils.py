@@ -5,9 +5,15 @@ These functions will work both with Butlerized and un-Butlerized data.
 
 import os
 
+from collections import OrderedDict
+
+from concurrent.futures import ThreadPoolExecutor
+
+from types import MappingProxyType
+
 import numpy as np
 
-from scipy import fftpack
+from scipy import fftpack, interpolate, ndimage
 
 from astropy.io import fits
 
@@ -15,14 +21,8 @@ import lsst.afw.math as afwMath
 
 import lsst.afw.image as afwImage
 
-import lsst.afw.detection as afwDetect
-
-import lsst.geom as afwGeom
-
-from lsst.pex.exceptions.wrappers import LengthError
-
 import lsst.eotest.image_utils as imutil
-from lsst.eotest.sensor import MaskedCCD
+from lsst.eotest.sensor import MaskedCCD, makeAmplifierGeometry
 from lsst.eotest.sensor.flatPairTask import mondiode_value
 
 from .defaults import T_SERIAL, T_PARALLEL
@@ -37,13 +37,250 @@ try:
 except AttributeError:
     AFWIMAGE_MASK = afwImage.Mask
 
+# Numpy types for the FITS bitpix values we can write
+BITPIX_DTYPES = {8:np.uint8, 16:np.int16, 32:np.int32, -32:np.float32, -64:np.float64}
+
+# Tile compression algorithms we allow for calibration frames
+CALIB_COMPRESSION_TYPES = ['RICE_1', 'GZIP_1', 'GZIP_2', 'HCOMPRESS_1']
+
+# Keywords that describe the data layout, these are not copied from template headers
+STRUCTURAL_KEYWORDS = ['SIMPLE', 'XTENSION', 'BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2',
+                       'EXTEND', 'PCOUNT', 'GCOUNT', 'BSCALE', 'BZERO',
+                       'CHECKSUM', 'DATASUM']
+
+# Number of decompressed calibration amplifier arrays to keep in memory
+CALIB_AMP_CACHE_SIZE = 32
+_CALIB_AMP_CACHE = OrderedDict()
+
+# Number of combined sets of mask planes to keep in memory
+MASK_CACHE_SIZE = 4
+_MASK_CACHE = OrderedDict()
+
+# Range and spacing, in ADU, of the nonlinearity correction lookup tables
+NONLIN_LUT_XMIN = -5000.
+NONLIN_LUT_XMAX = 262144.
+NONLIN_LUT_STEP = 1.
+
+# Overscan bias models that can be computed for all the amps at once
+BATCH_BIAS_TYPES = ['mean', 'row', 'func', 'spline']
+
+# Geometry descriptors, keyed by data source, manufacturer and detector type
+_CCD_GEOMETRY_CACHE = {}
+
+
+def _bbox_corners(bbox):
+    """Get the corners of a bounding box as a tuple of ints"""
+    return (bbox.getMinX(), bbox.getMinY(), bbox.getMaxX(), bbox.getMaxY())
+
+
+def _region_slices(regions, origin):
+    """Get the array slices for each region of an amp, relative to origin"""
+    o_dict = {}
+    for key in ['imaging', 'serial_overscan', 'parallel_overscan', 'prescan']:
+        (x_min, y_min, x_max, y_max) = _bbox_corners(regions[key])
+        o_dict[key] = (slice(y_min - origin[1], y_max + 1 - origin[1]),
+                       slice(x_min - origin[0], x_max + 1 - origin[0]))
+    return MappingProxyType(o_dict)
+
+
+class CCDGeometry:
+    """Immutable description of the readout geometry of one type of CCD
+
+    These are built once per data source, manufacturer and detector type by
+    `get_ccd_geometry` and shared by all the CCDs of that type.
+
+    Attributes
+    ----------
+    key : `tuple`
+        Data source, manufacturer and detector type
+    manu : `str` or `None`
+        Manufacturer 'ITL' or 'E2V'
+    dims : `MappingProxyType`
+        The amp dimensions, as returned by `get_dims_from_ccd`
+    regions : `MappingProxyType`
+        The bounding boxes for each amp, as returned by `get_geom_regions`
+    slices : `MappingProxyType`
+        The numpy slices for each region of each amp, relative to the raw amp image
+    steps : `MappingProxyType` or `None`
+        The (step_x, step_y) flips for each amp, `None` for unknown manufacturers
+    """
+    __slots__ = ['key', 'manu', 'dims', 'regions', 'slices', 'steps']
+
+    def __init__(self, key, manu, dims, regions, slices, steps):
+        """C'tor
+
+        Parameters
+        ----------
+        key : `tuple`
+            Data source, manufacturer and detector type
+        manu : `str` or `None`
+            Manufacturer 'ITL' or 'E2V'
+        dims : `dict`
+            The amp dimensions
+        regions : `dict`
+            The bounding boxes for each amp
+        slices : `dict`
+            The numpy slices for each region of each amp
+        steps : `dict` or `None`
+            The (step_x, step_y) flips for each amp
+        """
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, 'manu', manu)
+        object.__setattr__(self, 'dims', MappingProxyType(dims))
+        object.__setattr__(self, 'regions', MappingProxyType(regions))
+        object.__setattr__(self, 'slices', MappingProxyType(slices))
+        if steps is not None:
+            steps = MappingProxyType(steps)
+        object.__setattr__(self, 'steps', steps)
+
+    def __setattr__(self, name, value):
+        """Geometry descriptors can not be modified"""
+        raise AttributeError("CCDGeometry objects are immutable")
+
+    def __hash__(self):
+        """Hash on the key"""
+        return hash(self.key)
+
+    def __eq__(self, other):
+        """Descriptors are equal if their keys are"""
+        return isinstance(other, CCDGeometry) and self.key == other.key
+
+    def get_steps(self, amp):
+        """Get x and y steps (+1 or -1) to convert between
+        readout and physical orientation for a particular amp
+
+        Parameters
+        ----------
+        amp : `int`
+            Amplifier index
+
+        Returns
+        -------
+        step_x : `int`
+            Step to take in x to go from readout to physical order
+        step_y : `int`
+            Step to take in y to go from readout to physical order
+
+        Raises
+        ------
+        ValueError : If the manufacturer is not known.
+        """
+        if self.steps is None:
+            raise ValueError("Unknown CCD type %s" % self.manu)
+        return self.steps[amp]
+
+
+def _steps_for_manu(manu, amps):
+    """Get the readout to physical flips for a set of amps, `None` if manu is not known"""
+    if manu == 'ITL':
+        flip_y = -1
+    elif manu == 'E2V':
+        flip_y = 1
+    else:
+        return None
+    return {amp:(1, -1) if amp < 8 else (-1, flip_y) for amp in amps}
+
+
+def _make_file_ccd_geometry(key, manu, geom):
+    """Build the `CCDGeometry` for data read from FITS files"""
+    dims = dict(nrow_i=geom.imaging.getHeight(),
+                nrow_s=geom.serial_overscan.getHeight(),
+                nrow_p=geom.parallel_overscan.getHeight(),
+                ncol_i=geom.imaging.getWidth(),
+                ncol_s=geom.serial_overscan.getWidth(),
+                ncol_p=geom.parallel_overscan.getWidth(),
+                ncol_f=geom.naxis1)
+    amp_regions = MappingProxyType(dict(imaging=geom.imaging,
+                                        serial_overscan=geom.serial_overscan,
+                                        parallel_overscan=geom.parallel_overscan,
+                                        prescan=geom.prescan,
+                                        offset=None,
+                                        step_x=1,
+                                        step_y=1))
+    amp_slices = _region_slices(amp_regions, (0, 0))
+    amps = range(1, 17)
+    return CCDGeometry(key, manu, dims,
+                       {amp:amp_regions for amp in amps},
+                       {amp:amp_slices for amp in amps},
+                       _steps_for_manu(manu, amps))
+
+
+def _make_butler_ccd_geometry(key, manu, det):
+    """Build the `CCDGeometry` for data read with the `Butler`"""
+    geom = det[0]
+    dims = dict(nrow_i=geom.getBBox().getHeight(),
+                nrow_s=geom.getRawHorizontalOverscanBBox().getHeight(),
+                nrow_p=geom.getRawVerticalOverscanBBox().getHeight(),
+                ncol_i=geom.getBBox().getWidth(),
+                ncol_s=geom.getRawHorizontalOverscanBBox().getWidth(),
+                ncol_p=geom.getRawVerticalOverscanBBox().getWidth(),
+                ncol_f=geom.getRawBBox().getWidth())
+    amps = range(len(det))
+    steps = _steps_for_manu(manu, amps)
+    regions = {}
+    slices = {}
+    for amp in amps:
+        geom = det[amp]
+        if steps is None:
+            step_x, step_y = (None, None)
+        else:
+            step_x, step_y = steps[amp]
+        regions[amp] = MappingProxyType(dict(imaging=geom.getRawDataBBox(),
+                                             serial_overscan=geom.getRawHorizontalOverscanBBox(),
+                                             parallel_overscan=geom.getRawVerticalOverscanBBox(),
+                                             prescan=geom.getRawPrescanBBox(),
+                                             offset=geom.getRawXYOffset(),
+                                             step_x=step_x,
+                                             step_y=step_y))
+        slices[amp] = _region_slices(regions[amp], _bbox_corners(geom.getRawBBox())[0:2])
+    return CCDGeometry(key, manu, dims, regions, slices, steps)
+
+
+def get_ccd_geometry(ccd):
+    """Get the shared geometry descriptor for a CCD
+
+    Parameters
+    ----------
+    ccd : `ExposureF`, `MaskedCCD` or `ArrayCCD`
+        CCD data object
+
+    Returns
+    -------
+    geometry : `CCDGeometry`
+        The geometry descriptor
+    """
+    if isinstance(ccd, (MaskedCCD, ArrayCCD)):
+        try:
+            manu = ccd.md.get('CCD_MANU')
+        except KeyError:
+            manu = None
+        if manu is None:
+            try:
+                manu = ccd.md.get('LSST_NUM')[0:3]
+            except (KeyError, TypeError):
+                manu = None
+        geom = ccd.amp_geom
+        key = ('file', manu, geom.naxis1) + _bbox_corners(geom.imaging)
+        geometry = _CCD_GEOMETRY_CACHE.get(key, None)
+        if geometry is None:
+            geometry = _make_file_ccd_geometry(key, manu, geom)
+    else:
+        det = ccd.getDetector()
+        manu = det.getSerial()[0:3]
+        key = ('butler', manu, det.getPhysicalType())
+        geometry = _CCD_GEOMETRY_CACHE.get(key, None)
+        if geometry is None:
+            geometry = _make_butler_ccd_geometry(key, manu, det)
+    _CCD_GEOMETRY_CACHE[key] = geometry
+    return geometry
+
 
 def get_dims_from_ccd(ccd):
     """Get the CCD amp dimensions for a particular dataId or file
 
     Parameters
     ----------
-    ccd : `ExposureF` or `MaskedCCD`
+    ccd : `ExposureF`, `MaskedCCD` or `ArrayCCD`
         CCD data object
 
     Returns
@@ -51,25 +288,7 @@ def get_dims_from_ccd(ccd):
     odict : `dict`
         Dictionary with the dimensions
     """
-    if isinstance(ccd, MaskedCCD):
-        geom = ccd.amp_geom
-        o_dict = dict(nrow_i=geom.imaging.getHeight(),
-                      nrow_s=geom.serial_overscan.getHeight(),
-                      nrow_p=geom.parallel_overscan.getHeight(),
-                      ncol_i=geom.imaging.getWidth(),
-                      ncol_s=geom.serial_overscan.getWidth(),
-                      ncol_p=geom.parallel_overscan.getWidth(),
-                      ncol_f=geom.naxis1)
-    else:
-        geom = ccd.getDetector()[0]
-        o_dict = dict(nrow_i=geom.getBBox().getHeight(),
-                      nrow_s=geom.getRawHorizontalOverscanBBox().getHeight(),
-                      nrow_p=geom.getRawVerticalOverscanBBox().getHeight(),
-                      ncol_i=geom.getBBox().getWidth(),
-                      ncol_s=geom.getRawHorizontalOverscanBBox().getWidth(),
-                      ncol_p=geom.getRawVerticalOverscanBBox().getWidth(),
-                      ncol_f=geom.getRawBBox().getWidth())
-    return o_dict
+    return dict(get_ccd_geometry(ccd).dims)
 
 
 def get_readout_freqs_from_ccd(ccd):
@@ -85,25 +304,14 @@ def get_readout_freqs_from_ccd(ccd):
     odict : `dict`
         Dictionary with the frequencies
     """
-
-    if isinstance(ccd, MaskedCCD):
-        geom = ccd.amp_geom
-        nrow_i = geom.imaging.getHeight()
-        nrow_s = geom.serial_overscan.getHeight()
-        nrow_p = geom.parallel_overscan.getHeight()
-        ncol_i = geom.imaging.getWidth()
-        ncol_s = geom.serial_overscan.getWidth()
-        ncol_p = geom.parallel_overscan.getWidth()
-        ncol_f = geom.naxis1
-    else:
-        geom = ccd.getDetector()[0]
-        nrow_i = geom.getBBox().getHeight()
-        nrow_s = geom.getRawHorizontalOverscanBBox().getHeight()
-        nrow_p = geom.getRawVerticalOverscanBBox().getHeight()
-        ncol_i = geom.getBBox().getWidth()
-        ncol_s = geom.getRawHorizontalOverscanBBox().getWidth()
-        ncol_p = geom.getRawVerticalOverscanBBox().getWidth()
-        ncol_f = geom.getRawBBox().getWidth()
+    dims = get_ccd_geometry(ccd).dims
+    nrow_i = dims['nrow_i']
+    nrow_s = dims['nrow_s']
+    nrow_p = dims['nrow_p']
+    ncol_i = dims['ncol_i']
+    ncol_s = dims['ncol_s']
+    ncol_p = dims['ncol_p']
+    ncol_f = dims['ncol_f']
 
     t_row = ncol_f*T_SERIAL + T_PARALLEL
     f_s = 1./t_row
@@ -170,28 +378,7 @@ def get_geom_steps_from_amp(ccd, amp):
     step_y : `int`
         Step to take in y to go from readout to physical order
     """
-    if isinstance(ccd, MaskedCCD):
-        try:
-            manu = ccd.md.get('CCD_MANU')
-        except KeyError:
-            manu = ccd.md.get('LSST_NUM')[0:3]
-    else:
-        manu = ccd.getDetector().getSerial()[0:3]
-
-    if manu == 'ITL':
-        flip_y = -1
-    elif manu == 'E2V':
-        flip_y = 1
-    else:
-        raise ValueError("Unknown CCD type %s" % manu)
-
-    if amp < 8:
-        step_x = 1
-        step_y = -1
-    else:
-        step_x = -1
-        step_y = flip_y
-    return (step_x, step_y)
+    return get_ccd_geometry(ccd).get_steps(amp)
 
 
 def flip_data_in_place(filepath):
@@ -211,6 +398,206 @@ def flip_data_in_place(filepath):
         hdus[amp].data = hdus[amp].data[::step_x, ::step_y]
     hdus.writeto(filepath, overwrite=True)
 
+
+def make_calib_hdu(data, bitpix, compress=None, quantize_level=None):
+    """Build the HDU for one amplifier of a calibration frame
+
+    Parameters
+    ----------
+    data : `array`
+        The data for the amplifier
+    bitpix : `int`
+        FITS bitpix value
+    compress : `str` or `None`
+        Tile compression algorithm, `None` for an uncompressed HDU
+    quantize_level : `float` or `None`
+        Quantization level for floating point data, 0 is lossless.
+        `None` selects lossless for GZIP_1 and GZIP_2, and 16 otherwise
+
+    Returns
+    -------
+    hdu : `ImageHDU` or `CompImageHDU`
+        The HDU
+
+    Raises
+    ------
+    ValueError : If the bitpix value or the compression options are not valid
+    """
+    if bitpix not in BITPIX_DTYPES:
+        raise ValueError("Invalid bitpix value: %i" % bitpix)
+    if bitpix > 0:
+        data = np.round(data)
+    data = np.asarray(data, dtype=BITPIX_DTYPES[bitpix])
+
+    if compress is None:
+        return fits.ImageHDU(data=data)
+
+    if compress not in CALIB_COMPRESSION_TYPES:
+        raise ValueError("Unknown compression type %s.  Options are %s" %
+                         (compress, str(CALIB_COMPRESSION_TYPES)))
+    is_gzip = compress.find('GZIP') == 0
+    if quantize_level is None:
+        if is_gzip:
+            quantize_level = 0.
+        else:
+            quantize_level = 16.
+    if bitpix < 0 and quantize_level == 0 and not is_gzip:
+        raise ValueError("Lossless float compression requires GZIP_1 or GZIP_2, not %s" % compress)
+    return fits.CompImageHDU(data=data, compression_type=compress,
+                             quantize_level=quantize_level)
+
+
+def copy_header_cards(header, template_header):
+    """Copy the non-structural cards from a template header
+
+    Parameters
+    ----------
+    header : `Header`
+        The header we are updating
+    template_header : `Header`
+        The header we are copying from
+    """
+    for card in template_header.cards:
+        if card.keyword in STRUCTURAL_KEYWORDS or not card.keyword:
+            continue
+        header[card.keyword] = (card.value, card.comment)
+
+
+def write_calib_fits(images, outfile, template_file, bitpix, **kwargs):
+    """Write a calibration frame, optionally as tile-compressed FITS
+
+    This follows `lsst.eotest.image_utils.writeFits`: the primary and amplifier
+    headers are copied from the template file, as are the last three HDUs.
+
+    The amplifier HDUs are appended to the output file one at a time, and
+    released once written, so that only a single amplifier is held in memory
+    as FITS data.  If requested, the
+    amplifiers are flipped from readout to physical order as they are written,
+    which replaces a separate pass with `flip_data_in_place`.
+
+    Parameters
+    ----------
+    images : `dict`
+        Images keyed by amplifier index (1 to 16), and optionally 'METADATA'
+    outfile : `str`
+        The file we are writing
+    template_file : `str`
+        File used to get the headers
+    bitpix : `int`
+        FITS bitpix value
+
+    Keywords
+    --------
+    compress : `str` or `None`
+        Tile compression algorithm, `None` for uncompressed HDUs
+    quantize_level : `float` or `None`
+        Quantization level for floating point data, 0 is lossless
+    flip : `bool`
+        Flip the amplifiers into physical order, used for Butler data
+    """
+    compress = kwargs.get('compress', None)
+    quantize_level = kwargs.get('quantize_level', None)
+    flip = kwargs.get('flip', False)
+
+    with fits.open(template_file) as template:
+        primary = fits.PrimaryHDU(header=template[0].header)
+        primary.header['FILENAME'] = outfile
+        metadata = images.get('METADATA', None)
+        if metadata is not None:
+            for key, val in metadata.items():
+                primary.header[key] = val
+        primary.writeto(outfile, overwrite=True, checksum=True)
+
+        if flip:
+            manu = primary.header.get('CCD_MANU', None)
+            if manu is None:
+                manu = primary.header.get('LSST_NUM')[0:3]
+
+        # The file is re-opened for each amp, so that the HDUList does not
+        # keep the converted data of the amps that were already written
+        for amp in range(1, 17):
+            data = images[amp].getArray()
+            if flip:
+                (step_x, step_y) = get_geom_steps_manu_hdu(manu, amp)
+                data = data[::step_x, ::step_y]
+            hdu = make_calib_hdu(data, bitpix,
+                                 compress=compress, quantize_level=quantize_level)
+            copy_header_cards(hdu.header, template[amp].header)
+            hdu.add_checksum()
+            with fits.open(outfile, mode='append') as output:
+                output.append(hdu)
+
+        with fits.open(outfile, mode='append') as output:
+            for i in (-3, -2, -1):
+                hdu = template[i].copy()
+                hdu.add_checksum()
+                output.append(hdu)
+
+
+def bbox_to_slices(bbox):
+    """Get the slices that select a bounding box from a numpy array
+
+    Parameters
+    ----------
+    bbox : `Box2I`
+        The bounding box
+
+    Returns
+    -------
+    slices : `tuple`
+        The slices along y and x
+    """
+    return (slice(bbox.getMinY(), bbox.getMaxY() + 1),
+            slice(bbox.getMinX(), bbox.getMaxX() + 1))
+
+
+def read_calib_amp_array(filepath, amp, bbox=None):
+    """Read the data for one amplifier of a calibration frame
+
+    Only the requested HDU is read.  For tile-compressed files, if a bounding
+    box is given and the amplifier is not already cached, only the tiles
+    that overlap it are decompressed.  Otherwise the full amplifier is
+    decompressed and cached, keyed by the file path and modification time.
+
+    Parameters
+    ----------
+    filepath : `str`
+        The file we are reading
+    amp : `int`
+        HDU index
+    bbox : `Box2I` or `None`
+        Region to read, `None` to read the whole amplifier
+
+    Returns
+    -------
+    data : `array`
+        The data, cached arrays are returned read-only
+    """
+    key = (os.path.abspath(filepath), os.path.getmtime(filepath), amp)
+    data = _CALIB_AMP_CACHE.get(key, None)
+    if data is not None:
+        _CALIB_AMP_CACHE.move_to_end(key)
+        if bbox is None:
+            return data
+        return data[bbox_to_slices(bbox)]
+
+    with fits.open(filepath, memmap=True, lazy_load_hdus=True) as hdus:
+        if bbox is not None:
+            return np.array(hdus[amp].section[bbox_to_slices(bbox)])
+        data = np.array(hdus[amp].data)
+
+    data.setflags(write=False)
+    _CALIB_AMP_CACHE[key] = data
+    while len(_CALIB_AMP_CACHE) > CALIB_AMP_CACHE_SIZE:
+        _CALIB_AMP_CACHE.popitem(last=False)
+    return data
+
+
+def clear_calib_amp_cache():
+    """Remove all the cached calibration amplifier arrays"""
+    _CALIB_AMP_CACHE.clear()
+
+
 def get_geom_regions(ccd, amp):
     """Get the ccd amp bounding boxes for a particular dataId or file
 
@@ -221,33 +608,237 @@ def get_geom_regions(ccd, amp):
     amp : `int`
         Amplifier index
 
+    Returns
+    -------
+    odict : `MappingProxyType`
+        Read-only dictionary with the bounding boxes
+    """
+    return get_ccd_geometry(ccd).regions[amp]
+
+
+def get_geom_regions_from_file(filepath):
+    """Get the amp bounding boxes for a file without reading the pixel data
+
+    This gives the same regions as `get_geom_regions` does for a `MaskedCCD`,
+    but only uses the FITS headers.
+
+    Parameters
+    ----------
+    filepath : `str`
+        The file we are reading
+
     Returns
     -------
     odict : `dict`
         Dictionary with the bounding boxes
     """
-    if isinstance(ccd, MaskedCCD):
-        geom = ccd.amp_geom
-        o_dict = dict(imaging=geom.imaging,
-                      serial_overscan=geom.serial_overscan,
-                      parallel_overscan=geom.parallel_overscan,
-                      prescan=geom.prescan,
-                      offset=None,
-                      step_x=1,
-                      step_y=1)
-    else:
-        geom = ccd.getDetector()[amp]
-        step_x, step_y = get_geom_steps_from_amp(ccd, amp)
-        o_dict = dict(imaging=geom.getRawDataBBox(),
-                      serial_overscan=geom.getRawHorizontalOverscanBBox(),
-                      parallel_overscan=geom.getRawVerticalOverscanBBox(),
-                      prescan=geom.getRawPrescanBBox(),
-                      offset=geom.getRawXYOffset(),
-                      step_x=step_x,
-                      step_y=step_y)
+    geom = makeAmplifierGeometry(filepath)
+    o_dict = dict(imaging=geom.imaging,
+                  serial_overscan=geom.serial_overscan,
+                  parallel_overscan=geom.parallel_overscan,
+                  prescan=geom.prescan,
+                  offset=None,
+                  step_x=1,
+                  step_y=1)
     return o_dict
 
 
+def read_region_arrays(filepath, regionlist=None, **kwargs):
+    """Read selected regions of the amps in a file without building afw images
+
+    Only the pixels inside the requested bounding boxes are read from the
+    file, using memory-mapped FITS sections.  This is intended for tasks
+    that only need the overscan regions.
+
+    Parameters
+    ----------
+    filepath : `str`
+        The file we are reading
+    regionlist : `list` or `None`
+        Names of the regions to read, `None` for all three readout regions
+
+    Keywords
+    --------
+    regions : `dict` or `None`
+        Bounding boxes for the regions, `None` to get them from the file headers
+    amps : `list` or `None`
+        HDU indices of the amps to read, `None` for all 16
+
+    Returns
+    -------
+    o_dict : `dict`
+        Float arrays keyed by amp, then by region name
+    """
+    regions = kwargs.get('regions', None)
+    amps = kwargs.get('amps', None)
+
+    if regionlist is None:
+        regionlist = ['imaging', 'serial_overscan', 'parallel_overscan']
+    if regions is None:
+        regions = get_geom_regions_from_file(filepath)
+    if amps is None:
+        amps = range(1, 17)
+
+    step_x = regions['step_x']
+    step_y = regions['step_y']
+    slice_dict = {key:bbox_to_slices(regions[key]) for key in regionlist}
+
+    o_dict = {}
+    with fits.open(filepath, memmap=True, lazy_load_hdus=True) as hdus:
+        for amp in amps:
+            section = hdus[amp].section
+            o_dict[amp] = {key:np.asarray(section[slices], dtype=np.float32)[::step_x, ::step_y]
+                           for key, slices in slice_dict.items()}
+    return o_dict
+
+
+class ArrayCCD:
+    """Numpy-only access to the amplifier data in a FITS file
+
+    This is a lightweight alternative to `MaskedCCD` for tasks that only use
+    the pixel arrays.  The amplifier HDUs are memory-mapped and returned as
+    float32 arrays in readout order, so uncompressed float32 files (such as the
+    calibration frames) are accessed without any copies.  No afw images are
+    built, the geometry comes from the FITS headers and the pixel masks
+    are only read if they are requested.
+    """
+    def __init__(self, filepath, mask_files=None):
+        """C'tor
+
+        Parameters
+        ----------
+        filepath : `str`
+            The file we are reading
+        mask_files : `list` or `None`
+            Files used to construct the pixel masks
+        """
+        self.filepath = filepath
+        if mask_files is None:
+            self._mask_files = []
+        else:
+            self._mask_files = list(mask_files)
+        self._hdus = fits.open(filepath, memmap=True, lazy_load_hdus=True)
+        self.md = self._hdus[0].header
+        self._amp_geom = None
+        self._geometry = None
+        self._arrays = {}
+        self._masks = {}
+
+    def __enter__(self):
+        """Context manager entry, returns self"""
+        return self
+
+    def __exit__(self, *args):
+        """Context manager exit, closes the file"""
+        self.close()
+
+    def close(self):
+        """Close the file, arrays already returned remain valid"""
+        self._hdus.close()
+
+    @property
+    def amp_geom(self):
+        """The amplifier geometry, as for `MaskedCCD`"""
+        if self._amp_geom is None:
+            self._amp_geom = makeAmplifierGeometry(self.filepath)
+        return self._amp_geom
+
+    @property
+    def geometry(self):
+        """The shared geometry descriptor"""
+        if self._geometry is None:
+            self._geometry = get_ccd_geometry(self)
+        return self._geometry
+
+    @property
+    def regions(self):
+        """The bounding boxes for the readout regions"""
+        return self.geometry.regions[1]
+
+    @staticmethod
+    def amps():
+        """The HDU indices of the amplifiers"""
+        return range(1, 17)
+
+    def __getitem__(self, amp):
+        """Get the float32 data array for the full amp
+
+        Parameters
+        ----------
+        amp : `int`
+            HDU index
+
+        Returns
+        -------
+        data : `array`
+            The data
+        """
+        data = self._arrays.get(amp, None)
+        if data is None:
+            data = self._hdus[amp].data
+            if data.dtype.kind != 'f' or data.dtype.itemsize != 4:
+                data = data.astype(np.float32)
+            self._arrays[amp] = data
+        return data
+
+    def get_region(self, amp, region):
+        """Get a view of the data in one region of an amp
+
+        Parameters
+        ----------
+        amp : `int`
+            HDU index
+        region : `str`
+            Name of the region, e.g., 'imaging'
+
+        Returns
+        -------
+        data : `array`
+            The data
+        """
+        return self[amp][self.geometry.slices[amp][region]]
+
+    def get_mask(self, amp):
+        """Get the pixel mask for an amp, reading it on first use
+
+        Parameters
+        ----------
+        amp : `int`
+            HDU index
+
+        Returns
+        -------
+        mask : `array`
+            Boolean array, True for masked pixels
+        """
+        mask = self._masks.get(amp, None)
+        if mask is None:
+            if self._mask_files:
+                mask = read_combined_masks(self._mask_files)[amp-1] != 0
+            else:
+                mask = np.zeros(self[amp].shape, bool)
+            self._masks[amp] = mask
+        return mask
+
+    def get_masked_region(self, amp, region):
+        """Get the data in one region of an amp with the pixel mask applied
+
+        Parameters
+        ----------
+        amp : `int`
+            HDU index
+        region : `str`
+            Name of the region, e.g., 'imaging'
+
+        Returns
+        -------
+        data : `MaskedArray`
+            The data, this shares memory with the underlying arrays
+        """
+        mask = self.get_mask(amp)[self.geometry.slices[amp][region]]
+        return np.ma.MaskedArray(self.get_region(amp, region), mask=mask, copy=False)
+
+
 def get_dimension_arrays_from_ccd(ccd):
     """Get the linear arrays with the indices for each direction and readout region
 
@@ -261,30 +852,11 @@ def get_dimension_arrays_from_ccd(ccd):
     odict : `dict`
         Dictionary with the arrays
     """
-
-    if isinstance(ccd, MaskedCCD):
-        geom = ccd.amp_geom
-        nrow_i = geom.imaging.getHeight()
-        nrow_s = geom.serial_overscan.getHeight()
-        nrow_p = geom.parallel_overscan.getHeight()
-        ncol_i = geom.imaging.getWidth()
-        ncol_s = geom.serial_overscan.getWidth()
-        ncol_p = geom.parallel_overscan.getWidth()
-    else:
-        geom = ccd.getDetector()[0]
-        nrow_i = geom.getBBox().getHeight()
-        nrow_s = geom.getRawHorizontalOverscanBBox().getHeight()
-        nrow_p = geom.getRawVerticalOverscanBBox().getHeight()
-        ncol_i = geom.getBBox().getWidth()
-        ncol_s = geom.getRawHorizontalOverscanBBox().getWidth()
-        ncol_p = geom.getRawVerticalOverscanBBox().getWidth()
-
-    o_dict = {'row_i':np.linspace(0, nrow_i-1, nrow_i),
-              'row_s':np.linspace(0, nrow_s-1, nrow_s),
-              'row_p':np.linspace(0, nrow_p-1, nrow_p),
-              'col_i':np.linspace(0, ncol_i-1, ncol_i),
-              'col_s':np.linspace(0, ncol_s-1, ncol_s),
-              'col_p':np.linspace(0, ncol_p-1, ncol_p)}
+    dims = get_ccd_geometry(ccd).dims
+    o_dict = {}
+    for key in ['row_i', 'row_s', 'row_p', 'col_i', 'col_s', 'col_p']:
+        nval = dims['n%s' % key]
+        o_dict[key] = np.linspace(0, nval-1, nval)
     return o_dict
 
 
@@ -535,6 +1107,178 @@ def unbias_amp(img, serial_oscan, bias_type=None, superbias_im=None, region=None
 
     return image
 
+def bias_model_stack(oscan_stack, bias_type, nrow=None, **kwargs):
+    """Compute the row-by-row serial overscan bias model for a stack of amps
+
+    This reproduces the 'mean', 'row', 'func' and 'spline' methods
+    of `lsst.eotest.image_utils.bias_image`, but for all the amps at once.
+
+    Parameters
+    ----------
+    oscan_stack : `array`
+        (namp, ny, nx) array with the serial overscan data
+    bias_type : `str`
+        Method used to model the bias
+    nrow : `int` or `None`
+        Number of rows in the model, `None` to use the overscan height
+
+    Keywords
+    --------
+    dxmin : `int`
+        Number of overscan columns to skip at the start of each row
+    dxmax : `int`
+        Number of overscan columns to skip at the end of each row
+    deg : `int`
+        Polynomial degree for 'func'
+    k, s, t
+        Passed to `scipy.interpolate.splrep` for 'spline'
+
+    Returns
+    -------
+    model : `array`
+        (namp, nrow) array with the bias for each row of each amp
+
+    Raises
+    ------
+    ValueError : If the bias_type is not known.
+    """
+    dxmin = kwargs.get('dxmin', 5)
+    dxmax = kwargs.get('dxmax', 2)
+
+    namp, ny_o, nx_o = oscan_stack.shape
+    if nrow is None:
+        nrow = ny_o
+
+    if bias_type == 'mean':
+        values = np.nanmean(oscan_stack.reshape(namp, -1), 1, dtype=np.float64)
+        return np.repeat(values[:, np.newaxis], nrow, 1)
+
+    values = oscan_stack[:, :, dxmin:-dxmax].mean(2)
+    if bias_type == 'row':
+        return values[:, 0:nrow]
+
+    rows = np.arange(ny_o)
+    xvals = np.arange(nrow)
+    if bias_type == 'func':
+        coeffs = np.polyfit(rows, values.T, kwargs.get('deg', 1))
+        model = np.zeros((namp, nrow))
+        for coeff in coeffs:
+            model *= xvals
+            model += coeff[:, np.newaxis]
+        return model
+
+    if bias_type == 'spline':
+        # 7 ADU is the expected read noise per pixel
+        weights = np.ones(ny_o) * (7. / np.sqrt(nx_o))
+        model = np.zeros((namp, nrow))
+        for i, amp_values in enumerate(values):
+            tck = interpolate.splrep(rows, amp_values, w=1/weights,
+                                     k=kwargs.get('k', 3),
+                                     s=kwargs.get('s', 18000),
+                                     t=kwargs.get('t', None))
+            model[i] = interpolate.splev(xvals, tck)
+        return model
+
+    raise ValueError("Unknown bias type %s, options are %s" % (bias_type, BATCH_BIAS_TYPES))
+
+
+def unbias_array_stack(stack, serial_oscan, bias_type, **kwargs):
+    """Subtract the serial overscan bias from a stack of amp arrays in place
+
+    Parameters
+    ----------
+    stack : `array`
+        (namp, ny, nx) array with the raw amp data, in readout order
+    serial_oscan : `Box2I`
+        Serial overscan bounding box, the same for all the amps
+    bias_type : `str`
+        Method used to model the bias
+
+    Keywords
+    --------
+    superbias_stack : `array` or `None`
+        (namp, ny, nx) array with the superbias to subtract off
+    Other keywords are passed to `bias_model_stack`
+
+    Returns
+    -------
+    stack : `array`
+        The input stack, now unbiased
+    """
+    superbias_stack = kwargs.get('superbias_stack', None)
+    oscan_stack = stack[(slice(None),) + bbox_to_slices(serial_oscan)]
+    model = bias_model_stack(oscan_stack, bias_type, stack.shape[1], **kwargs)
+    stack -= model[:, :, np.newaxis].astype(stack.dtype)
+    if superbias_stack is not None:
+        stack -= superbias_stack
+    return stack
+
+
+def unbias_amp_images(images, regions, **kwargs):
+    """Unbias the images for a set of amps
+
+    The serial overscan bias model is computed for all the amps at once
+    with `bias_model_stack` and subtracted in place.  Column-wise
+    corrections and unknown methods fall back to `unbias_amp`.
+
+    Parameters
+    ----------
+    images : `list`
+        The `ImageF` or `MaskedImageF` objects for the amps
+    regions : `list`
+        The bounding boxes for each amp, as returned by `get_geom_regions`
+
+    Keywords
+    --------
+    bias_type : `str` or `None`
+        Method of unbiasing to apply
+    bias_type_col : `str` or `None`
+        Method of unbiasing to apply with the parallel overscan
+    superbias_ims : `list` or `None`
+        Superbias images to subtract off, one per amp
+    trim : `str` or `None`
+        Region to trim return images to
+
+    Returns
+    -------
+    o_list : `list`
+        The unbiased images
+    """
+    bias_type = kwargs.get('bias_type', None)
+    bias_type_col = kwargs.get('bias_type_col', None)
+    superbias_ims = kwargs.get('superbias_ims', None)
+    trim = kwargs.get('trim', None)
+
+    if superbias_ims is None:
+        superbias_ims = [None]*len(images)
+
+    if bias_type in BATCH_BIAS_TYPES and bias_type_col is None and images:
+        try:
+            arrays = [image.getImage().getArray() for image in images]
+            oscans = [image[region['serial_overscan']].getImage().getArray()
+                      for image, region in zip(images, regions)]
+        except AttributeError:
+            arrays = [image.getArray() for image in images]
+            oscans = [image[region['serial_overscan']].getArray()
+                      for image, region in zip(images, regions)]
+        model = bias_model_stack(np.stack(oscans), bias_type, arrays[0].shape[0])
+        for array, row_model in zip(arrays, model.astype(arrays[0].dtype)):
+            array -= row_model[:, np.newaxis]
+        bias_type = None
+
+    o_list = []
+    for image, region, superbias_im in zip(images, regions, superbias_ims):
+        if trim is None:
+            trim_region = None
+        else:
+            trim_region = region[trim]
+        o_list.append(unbias_amp(image, region['serial_overscan'], bias_type=bias_type,
+                                 superbias_im=superbias_im, region=trim_region,
+                                 bias_type_col=bias_type_col,
+                                 parallel_oscan=region['parallel_overscan']))
+    return o_list
+
+
 def raw_amp_image(ccd, amp):
     """Get the image for a particular amp
 
@@ -559,6 +1303,217 @@ def raw_amp_image(ccd, amp):
     return image
 
 
+class PreparedSuperbias:
+    """Superbias images for each amp, oriented to match the data they are subtracted from
+
+    The amp images are extracted, and flipped if needed, the first time
+    they are requested and then reused for every file the superbias is
+    applied to.  The underlying superbias frame is never modified.
+    """
+    def __init__(self, superbias_frame):
+        """C'tor
+
+        Parameters
+        ----------
+        superbias_frame : `MaskedCCD`
+            The superbias frame
+        """
+        self.frame = superbias_frame
+        self._amp_images = {}
+
+    def get_amp_image(self, ccd, amp):
+        """Get the superbias image for one amp of a CCD
+
+        Parameters
+        ----------
+        ccd : `ExposureF` or `MaskedCCD`
+            The CCD data object the superbias will be subtracted from
+        amp : `int`
+            Amplifier index, as used by ccd
+
+        Returns
+        -------
+        superbias_im : `MaskedImageF`
+            The superbias image
+        """
+        sb_amp = amp + get_amp_offset(ccd, self.frame)
+        flip = not isinstance(ccd, MaskedCCD)
+        key = (sb_amp, flip)
+        superbias_im = self._amp_images.get(key, None)
+        if superbias_im is None:
+            superbias_im = raw_amp_image(self.frame, sb_amp)
+            if flip:
+                (step_x, step_y) = get_geom_steps_from_amp(self.frame, sb_amp)
+                flipped = superbias_im.Factory(superbias_im, True)
+                flipped.image.array[:] = superbias_im.image.array[::step_x, ::step_y]
+                flipped.mask.array[:] = superbias_im.mask.array[::step_x, ::step_y]
+                superbias_im = flipped
+            self._amp_images[key] = superbias_im
+        return superbias_im
+
+    def get_amp_images(self, ccd, amps):
+        """Get the superbias images for a list of amps of a CCD
+
+        Parameters
+        ----------
+        ccd : `ExposureF` or `MaskedCCD`
+            The CCD data object the superbias will be subtracted from
+        amps : `list`
+            Amplifier indices, as used by ccd
+
+        Returns
+        -------
+        o_list : `list`
+            The superbias images
+        """
+        return [self.get_amp_image(ccd, amp) for amp in amps]
+
+
+def prepare_superbias(superbias_frame):
+    """Wrap a superbias frame in a `PreparedSuperbias`
+
+    Parameters
+    ----------
+    superbias_frame : `MaskedCCD`, `PreparedSuperbias` or `None`
+        The superbias frame
+
+    Returns
+    -------
+    superbias : `PreparedSuperbias` or `None`
+        The prepared superbias, `None` if there is no superbias frame
+    """
+    if superbias_frame is None or isinstance(superbias_frame, PreparedSuperbias):
+        return superbias_frame
+    return PreparedSuperbias(superbias_frame)
+
+
+class NonlinearityLUT:
+    """Nonlinearity correction applied with per-amp lookup tables
+
+    The wrapped correction is evaluated once per amp on a uniform grid of ADU
+    values, and then applied to data arrays by linear interpolation in that
+    table.  Pixels outside the table range are corrected directly.
+    """
+    def __init__(self, nlc, **kwargs):
+        """C'tor
+
+        Parameters
+        ----------
+        nlc : `NonlinearityCorrection`
+            The correction, called as nlc(amp, data)
+
+        Keywords
+        --------
+        xmin : `float`
+            Lowest ADU value in the tables
+        xmax : `float`
+            Highest ADU value in the tables
+        step : `float`
+            Spacing of the tables in ADU
+        """
+        self.nlc = nlc
+        self._xmin = kwargs.get('xmin', NONLIN_LUT_XMIN)
+        self._step = kwargs.get('step', NONLIN_LUT_STEP)
+        self._xvals = np.arange(self._xmin, kwargs.get('xmax', NONLIN_LUT_XMAX) + self._step,
+                                self._step)
+        self._tables = {}
+
+    def get_table(self, amp):
+        """Get the lookup table for one amp, computing it on first use
+
+        Parameters
+        ----------
+        amp : `int`
+            Amplifier index, as passed to the correction
+
+        Returns
+        -------
+        values : `array`
+            The corrected values at each of the grid points
+        slopes : `array`
+            The differences between successive grid points
+        """
+        table = self._tables.get(amp, None)
+        if table is None:
+            values = np.asarray(self.nlc(amp, self._xvals), dtype=float)
+            table = (values, np.diff(values))
+            self._tables[amp] = table
+        return table
+
+    def apply(self, amp, data):
+        """Apply the correction to an array in place
+
+        Parameters
+        ----------
+        amp : `int`
+            Amplifier index, as passed to the correction
+        data : `array`
+            The data
+
+        Returns
+        -------
+        data : `array`
+            The input array, now corrected
+        """
+        values, slopes = self.get_table(amp)
+        out_of_range = (data < self._xvals[0]) | (data > self._xvals[-1])
+        if out_of_range.any():
+            outliers = self.nlc(amp, data[out_of_range])
+        else:
+            outliers = None
+
+        # Position of each pixel in the table, split into index and fraction
+        pos = data.astype(float)
+        pos -= self._xmin
+        pos /= self._step
+        idx = pos.astype(np.intp)
+        np.clip(idx, 0, len(slopes) - 1, out=idx)
+        pos -= idx
+
+        corrected = slopes[idx]
+        corrected *= pos
+        corrected += values[idx]
+        data[:] = corrected
+        if outliers is not None:
+            data[out_of_range] = outliers
+        return data
+
+    def __call__(self, amp, data):
+        """Return a corrected copy of an array
+
+        Parameters
+        ----------
+        amp : `int`
+            Amplifier index, as passed to the correction
+        data : `array`
+            The data
+
+        Returns
+        -------
+        corrected : `array`
+            The corrected data
+        """
+        return self.apply(amp, np.array(data))
+
+
+def prepare_nonlinearity(nlc):
+    """Wrap a nonlinearity correction in a `NonlinearityLUT`
+
+    Parameters
+    ----------
+    nlc : `NonlinearityCorrection`, `NonlinearityLUT` or `None`
+        The correction
+
+    Returns
+    -------
+    nlc_lut : `NonlinearityLUT` or `None`
+        The tabulated correction, `None` if there is no correction
+    """
+    if nlc is None or isinstance(nlc, NonlinearityLUT):
+        return nlc
+    return NonlinearityLUT(nlc)
+
+
 def unbiased_ccd_image_dict(ccd, **kwargs):
     """Get the images keys by amp for a ccd
 
@@ -571,11 +1526,11 @@ def unbiased_ccd_image_dict(ccd, **kwargs):
     --------
     bias : `str` or `None`
         Method for bias subtraction
-    superbias_frame : `MaskedCCD` or `None`
+    superbias_frame : `MaskedCCD`, `PreparedSuperbias` or `None`
         Bias frame to subtract off
     trim : `str` or `None`
         Region to trim return images to
-    nonlinearity : `NonlinearityCorrection` or `None`
+    nonlinearity : `NonlinearityCorrection`, `NonlinearityLUT` or `None`
         Object that applies the nonlinearity correction
 
     Returns
@@ -587,40 +1542,27 @@ def unbiased_ccd_image_dict(ccd, **kwargs):
     bias_type = kwcopy.pop('bias', None)
     bias_type_col = kwcopy.pop('bias_col', None)
         
-    superbias_frame = kwcopy.pop('superbias_frame', None)
+    superbias = prepare_superbias(kwcopy.pop('superbias_frame', None))
     trim = kwcopy.pop('trim', None)
-    nlc = kwcopy.pop('nonlinearity', None)
+    nlc = prepare_nonlinearity(kwcopy.pop('nonlinearity', None))
 
     amps = get_amp_list(ccd)
 
-    is_masked_ccd = isinstance(ccd, MaskedCCD)
-
-    o_dict = {}
-    offset = get_amp_offset(ccd, superbias_frame)
-
-    for amp in amps:
-        regions = get_geom_regions(ccd, amp)
-        serial_oscan = regions['serial_overscan']
-        parallel_oscan = regions['parallel_overscan']
-        if trim is None:
-            trim_region = None
-        else:
-            trim_region = regions[trim]
-
-        img = get_raw_image(ccd, amp)
+    images = [get_raw_image(ccd, amp) for amp in amps]
+    regions = [get_geom_regions(ccd, amp) for amp in amps]
+    if superbias is None:
+        superbias_ims = None
+    else:
+        superbias_ims = superbias.get_amp_images(ccd, amps)
 
-        superbias_im = raw_amp_image(superbias_frame, amp + offset)
-        if not is_masked_ccd and superbias_frame is not None:
-            # Flip the superbias image for the subtraction
-            (step_x, step_y) = get_geom_steps_from_amp(superbias_frame, amp + offset)
-            superbias_im.mask.array = superbias_im.mask.array[::step_x, ::step_y]
-            superbias_im.image.array = superbias_im.image.array[::step_x, ::step_y]
+    unbiased = unbias_amp_images(images, regions, bias_type=bias_type,
+                                 bias_type_col=bias_type_col,
+                                 superbias_ims=superbias_ims, trim=trim)
 
-        image = unbias_amp(img, serial_oscan, bias_type=bias_type,
-                           superbias_im=superbias_im, region=trim_region,
-                           bias_type_col=bias_type_col, parallel_oscan=parallel_oscan)
+    o_dict = {}
+    for amp, image in zip(amps, unbiased):
         if nlc is not None:
-            image.getImage().array[:] = nlc(amp, image.getImage().array)
+            nlc.apply(amp, image.getImage().array)
         o_dict[amp] = image
 
     return o_dict
@@ -764,9 +1706,7 @@ def get_exposure_time(ccd):
 
     Parameters
     ----------
-    butler : `Butler` or `None`
-        Data Butler (or none)
-    ccd : `ImageF` or `MaskedImageF`
+    ccd : `ExposureF` or `MaskedCCD` or `ArrayCCD`
         CCD image object
 
     Returns
@@ -776,6 +1716,8 @@ def get_exposure_time(ccd):
     """
     if isinstance(ccd, MaskedCCD):
         return ccd.md.md.get('EXPTIME')
+    if isinstance(ccd, ArrayCCD):
+        return ccd.md.get('EXPTIME')
     return ccd.getInfo().getVisitInfo().getExposureTime()
 
 
@@ -926,6 +1868,54 @@ def get_mono_slit_b(ccd):
     return ccd.getMetadata()['MONOCH-SLIT_B']
 
 
+def unbiased_stack_inputs(ccd, **kwargs):
+    """Unbias the amps of one CCD before stacking
+
+    Parameters
+    ----------
+    ccd : `MaskedCCD` or `ExposureF`
+        The input data
+
+    Keywords
+    --------
+    bias_type : `str`
+        Unbiasing method to use
+    bias_type_col : `str` or `None`
+        Column unbiasing method to use
+    superbias : `PreparedSuperbias` or `None`
+        Bias image to subtract
+    gains : `list` or `None`
+        Gains to apply to each amp
+    nlc : `NonlinearityCorrection`, `NonlinearityLUT` or `None`
+        Object that applies the nonlinearity correction
+
+    Returns
+    -------
+    o_list : `list`
+        (amp, unbiased `MaskedImageF`) pairs
+    """
+    superbias = kwargs.get('superbias', None)
+    gains = kwargs.get('gains', None)
+    nlc = kwargs.get('nlc', None)
+
+    amps = get_amp_list(ccd)
+    if superbias is None:
+        superbias_ims = None
+    else:
+        superbias_ims = superbias.get_amp_images(ccd, amps)
+    unbiased_list = unbias_amp_images([get_raw_image(ccd, amp) for amp in amps],
+                                      [get_geom_regions(ccd, amp) for amp in amps],
+                                      bias_type=kwargs.get('bias_type', 'spline'),
+                                      bias_type_col=kwargs.get('bias_type_col', None),
+                                      superbias_ims=superbias_ims)
+    for iamp, (amp, unbiased) in enumerate(zip(amps, unbiased_list)):
+        if gains is not None:
+            unbiased.image.array *= gains[iamp]
+        if nlc is not None:
+            nlc.apply(amp, unbiased.image.array)
+    return list(zip(amps, unbiased_list))
+
+
 def stack_images(butler, in_files, statistic=afwMath.MEDIAN, **kwargs):
     """Stack a set of images
 
@@ -942,26 +1932,27 @@ def stack_images(butler, in_files, statistic=afwMath.MEDIAN, **kwargs):
     --------
     bias_type : `str`
         Unbiasing method to use
-    superbias_frame : `MaskedCCD` or `None`
+    superbias_frame : `MaskedCCD`, `PreparedSuperbias` or `None`
         Bias image to subtract
     log : `log`
         Logging stream
+    nlc : `NonlinearityCorrection`, `NonlinearityLUT` or `None`
+        Object that applies the nonlinearity correction
 
     Returns
     -------
     out_dict : `dict`
         Mapping amplifier index to stacked image
     """
-
-    bias_type = kwargs.get('bias_type', 'spline')
-    bias_type_col = kwargs.get('bias_type_col', None)
-    superbias_frame = kwargs.get('superbias_frame', None)
     log = kwargs.get('log', None)
-    gains = kwargs.get('gains', None)
-    nlc = kwargs.get('nlc', None)
     stat_ctrl = kwargs.get('stat_ctrl', None)
     if stat_ctrl is None:
         stat_ctrl = afwMath.StatisticsControl()
+    unbias_kwargs = dict(bias_type=kwargs.get('bias_type', 'spline'),
+                         bias_type_col=kwargs.get('bias_type_col', None),
+                         superbias=prepare_superbias(kwargs.get('superbias_frame', None)),
+                         gains=kwargs.get('gains', None),
+                         nlc=prepare_nonlinearity(kwargs.get('nlc', None)))
 
     amp_stack_dict = {}
     out_dict = {}
@@ -983,29 +1974,9 @@ def stack_images(butler, in_files, statistic=afwMath.MEDIAN, **kwargs):
 
         used_files += 1
         exp_time += get_exposure_time(ccd)
-        amps = get_amp_list(ccd)
 
-        offset = get_amp_offset(ccd, superbias_frame)
-        for iamp, amp in enumerate(amps):
-            regions = get_geom_regions(ccd, amp)
-            serial_oscan = regions['serial_overscan']
-            parallel_oscan = regions['parallel_overscan']
-            img = get_raw_image(ccd, amp)
-            superbias_im = raw_amp_image(superbias_frame, amp + offset)
-            unbiased = unbias_amp(img, serial_oscan,
-                                  bias_type=bias_type,
-                                  superbias_im=superbias_im,
-                                  bias_type_col=bias_type_col,
-                                  parallel_oscan=parallel_oscan)
-            if gains is not None:
-                unbiased.image.array *= gains[iamp]
-            if nlc is not None:
-                unbiased.image.array = nlc(unbiased.image.array)
-
-            if ifile == 0:
-                amp_stack_dict[amp] = [unbiased]
-            else:
-                amp_stack_dict[amp].append(unbiased)
+        for amp, unbiased in unbiased_stack_inputs(ccd, **unbias_kwargs):
+            amp_stack_dict.setdefault(amp, []).append(unbiased)
 
     if used_files:
         exp_time /= float(used_files)
@@ -1028,6 +1999,386 @@ def stack_images(butler, in_files, statistic=afwMath.MEDIAN, **kwargs):
     return out_dict
 
 
+class StackAccumulator:
+    """Running statistics of a stack of images, that can be saved and updated
+
+    This keeps per-pixel sums, sums of squares and the number of frames,
+    which give the mean and variance of the stack exactly,
+    and a bounded reservoir of frames (Vitter's algorithm R),
+    which is used for the median and clipped mean.
+    These are exact as long as no more than nsample frames have been added,
+    and otherwise come from a uniform random subset of nsample frames.
+
+    Attributes
+    ----------
+    nsample : `int`
+        Maximum number of frames kept in the reservoir
+    nframes : `int`
+        Number of frames added
+    exptime_sum : `float`
+        Sum of the exposure times of the frames
+    file_keys : `list`
+        Strings identifying the input files that were added
+    sums : `dict`
+        Per-pixel sums, keyed by amp
+    sumsqs : `dict`
+        Per-pixel sums of squares, keyed by amp
+    samples : `dict`
+        (nsample, ny, nx) reservoirs of frames, keyed by amp
+    """
+
+    def __init__(self, nsample=11):
+        """C'tor
+
+        Parameters
+        ----------
+        nsample : `int`
+            Maximum number of frames kept in the reservoir
+        """
+        self.nsample = nsample
+        self.nframes = 0
+        self.exptime_sum = 0.
+        self.file_keys = []
+        self.sums = {}
+        self.sumsqs = {}
+        self.samples = {}
+
+    def add(self, amp_arrays, exptime=0., file_key=None):
+        """Add a frame
+
+        Parameters
+        ----------
+        amp_arrays : `dict`
+            The data for each amp of the frame, keyed by amp
+        exptime : `float`
+            Exposure time of the frame
+        file_key : `str` or `None`
+            Identifies the input file
+        """
+        # Algorithm R, seeded by the frame count so that updates are reproducible
+        if self.nframes < self.nsample:
+            isample = self.nframes
+        else:
+            isample = np.random.default_rng(self.nframes).integers(0, self.nframes + 1)
+        for amp, data in amp_arrays.items():
+            if amp not in self.sums:
+                self.sums[amp] = np.zeros(data.shape)
+                self.sumsqs[amp] = np.zeros(data.shape)
+                self.samples[amp] = np.zeros((self.nsample,) + data.shape, np.float32)
+            self.sums[amp] += data
+            self.sumsqs[amp] += np.square(data, dtype=float)
+            if isample < self.nsample:
+                self.samples[amp][isample] = data
+        self.nframes += 1
+        self.exptime_sum += exptime
+        if file_key is not None:
+            self.file_keys.append(file_key)
+
+    def amps(self):
+        """Return the amps with data"""
+        return sorted(self.sums.keys())
+
+    def stack_array(self, amp, stat_type='median', nsigma_clip=3.):
+        """Get the stacked data for one amp
+
+        Parameters
+        ----------
+        amp : `int`
+            The amp
+        stat_type : `str`
+            Statistic: 'mean', 'median', 'meanclip', 'stdev' or 'variance'
+        nsigma_clip : `float`
+            Clipping used for 'meanclip'
+
+        Returns
+        -------
+        stack : `array`
+            The stacked data
+
+        Raises
+        ------
+        ValueError : If the statistic is not supported
+        """
+        stat_type = stat_type.lower()
+        mean = self.sums[amp] / self.nframes
+        if stat_type == 'mean':
+            return mean
+        if stat_type in ['stdev', 'variance']:
+            var = (self.sumsqs[amp] / self.nframes - mean*mean).clip(0., None)
+            var *= self.nframes / max(self.nframes - 1, 1)
+            return np.sqrt(var) if stat_type == 'stdev' else var
+        samples = self.samples[amp][0:min(self.nframes, self.nsample)]
+        median = np.median(samples, axis=0)
+        if stat_type == 'median':
+            return median
+        if stat_type == 'meanclip':
+            sigma = 1.4826 * np.median(np.fabs(samples - median), axis=0)
+            masked = np.ma.masked_array(samples, np.fabs(samples - median) > nsigma_clip*sigma)
+            return np.ma.mean(masked, axis=0).filled(np.nan)
+        raise ValueError("Can not stack with statistic %s" % stat_type)
+
+    def stack(self, stat_type='median', **kwargs):
+        """Get the stacked images for all the amps
+
+        Parameters
+        ----------
+        stat_type : `str`
+            Statistic: 'mean', 'median', 'meanclip', 'stdev' or 'variance'
+
+        Keywords
+        --------
+        nsigma_clip : `float`
+            Clipping used for 'meanclip'
+
+        Returns
+        -------
+        out_dict : `dict`
+            Mapping amp to stacked `ImageF`, with 'METADATA', as from `stack_images`
+        """
+        out_dict = dict(METADATA=dict(EXPTIME=self.exptime_sum / max(self.nframes, 1),
+                                      NFRAMES=self.nframes))
+        for amp in self.amps():
+            stack = self.stack_array(amp, stat_type, kwargs.get('nsigma_clip', 3.))
+            out_dict[amp] = afwImage.ImageF(stack.astype(np.float32))
+        return out_dict
+
+    def save(self, filepath):
+        """Write the running statistics to a FITS file
+
+        Parameters
+        ----------
+        filepath : `str`
+            The file to write
+        """
+        primary = fits.PrimaryHDU()
+        primary.header['NSAMPLE'] = self.nsample
+        primary.header['NFRAMES'] = self.nframes
+        primary.header['EXPTSUM'] = self.exptime_sum
+        hdus = [primary]
+        for amp in self.amps():
+            hdus.append(fits.ImageHDU(self.sums[amp], name='SUM%02i' % amp))
+            hdus.append(fits.ImageHDU(self.sumsqs[amp], name='SUMSQ%02i' % amp))
+            hdus.append(fits.ImageHDU(self.samples[amp], name='SAMPLE%02i' % amp))
+        hdus.append(fits.BinTableHDU.from_columns([fits.Column('filename', 'A256',
+                                                               array=self.file_keys)],
+                                                  name='FILES'))
+        fits.HDUList(hdus).writeto(filepath, overwrite=True)
+
+    @classmethod
+    def load(cls, filepath):
+        """Read back running statistics written by `save`
+
+        Parameters
+        ----------
+        filepath : `str`
+            The file to read
+
+        Returns
+        -------
+        accum : `StackAccumulator`
+            The running statistics
+        """
+        with fits.open(filepath) as hdulist:
+            header = hdulist[0].header
+            accum = cls(header['NSAMPLE'])
+            accum.nframes = header['NFRAMES']
+            accum.exptime_sum = header['EXPTSUM']
+            for hdu in hdulist[1:]:
+                if hdu.name.startswith('SUMSQ'):
+                    accum.sumsqs[int(hdu.name[5:])] = hdu.data.astype(float)
+                elif hdu.name.startswith('SUM'):
+                    accum.sums[int(hdu.name[3:])] = hdu.data.astype(float)
+                elif hdu.name.startswith('SAMPLE'):
+                    accum.samples[int(hdu.name[6:])] = hdu.data.astype(np.float32)
+            accum.file_keys = [key.strip() for key in hdulist['FILES'].data['filename']]
+        return accum
+
+
+def add_unbiased_frame(accum, butler, in_file, file_key, **kwargs):
+    """Unbias one image and add it to running statistics
+
+    Parameters
+    ----------
+    accum : `StackAccumulator`
+        The running statistics
+    butler : `Butler` or `None`
+        Data Butler (or none)
+    in_file : `str` or `dict`
+        The data_id or filename
+    file_key : `str`
+        String identifying the input file
+
+    Keywords
+    --------
+    log : `log`
+        Logging stream
+    Other keywords are passed to `unbiased_stack_inputs`
+
+    Returns
+    -------
+    added : `bool`
+        False if the file could not be read
+    """
+    kwcopy = kwargs.copy()
+    log = kwcopy.pop('log', None)
+    try:
+        ccd = get_ccd_from_id(butler, in_file, mask_files=[])
+    except Exception:
+        if log is not None:
+            log.warn("  Failed to read %s, skipping" % (str(in_file)))
+        return False
+
+    offset = 0 if butler is None else 1
+    amp_arrays = {amp + offset: unbiased.image.array
+                  for amp, unbiased in unbiased_stack_inputs(ccd, **kwcopy)}
+    accum.add(amp_arrays, get_exposure_time(ccd), file_key)
+    return True
+
+
+def accumulate_images(accum, butler, in_files, **kwargs):
+    """Unbias a set of images and add them to running statistics
+
+    Files that were already added, according to accum.file_keys, are skipped.
+
+    Parameters
+    ----------
+    accum : `StackAccumulator`
+        The running statistics
+    butler : `Butler` or `None`
+        Data Butler (or none)
+    in_files : `list`
+        Data to add, either data_ids or filenames
+
+    Keywords
+    --------
+    file_keys : `list`
+        Strings identifying the input files
+    log : `log`
+        Logging stream
+    Other keywords are the same as for `stack_images`
+
+    Returns
+    -------
+    nadded : `int`
+        The number of frames added
+    """
+    file_keys = kwargs.get('file_keys', [str(in_file) for in_file in in_files])
+    unbias_kwargs = dict(bias_type=kwargs.get('bias_type', 'spline'),
+                         bias_type_col=kwargs.get('bias_type_col', None),
+                         superbias=prepare_superbias(kwargs.get('superbias_frame', None)),
+                         gains=kwargs.get('gains', None),
+                         nlc=prepare_nonlinearity(kwargs.get('nlc', None)),
+                         log=kwargs.get('log', None))
+    done_keys = set(accum.file_keys)
+
+    nadded = 0
+    for in_file, file_key in zip(in_files, file_keys):
+        if file_key in done_keys:
+            continue
+        nadded += add_unbiased_frame(accum, butler, in_file, file_key, **unbias_kwargs)
+    return nadded
+
+
+def stack_sflats(butler, sflat_files, statistic=afwMath.MEDIAN, **kwargs):
+    """Make the low, high and ratio superflats, reading each file once
+
+    The files are first classified with `classify_sflat`, which does not
+    read the pixel data, then the low and the high exposure files are
+    read, once each, and stacked one class after the other.  The stacks use
+    all the frames and the same statistics as `stack_images`.
+
+    Parameters
+    ----------
+    butler : `Butler` or `None`
+        Data Butler (or none)
+    sflat_files : `list`
+        Superflat data_ids or filenames
+    statistic : `int`
+        Statisitic used to stack the images
+
+    Keywords
+    --------
+    exptime_cut : `float`
+        Cut between low and high exposures
+    stat_ctrl : `afwMath.StatisticsControl` or `None`
+        Controls the stacking statistic
+    log : `log`
+        Logging stream
+    Other keywords are the same as for `stack_images`
+
+    Returns
+    -------
+    sflat_l : `dict`
+        Dictionary keyed by amp of the low exposure superflats
+    sflat_h : `dict`
+        Dictionary keyed by amp of the high exposure superflats
+    ratio_images : `dict`
+        Dictionary keyed by amp of the low/high ratio images
+        None is returned if there are no low or no high exposure frames
+    """
+    exptime_cut = kwargs.get('exptime_cut', 20.)
+    log = kwargs.get('log', None)
+    stat_ctrl = kwargs.get('stat_ctrl', None)
+    if stat_ctrl is None:
+        stat_ctrl = afwMath.StatisticsControl()
+    unbias_kwargs = dict(bias_type=kwargs.get('bias_type', 'spline'),
+                         bias_type_col=kwargs.get('bias_type_col', None),
+                         superbias=prepare_superbias(kwargs.get('superbias_frame', None)),
+                         gains=kwargs.get('gains', None),
+                         nlc=prepare_nonlinearity(kwargs.get('nlc', None)))
+
+    sflat_types = [classify_sflat(butler, sflat, exptime_cut) for sflat in sflat_files]
+    type_files = {sflat_type: [sflat for sflat, ftype in zip(sflat_files, sflat_types)
+                               if ftype == sflat_type] for sflat_type in ['l', 'h']}
+    for sflat_type, files in type_files.items():
+        if not files:
+            if log is not None:
+                log.warn("No %s superflat frames" % sflat_type)
+            return None
+
+    # Only the unbiased images of one exposure class are held at a time
+    offset = 0 if butler is None else 1
+    sflats = {}
+    for sflat_type, files in type_files.items():
+        amp_stack_dict = {}
+        exp_times = []
+        for ifile, sflat in enumerate(files):
+            if ifile % 10 == 0:
+                if log is not None:
+                    log.info("  %s %i" % (sflat_type, ifile))
+            try:
+                ccd = get_ccd_from_id(butler, sflat, mask_files=[])
+            except Exception:
+                if log is not None:
+                    log.warn("  Failed to read %s, skipping" % (str(sflat)))
+                continue
+
+            exp_times.append(get_exposure_time(ccd))
+            for amp, unbiased in unbiased_stack_inputs(ccd, **unbias_kwargs):
+                amp_stack_dict.setdefault(amp, []).append(unbiased)
+
+        if not exp_times:
+            if log is not None:
+                log.warn("No %s superflat frames could be read" % sflat_type)
+            return None
+
+        sflats[sflat_type] = dict(METADATA=dict(EXPTIME=sum(exp_times) / float(len(exp_times))))
+        for amp, val in amp_stack_dict.items():
+            stackimage = imutil.stack(val, statistic, stat_ctrl=stat_ctrl)
+            sflats[sflat_type][amp + offset] = stackimage.image
+
+    ratio_images = {}
+    for amp, im_l in sflats['l'].items():
+        if amp == 'METADATA':
+            continue
+        ratio_images[amp] = afwImage.ImageF(im_l.array / sflats['h'][amp].array)
+
+    if log is not None:
+        log.info("Done!")
+
+    return (sflats['l'], sflats['h'], ratio_images)
+
+
 def read_masks(maskfile):
     """Read masks for all amplifiers from a file
 
@@ -1048,6 +2399,54 @@ def read_masks(maskfile):
     return mask_list
 
 
+def read_combined_masks(maskfiles):
+    """Read the masks for all amplifiers from a set of files and OR them together
+
+    The combined mask planes are cached, keyed by the file names and
+    modification times, so a set of mask files is only read once
+    for all the exposures it is applied to.
+
+    Parameters
+    ----------
+    maskfiles : `list`
+        The files we are reading
+
+    Returns
+    -------
+    mask_arrays : `list`
+        The combined mask arrays, one per amplifier, these are read-only
+    """
+    key = tuple([(os.path.abspath(mfile), os.path.getmtime(mfile)) for mfile in maskfiles])
+    mask_arrays = _MASK_CACHE.get(key, None)
+    if mask_arrays is not None:
+        _MASK_CACHE.move_to_end(key)
+        return mask_arrays
+
+    mask_arrays = None
+    for mfile in maskfiles:
+        mask_list = read_masks(mfile)
+        if mask_arrays is None:
+            mask_arrays = [mask.array.copy() for mask in mask_list]
+        else:
+            for mask_array, mask in zip(mask_arrays, mask_list):
+                mask_array |= mask.array
+
+    if mask_arrays is None:
+        mask_arrays = []
+    for mask_array in mask_arrays:
+        mask_array.setflags(write=False)
+
+    _MASK_CACHE[key] = mask_arrays
+    while len(_MASK_CACHE) > MASK_CACHE_SIZE:
+        _MASK_CACHE.popitem(last=False)
+    return mask_arrays
+
+
+def clear_mask_cache():
+    """Remove all the cached combined mask planes"""
+    _MASK_CACHE.clear()
+
+
 def apply_masks(butler, ccd, maskfiles):
     """Apply a set of masks to an image (this is done in place)
 
@@ -1060,16 +2459,50 @@ def apply_masks(butler, ccd, maskfiles):
     maskfiles : `list`
         Files with the masks we are applying
     """
-    if butler is None:
+    if butler is None or not maskfiles:
         return
     geom = ccd.getDetector()
-    for mfile in maskfiles:
-        mask_list = read_masks(mfile)
-        for amp, mask in enumerate(mask_list):
-            (step_x, step_y) = get_geom_steps_from_amp(ccd, amp)
-            ccd.mask[geom[amp].getRawBBox()].array = mask.array[::step_x, ::step_y]
+    for amp, mask_array in enumerate(read_combined_masks(maskfiles)):
+        (step_x, step_y) = get_geom_steps_from_amp(ccd, amp)
+        ccd.mask[geom[amp].getRawBBox()].array |= mask_array[::step_x, ::step_y]
+
 
 
+def classify_sflat(butler, sflat, exptime_cut=20.):
+    """Classify a superflat image as a low or high exposure
+
+    This uses the filename, the butler registry or the primary header,
+    and does not read the pixel data.
+
+    Parameters
+    ----------
+    butler : `Butler` or `None`
+        Data Butler (or none)
+    sflat : `str` or `dict`
+        Superflat filename or data_id
+    exptime_cut : `float`
+        Cut between low and high exposures
+
+    Returns
+    -------
+    sflat_type : `str` or `None`
+        'l' for low, 'h' for high, or None if the file can not be classified
+    """
+    if butler is None:
+        if sflat.find('_L_') >= 0 or sflat.find('flat_L') >= 0:
+            return 'l'
+        if sflat.find('_H_') >= 0 or sflat.find('flat_H') >= 0:
+            return 'h'
+        try:
+            exp_time = fits.getheader(sflat)['EXPTIME']
+        except (IOError, KeyError):
+            return None
+    else:
+        exp_time = butler.queryMetadata('raw', 'EXPTIME', sflat)[0]
+    if exp_time < exptime_cut:
+        return 'l'
+    return 'h'
+
 
 def sort_sflats(butler, sflat_files, exptime_cut=20.):
     """Sort a set of superflat image filenames into low and high exposures
@@ -1094,21 +2527,11 @@ def sort_sflats(butler, sflat_files, exptime_cut=20.):
     sflats_h = []
 
     for sflat in sflat_files:
-        if butler is None:
-            if sflat.find('_L_') >= 0:
-                sflats_l.append(sflat)
-            elif sflat.find('flat_L') >= 0:
-                sflats_l.append(sflat)
-            elif sflat.find('_H_') >= 0:
-                sflats_h.append(sflat)
-            elif  sflat.find('flat_H') >= 0:
-                sflats_h.append(sflat)
-        else:
-            exp_time = butler.queryMetadata('raw', 'EXPTIME', sflat)[0]
-            if exp_time < exptime_cut:
-                sflats_l.append(sflat)
-            else:
-                sflats_h.append(sflat)
+        sflat_type = classify_sflat(butler, sflat, exptime_cut)
+        if sflat_type == 'l':
+            sflats_l.append(sflat)
+        elif sflat_type == 'h':
+            sflats_h.append(sflat)
 
     return (sflats_l, sflats_h)
 
@@ -1169,9 +2592,45 @@ def extract_raft_imaging_data(image_dict, ccd_dict, **kwargs):
     return o_dict
 
 
-def outlier_raft_dict(raft_data, mean_val, max_offset):
+def outlier_cube_stats(data_cube, mean_val, max_offset):
+    """Get some stats on the number of outliers in a stack of arrays
+
+    This is the same as `outlier_stats`, for all the arrays at once.
+
+    Parameters
+    ----------
+    data_cube : `np.array`
+        (..., ny, nx) data array
+    mean_val : `float`
+        Expected value
+    max_offset : `float`
+        Maximum offset from mean
+
+    Returns
+    -------
+    o_dict : `dict`
+        Dictionary with information about outliers,
+        each entry has the leading dimensions of data_cube
+    """
+    # Comparing to the two limits avoids making a temporary array of offsets
+    mask_cube = (data_cube < mean_val - max_offset) | (data_cube > mean_val + max_offset)
+    mask_cube = mask_cube.view(np.uint8)
+    cols = mask_cube.sum(axis=-2, dtype=np.int32)
+    rows = mask_cube.sum(axis=-1, dtype=np.int32)
+    o_dict = dict(row_data=rows,
+                  col_data=cols,
+                  nbad_total=cols.sum(axis=-1)/(rows.shape[-1]*cols.shape[-1]),
+                  nbad_rows=(rows >= 10).sum(axis=-1)/rows.shape[-1],
+                  nbad_cols=(cols >= 10).sum(axis=-1)/cols.shape[-1])
+    return o_dict
+
+
+def outlier_raft_dict(raft_data, mean_val, max_offset, **kwargs):
     """Get some stats on the number of outliers for a raft
 
+    The amps of each slot are stacked into a (16, ny, nx) float32 cube,
+    and the slots are processed in parallel if nthreads > 1.
+
     Parameters
     ----------
     raft_data : `dict`
@@ -1181,11 +2640,38 @@ def outlier_raft_dict(raft_data, mean_val, max_offset):
     max_offset : `float`
         Maximum offset from mean
 
+    Keywords
+    --------
+    nthreads : `int`
+        Number of slots to process at the same time
+
     Returns
     -------
     o_dict : `dict`
-        Dictionary of dictionaries with information about outliers, keyed by slot
+        Dictionary with information about outliers, one row per slot, amp
     """
+    nthreads = kwargs.get('nthreads', 1)
+
+    def process_slot(slot_arrays):
+        """Get the outlier stats for the amps of one slot"""
+        amp_arrays = [ccd_data for _, ccd_data in sorted(slot_arrays.items())]
+        if not amp_arrays:
+            return dict(row_data=[], col_data=[], nbad_total=[], nbad_rows=[], nbad_cols=[])
+        if len(set(ccd_data.shape for ccd_data in amp_arrays)) == 1:
+            return outlier_cube_stats(np.stack(amp_arrays).astype(np.float32, copy=False),
+                                      mean_val, max_offset)
+        amp_stats = [outlier_cube_stats(ccd_data.astype(np.float32, copy=False),
+                                        mean_val, max_offset)
+                     for ccd_data in amp_arrays]
+        return {key: [amp_stat[key] for amp_stat in amp_stats] for key in amp_stats[0]}
+
+    slot_list = [slot_arrays for _, slot_arrays in sorted(raft_data.items())]
+    if nthreads is None or nthreads <= 1:
+        slot_stats = [process_slot(slot_arrays) for slot_arrays in slot_list]
+    else:
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            slot_stats = list(executor.map(process_slot, slot_list))
+
     out_data = dict(nbad_total=[],
                     nbad_rows=[],
                     nbad_cols=[],
@@ -1193,22 +2679,329 @@ def outlier_raft_dict(raft_data, mean_val, max_offset):
                     col_data=[],
                     slot=[],
                     amp=[])
-
-    for islot, (_, slot_arrays) in enumerate(sorted(raft_data.items())):
-        for iamp, (_, ccd_data) in enumerate(sorted(slot_arrays.items())):
-            outlier_data = outlier_stats(ccd_data, mean_val, max_offset)
-            out_data['slot'].append(islot)
-            out_data['amp'].append(iamp)
-            for key, val in outlier_data.items():
-                out_data[key].append(val)
+    for islot, (slot_arrays, slot_stat) in enumerate(zip(slot_list, slot_stats)):
+        namps = len(slot_arrays)
+        out_data['slot'] += namps*[islot]
+        out_data['amp'] += list(range(namps))
+        for key, val in slot_stat.items():
+            out_data[key] += list(val)
     return out_data
 
 
+def summed_area_table(data):
+    """Build the summed-area table (integral image) of an array
+
+    Parameters
+    ----------
+    data : `array`
+        The 2D array
+
+    Returns
+    -------
+    sat : `array`
+        (ny+1, nx+1) array, sat[y, x] is the sum of data[:y, :x]
+    """
+    sat = np.zeros((data.shape[0] + 1, data.shape[1] + 1))
+    np.cumsum(data, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def box_sums(sat, ymin, xmin, ymax, xmax):
+    """Get the sums over a set of boxes from a summed-area table
+
+    The boxes cover data[ymin:ymax, xmin:xmax], all the arguments
+    can be arrays, in which case the sums are computed for all the
+    boxes at once.
+
+    Parameters
+    ----------
+    sat : `array`
+        The summed-area table, from `summed_area_table`
+    ymin, xmin : `int` or `array`
+        The lower corners of the boxes
+    ymax, xmax : `int` or `array`
+        The upper corners of the boxes (exclusive)
+
+    Returns
+    -------
+    sums : `float` or `array`
+        The sums over the boxes
+    """
+    return sat[ymax, xmax] - sat[ymin, xmax] - sat[ymax, xmin] + sat[ymin, xmin]
+
+
+def find_footprints(data, thresh):
+    """Find the groups of connected pixels above a threshold
+
+    This follows the conventions of `afwDetect.FootprintSet`, i.e.,
+    pixels at or above the threshold are used and diagonal neighbors
+    are connected.
+
+    Parameters
+    ----------
+    data : `array`
+        The image data
+    thresh : `float`
+        The threshold
+
+    Returns
+    -------
+    labels : `array`
+        Footprint index + 1 for each pixel, 0 for pixels below threshold
+    bboxes : `array`
+        (nfp, 4) array with ymin, xmin, ymax, xmax (exclusive) of each footprint
+    peaks : `array`
+        (nfp, 2) array with y, x of the brightest pixel in the bbox of each footprint
+    """
+    labels, nfp = ndimage.label(data >= thresh, structure=np.ones((3, 3), int))
+    bboxes = np.array([[slc[0].start, slc[1].start, slc[0].stop, slc[1].stop]
+                       for slc in ndimage.find_objects(labels)], int).reshape(nfp, 4)
+
+    # The brightest pixel of each footprint, ties go to the first in row-major order
+    pix_idx = np.flatnonzero(labels)
+    pix_labels = labels.ravel()[pix_idx]
+    order = np.argsort(pix_labels, kind='stable')
+    pix_idx = pix_idx[order]
+    pix_labels = pix_labels[order]
+    pix_vals = data.ravel()[pix_idx]
+    starts = np.searchsorted(pix_labels, np.arange(1, nfp + 1))
+    maxes = np.maximum.reduceat(pix_vals, starts) if nfp else pix_vals[0:0]
+    is_max = pix_vals == maxes[pix_labels - 1]
+    _, first = np.unique(pix_labels[is_max], return_index=True)
+    peak_idx = pix_idx[is_max][first]
+    peaks = np.stack([peak_idx // data.shape[1], peak_idx % data.shape[1]], axis=1)
+
+    # The bbox can include pixels from other footprints, which might be brighter
+    npix = np.bincount(pix_labels, minlength=nfp + 1)[1:]
+    sat_fp = summed_area_table(labels > 0)
+    npix_bbox = box_sums(sat_fp, bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3])
+    for ifp in np.flatnonzero(npix_bbox != npix):
+        ymin, xmin, ymax, xmax = bboxes[ifp]
+        cutout = data[ymin:ymax, xmin:xmax]
+        peak = cutout.argmax()
+        peaks[ifp] = (ymin + peak // cutout.shape[1], xmin + peak % cutout.shape[1])
+
+    return labels, bboxes, peaks
+
+
+def bbox_list_to_array(bbox_list):
+    """Convert a list of bounding boxes to an array of corners
+
+    Parameters
+    ----------
+    bbox_list : `list`
+        The `Box2I` objects
+
+    Returns
+    -------
+    bboxes : `array`
+        (n, 4) array with ymin, xmin, ymax, xmax (exclusive) of each box
+    """
+    return np.array([[bbox.getMinY(), bbox.getMinX(), bbox.getMaxY() + 1, bbox.getMaxX() + 1]
+                     for bbox in bbox_list], int).reshape(len(bbox_list), 4)
+
+
+class BBoxPhotometry:
+    """Photometry in boxes and in rings around peaks for one amp image
+
+    The summed-area tables of the image, and of the pixels over each
+    threshold, are built once, after which any box sum costs the same
+    regardless of the size of the box.  The median of the image is also
+    computed once.
+
+    Boxes are given as arrays of ymin, xmin, ymax, xmax (exclusive) in
+    the coordinates of the parent image, as from `bbox_list_to_array`
+    or `find_footprints`.
+    """
+    def __init__(self, image):
+        """C'tor
+
+        Parameters
+        ----------
+        image : `ImageF` or `MaskedImageF`
+            The amp image
+        """
+        if hasattr(image, 'getImage'):
+            image = image.getImage()
+        self.data = image.array
+        self.xy0 = np.array([image.getY0(), image.getX0()])
+        self._median = None
+        self._sat = None
+        self._count_sats = {}
+
+    @property
+    def median(self):
+        """The median of the image"""
+        if self._median is None:
+            self._median = float(np.median(self.data))
+        return self._median
+
+    @property
+    def sat(self):
+        """The summed-area table of the image"""
+        if self._sat is None:
+            self._sat = summed_area_table(self.data)
+        return self._sat
+
+    def count_sat(self, thresh):
+        """The summed-area table of the pixels above a threshold"""
+        sat = self._count_sats.get(thresh, None)
+        if sat is None:
+            sat = summed_area_table(self.data > thresh)
+            self._count_sats[thresh] = sat
+        return sat
+
+    def to_array_coords(self, bboxes):
+        """Convert boxes to array indices
+
+        Parameters
+        ----------
+        bboxes : `array`
+            (n, 4) array with ymin, xmin, ymax, xmax in parent coordinates
+
+        Returns
+        -------
+        corners : `array`
+            (4, n) array with ymin, xmin, ymax, xmax in array indices,
+            boxes outside the image are clipped to it
+        inside : `array`
+            Flags for the boxes that are fully inside the image
+        """
+        corners = np.asarray(bboxes, int).reshape(-1, 4).T - np.tile(self.xy0, 2)[:, np.newaxis]
+        dims = np.tile(self.data.shape, 2)[:, np.newaxis]
+        inside = np.all((corners >= 0) & (corners <= dims), axis=0)
+        return np.clip(corners, 0, dims), inside
+
+    def box_sums(self, bboxes):
+        """Sums of the image over a set of boxes
+
+        Parameters
+        ----------
+        bboxes : `array`
+            (n, 4) array with ymin, xmin, ymax, xmax in parent coordinates
+
+        Returns
+        -------
+        sums : `array`
+            The sums, NaN for boxes not fully inside the image
+        """
+        corners, inside = self.to_array_coords(bboxes)
+        return np.where(inside, box_sums(self.sat, *corners), np.nan)
+
+    def box_peaks(self, bboxes):
+        """Positions of the brightest pixel in each of a set of boxes
+
+        Parameters
+        ----------
+        bboxes : `array`
+            (n, 4) array with ymin, xmin, ymax, xmax in parent coordinates
+
+        Returns
+        -------
+        peaks : `array`
+            (n, 2) array with y, x of the peaks in parent coordinates
+        """
+        corners, _ = self.to_array_coords(bboxes)
+        peaks = np.zeros((corners.shape[1], 2), int)
+        for i, (ymin, xmin, ymax, xmax) in enumerate(corners.T):
+            cutout = self.data[ymin:ymax, xmin:xmax]
+            if cutout.size:
+                peak = cutout.argmax()
+                peaks[i] = (ymin + peak // cutout.shape[1], xmin + peak % cutout.shape[1])
+        return peaks + self.xy0
+
+    def box_medians(self, bboxes):
+        """Medians of the image over a set of boxes
+
+        Parameters
+        ----------
+        bboxes : `array`
+            (n, 4) array with ymin, xmin, ymax, xmax in parent coordinates
+
+        Returns
+        -------
+        medians : `array`
+            The medians, NaN for boxes not fully inside the image
+        """
+        corners, inside = self.to_array_coords(bboxes)
+        medians = np.full(corners.shape[1], np.nan)
+        for i in np.flatnonzero(inside):
+            ymin, xmin, ymax, xmax = corners[:, i]
+            medians[i] = np.median(self.data[ymin:ymax, xmin:xmax])
+        return medians
+
+    def ring_stats(self, peaks, **kwargs):
+        """Statistics in square rings around a set of peaks
+
+        Ring 0 is the peak pixel, ring i is the band of 8i pixels
+        between the boxes of size 2i-1 and 2i+1 centered on the peak.
+        Rings that extend past the edge of the image, and all the rings
+        outside them, are set to zero.
+
+        Parameters
+        ----------
+        peaks : `array`
+            (n, 2) array with y, x of the peaks in parent coordinates
+
+        Keywords
+        --------
+        nring : `int`
+            Number of rings
+        thresholds : `list`
+            Thresholds at which to count pixels
+        medians : `bool`
+            Also return the differences between the medians of successive boxes
+
+        Returns
+        -------
+        ring_dict : `dict`
+            'sums' : (nring, n) array of the sums over the rings
+            'npix' : list of (nring, n) arrays of number of pixels above each threshold
+            'medians' : (nring, n) array, if requested
+        """
+        nring = kwargs.get('nring', 4)
+        thresholds = kwargs.get('thresholds', [])
+        do_medians = kwargs.get('medians', False)
+
+        peaks = np.asarray(peaks, int).reshape(-1, 2) - self.xy0
+        peak_y, peak_x = peaks.T
+        ny, nx = self.data.shape
+
+        sums = np.zeros((nring + 1, len(peaks)))
+        counts = np.zeros((len(thresholds), nring + 1, len(peaks)), int)
+        valid = np.zeros((nring, len(peaks)), bool)
+        for i in range(nring):
+            valid[i] = (peak_y >= i) & (peak_x >= i) & (peak_y + i < ny) & (peak_x + i < nx)
+            corners = (np.clip(peak_y - i, 0, ny), np.clip(peak_x - i, 0, nx),
+                       np.clip(peak_y + i + 1, 0, ny), np.clip(peak_x + i + 1, 0, nx))
+            sums[i + 1] = box_sums(self.sat, *corners)
+            for counts_t, thresh in zip(counts, thresholds):
+                counts_t[i + 1] = np.round(box_sums(self.count_sat(thresh), *corners))
+
+        ring_dict = dict(sums=np.where(valid, np.diff(sums, axis=0), 0.),
+                         npix=[np.where(valid, np.diff(counts_t, axis=0), 0) for counts_t in counts])
+
+        if do_medians:
+            # Windows of the largest box around each peak, padded at the edges
+            padded = np.pad(self.data.astype(float), nring - 1, constant_values=np.nan)
+            windows = np.lib.stride_tricks.sliding_window_view(padded, (2*nring - 1,)*2)
+            windows = windows[np.clip(peak_y, 0, ny - 1), np.clip(peak_x, 0, nx - 1)]
+            meds = np.zeros((nring + 1, len(peaks)))
+            for i in range(nring):
+                sub = windows[:, nring - 1 - i:nring + i, nring - 1 - i:nring + i]
+                meds[i + 1] = np.median(sub.reshape(len(peaks), -1), axis=1)
+            ring_dict['medians'] = np.where(valid, np.diff(meds, axis=0), 0.)
+
+        return ring_dict
 
 
 def fill_footprint_dict(image, fp_dict, amp, slot, **kwargs):
     """Fill a dictionary with data about the footprints from an image
 
+    The statistics for all the footprints are computed at once
+    with `BBoxPhotometry`.
+
     Parameters
     ----------
     image : `imageF`
@@ -1231,97 +3024,61 @@ def fill_footprint_dict(image, fp_dict, amp, slot, **kwargs):
     kwcopy = kwargs.copy()
     fp_type = kwcopy.get('fp_type', 'dark')
 
+    data = image.array
     if fp_type == 'dark':
         frac_thresh = kwcopy.get('frac_thresh', 0.6)
-        median = np.median(image.array)
+        median = np.median(data)
         #stdev = np.std(image.array)
         thresh_float = frac_thresh*median
         thresh_0p2_float = (1. - (1. - frac_thresh)*0.2)*median
-        threshold = afwDetect.Threshold(thresh_float)
         keystr = 'ratio'
     elif fp_type == 'bright':
         abs_thresh = kwcopy.get('abs_thresh', 50.)
-        median = float(np.median(image.array))
+        median = float(np.median(data))
         thresh_float = median + abs_thresh
         thresh_0p2_float = median + 0.2*abs_thresh
-        threshold = afwDetect.Threshold(thresh_float)
         keystr = 'mean'
 
-    fpset = afwDetect.FootprintSet(image, threshold)
-
-    for footprint in fpset.getFootprints():
-        bbox = footprint.getBBox()
-
-        if bbox.getWidth() > 500:
-            continue
-
-        fp_dict['slot'].append(slot)
-        fp_dict['amp'].append(amp)
-
-        fp_dict['x_corner'].append(bbox.getMinX())
-        fp_dict['y_corner'].append(bbox.getMinY())
-
-        fp_dict['x_size'].append(bbox.getWidth())
-        fp_dict['y_size'].append(bbox.getHeight())
+    _, bboxes, peaks = find_footprints(data, thresh_float)
 
-        cutout = image[bbox].array
-        peak_idx = cutout.argmax()
+    keep = (bboxes[:, 3] - bboxes[:, 1]) <= 500
+    phot = BBoxPhotometry(image)
+    bboxes = bboxes[keep] + np.tile(phot.xy0, 2)
+    peaks = peaks[keep] + phot.xy0
+    nfp = len(bboxes)
 
-        peak_x = bbox.getMinX() + int(peak_idx % cutout.shape[1])
-        peak_y = bbox.getMinY() + int(peak_idx / cutout.shape[1])
-        fp_dict['x_peak'].append(peak_x)
-        fp_dict['y_peak'].append(peak_y)
+    fp_dict['slot'] += nfp*[slot]
+    fp_dict['amp'] += nfp*[amp]
 
-        peak = afwGeom.Point2I(peak_x, peak_y)
-        extent = afwGeom.Extent2I(1, 1)
-        bbox_expand = afwGeom.Box2I(peak, extent)
+    fp_dict['x_corner'] += bboxes[:, 1].tolist()
+    fp_dict['y_corner'] += bboxes[:, 0].tolist()
 
-        ratio_full = np.mean(cutout)
-        if fp_type == 'dark':
-            ratio_full /= median
+    fp_dict['x_size'] += (bboxes[:, 3] - bboxes[:, 1]).tolist()
+    fp_dict['y_size'] += (bboxes[:, 2] - bboxes[:, 0]).tolist()
 
-        fp_dict['%s_full' % keystr].append(ratio_full)
+    fp_dict['x_peak'] += peaks[:, 1].tolist()
+    fp_dict['y_peak'] += peaks[:, 0].tolist()
 
-        npix_cumul = np.array([1, 8, 16, 24])
-        sums = np.zeros((4))
-        over_thresh = np.zeros((4), int)
-        over_0p2_thresh = np.zeros((4), int)
-
-        sums_cumul = np.zeros((4))
-        over_thresh_cumul = np.zeros((4), int)
-        over_0p2_thresh_cumul = np.zeros((4), int)
+    areas = (bboxes[:, 2] - bboxes[:, 0])*(bboxes[:, 3] - bboxes[:, 1])
+    ratio_full = phot.box_sums(bboxes) / areas
+    if fp_type == 'dark':
+        ratio_full /= median
 
-        for i in range(4):
+    fp_dict['%s_full' % keystr] += ratio_full.tolist()
 
-            try:
-                cuttout_array = image[bbox_expand].array
-            except LengthError:
-                break
-
-            sums[i] = cuttout_array.sum()
-            over_thresh[i] = (cuttout_array > thresh_float).sum()
-            over_0p2_thresh[i] = (cuttout_array > thresh_0p2_float).sum()
-
-            if i > 0:
-                sums_cumul[i] = sums[i] - sums[i-1]
-                over_thresh_cumul[i] = over_thresh[i] - over_thresh[i-1]
-                over_0p2_thresh_cumul[i] = over_0p2_thresh[i] - over_0p2_thresh[i-1]
-            else:
-                sums_cumul[i] = sums[i]
-                over_thresh_cumul[i] = over_thresh[i]
-                over_0p2_thresh_cumul[i] = over_0p2_thresh[i]
+    # Rings of 1, 8, 16, 24 pixels around the peak
+    npix_cumul = np.array([1, 8, 16, 24])
+    rings = phot.ring_stats(peaks, nring=4, thresholds=[thresh_float, thresh_0p2_float])
 
-            bbox_expand.grow(1)
+    means_cumul = rings['sums']/npix_cumul[:, np.newaxis]
 
-        means_cumul = sums_cumul/npix_cumul
-
-        if fp_type == 'dark':
-            means_cumul /= median
+    if fp_type == 'dark':
+        means_cumul /= median
 
-        for i in range(4):
-            fp_dict['%s_%i' % (keystr, i)].append(means_cumul[i])
-            fp_dict['npix_%i' % i].append(over_thresh_cumul[i])
-            fp_dict['npix_0p2_%i' % i].append(over_0p2_thresh_cumul[i])
+    for i in range(4):
+        fp_dict['%s_%i' % (keystr, i)] += means_cumul[i].tolist()
+        fp_dict['npix_%i' % i] += rings['npix'][0][i].tolist()
+        fp_dict['npix_0p2_%i' % i] += rings['npix'][1][i].tolist()
 
 
 def build_defect_dict(dark_array, **kwargs):
@@ -1031,6 +1031,7 @@ class TableAnalysisByRun(AnalysisByRun):
         raft_level = False
         for raft in raft_list:
             kwcopy['raft'] = raft
+            kwcopy.pop('slot', None)
             if slot_list is None:
                 slot_list_use = getSlotList(raft)
             else:
@@ -1047,7 +1048,7 @@ class TableAnalysisByRun(AnalysisByRun):
             except Exception:
                 pass
             slot_dict = {}
-            for slot in slot_list:
+            for slot in slot_list_use:
                 kwcopy['slot'] = slot
                 datapath = self._task.get_filename_from_format(formatter, '.fits', **kwcopy)
                 slot_dict[slot] = datapath
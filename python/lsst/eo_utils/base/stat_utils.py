@@ -1,8 +1,12 @@
 """Functions to help with statistics and fitting"""
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
-import scipy.optimize
+import scipy.fft
+
+from scipy.interpolate import RectBivariateSpline
 
 from scipy.special import erf
 
@@ -29,7 +33,7 @@ def gauss_intergral(xval, norm, x_0, sigmax):
     """
     sqrt2sigmax = SQRT2 * sigmax
     edge_vals = erf((xval - x_0)/sqrt2sigmax)
-    bin_vals = 0.5 * norm * (edge_vals[1:] - edge_vals[0:-1])
+    bin_vals = 0.5 * norm * (edge_vals[..., 1:] - edge_vals[..., 0:-1])
     return bin_vals
 
 
@@ -67,30 +71,339 @@ def gauss_fit(hist):
     Returns
     -------
     retvals : `tuple`
-        The output of `scipy.optimize.leastsq`
+        The fitted parameters (norm, mean, width) and a status flag,
+        1 if the fit converged, as from `scipy.optimize.leastsq`
     """
-    bin_edges = hist[1]
-    bin_values = hist[0]
-    norm = bin_values.sum()
-    mean = (bin_edges[0] + bin_edges[-1]) / 2.
-    width = (bin_edges[-1] - bin_edges[0]) / 10.
-    init_pars = (norm, mean, width)
-    return scipy.optimize.leastsq(gauss_residuals, init_pars,
-                                  args=(bin_edges, bin_values))
+    pars, _, _, converged = batched_gauss_fit(hist[1], hist[0])
+    return pars[0], 1 if converged[0] else 5
 
 
+def batched_histograms(data_list, bin_edges):
+    """Histogram many arrays into a single array of counts
 
-def make_profile_hist(xbin_edges, xdata, ydata, **kwargs):
-    """Build a profile historgram
+    The bins follow the `numpy.histogram` conventions, i.e., they include
+    their lower edge, and the last bin also includes its upper edge.
+
+    Parameters
+    ----------
+    data_list : `list`
+        The arrays to histogram, they can be of different sizes
+    bin_edges : `array`
+        The bin edges, (nbins+1), or (narr, nbins+1) for per-array edges
+
+    Returns
+    -------
+    counts : `array`
+        (narr, nbins) array with the number of entries in each bin
+    """
+    narr = len(data_list)
+    bin_edges = np.broadcast_to(np.atleast_2d(bin_edges), (narr, np.shape(bin_edges)[-1]))
+    nbins = bin_edges.shape[1] - 1
+
+    counts = np.zeros((narr, nbins), int)
+    for iarr, (data, edges) in enumerate(zip(data_list, bin_edges)):
+        counts[iarr] = np.histogram(data, bins=edges)[0]
+    return counts
+
+
+def batched_levenberg_marquardt(residuals_and_jacobian, pars, **kwargs):
+    """Minimize many independent chi**2 functions at once
+
+    This does Levenberg-Marquardt damped Gauss-Newton steps for all the fits
+    together, the normal equations are solved with the Jacobian columns
+    scaled to unit norm, so that the parameters can have very different scales.
+
+    Parameters
+    ----------
+    residuals_and_jacobian : `function`
+        Called as residuals_and_jacobian(pars, sel), where pars are the parameters
+        of the fits selected by sel, it should return the (nsel, npts) normalized
+        residuals and their (nsel, npts, npars) derivatives w.r.t. the parameters
+    pars : `array`
+        (nfit, npars) array with the starting values of the parameters
+
+    Keywords
+    --------
+    niter : `int`
+        Maximum number of iterations
+    tol : `float`
+        Relative change in chi**2 at which to stop
+
+    Returns
+    -------
+    pars : `array`
+        (nfit, npars) array of fitted parameters
+    chi2 : `array`
+        The chi**2 of each fit
+    jac : `array`
+        The Jacobian of the residuals at the fitted parameters
+    converged : `array`
+        Flags for the fits that converged
+    """
+    niter = kwargs.get('niter', 100)
+    tol = kwargs.get('tol', 1e-10)
+
+    pars = np.array(pars, dtype=float)
+    nfit, npars = pars.shape
+
+    resid, jac = residuals_and_jacobian(pars, slice(None))
+    chi2 = (resid**2).sum(axis=1)
+    lam = np.full(nfit, 1e-3)
+    converged = np.zeros(nfit, bool)
+
+    for _ in range(niter):
+        active = ~converged
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        jtj = np.einsum('fbi,fbj->fij', jac[active], jac[active])
+        jtr = np.einsum('fbi,fb->fi', jac[active], resid[active])
+        scale = np.sqrt(np.diagonal(jtj, axis1=1, axis2=2))
+        scale[scale <= 0.] = 1.
+        damped = jtj / (scale[:, :, np.newaxis] * scale[:, np.newaxis, :]) + \
+            lam[active, np.newaxis, np.newaxis] * np.eye(npars)
+        try:
+            step = np.linalg.solve(damped, -(jtr / scale)[..., np.newaxis])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.stack([np.linalg.lstsq(mat, -vec, rcond=None)[0]
+                             for mat, vec in zip(damped, jtr / scale)])
+        step /= scale
+
+        trial = pars[active] + step
+        trial_resid, trial_jac = residuals_and_jacobian(np.where(np.isfinite(trial), trial,
+                                                                 pars[active]), idx)
+        trial_chi2 = (trial_resid**2).sum(axis=1)
+        improved = np.isfinite(trial_chi2) & (trial_chi2 <= chi2[active])
+
+        idx_imp = idx[improved]
+        small = np.abs(chi2[idx_imp] - trial_chi2[improved]) <= tol * np.maximum(chi2[idx_imp], 1.)
+        pars[idx_imp] = trial[improved]
+        resid[idx_imp] = trial_resid[improved]
+        jac[idx_imp] = trial_jac[improved]
+        chi2[idx_imp] = trial_chi2[improved]
+        lam[idx_imp] *= 0.1
+        lam[idx[~improved]] *= 10.
+        converged[idx_imp[small]] = True
+        converged[idx[~improved][lam[idx[~improved]] > 1e10]] = True
+
+    return pars, chi2, jac, converged
+
+
+def batched_gauss_fit(bin_edges, bin_values, **kwargs):
+    """Fit Gaussians to many histograms at once
+
+    This minimizes the same chi**2 as `gauss_residuals`, starting
+    from the moments of the histograms, with Levenberg-Marquardt
+    damped Gauss-Newton steps done for all the histograms together.
+
+    Parameters
+    ----------
+    bin_edges : `array`
+        The bin edges, (nbins+1), or (nfit, nbins+1) for per-histogram edges
+    bin_values : `array`
+        The numbers of counts in each bin, (nfit, nbins)
+
+    Keywords
+    --------
+    niter : `int`
+        Maximum number of iterations
+    tol : `float`
+        Relative change in chi**2 at which to stop
+
+    Returns
+    -------
+    pars : `array`
+        (nfit, 3) array of fitted parameters (norm, mean, width)
+    chi2 : `array`
+        The chi**2 of each fit
+    dof : `int`
+        The number of degrees of freedom of each fit
+    converged : `array`
+        Flags for the fits that converged
+    """
+    niter = kwargs.get('niter', 100)
+    tol = kwargs.get('tol', 1e-10)
+
+    bin_values = np.atleast_2d(np.asarray(bin_values, dtype=float))
+    nfit, nbins = bin_values.shape
+    bin_edges = np.broadcast_to(np.atleast_2d(np.asarray(bin_edges, dtype=float)),
+                                (nfit, nbins + 1))
+    errors = np.sqrt(bin_values).clip(1., np.inf)
+
+    # Seed with the moments of the histograms
+    centers = (bin_edges[:, 1:] + bin_edges[:, 0:-1]) / 2.
+    norm = bin_values.sum(axis=1)
+    safe_norm = np.where(norm > 0, norm, 1.)
+    mean = (bin_values * centers).sum(axis=1) / safe_norm
+    var = (bin_values * (centers - mean[:, np.newaxis])**2).sum(axis=1) / safe_norm
+    width = np.sqrt(np.maximum(var, ((bin_edges[:, -1] - bin_edges[:, 0]) / nbins)**2))
+    pars = np.stack([norm, mean, width], axis=1)
+
+    def residuals_and_jacobian(pars, sel):
+        """Return the residuals and their derivatives w.r.t. the parameters"""
+        norm, x_0, sigmax = [par[:, np.newaxis] for par in pars.T]
+        sigmax = np.abs(sigmax)
+        edges = bin_edges[sel]
+        uvals = (edges - x_0) / (SQRT2 * sigmax)
+        model = gauss_intergral(edges, norm, x_0, sigmax)
+        gvals = np.exp(-uvals*uvals) / np.sqrt(np.pi)
+        jac = np.stack([0.5 * (erf(uvals[:, 1:]) - erf(uvals[:, 0:-1])),
+                        -norm * (gvals[:, 1:] - gvals[:, 0:-1]) / (SQRT2 * sigmax),
+                        -norm * (gvals[:, 1:] * uvals[:, 1:] - gvals[:, 0:-1] * uvals[:, 0:-1]) / sigmax],
+                       axis=-1)
+        return (bin_values[sel] - model) / errors[sel], -jac / errors[sel][..., np.newaxis]
+
+    pars, chi2, _, converged = batched_levenberg_marquardt(residuals_and_jacobian, pars,
+                                                           niter=niter, tol=tol)
+    pars[:, 2] = np.abs(pars[:, 2])
+    return pars, chi2, nbins - 3, converged
+
+
+def ptc_model(pars, mean):
+    """The photon transfer curve model, variance as a function of mean
+
+    This is the same model as `lsst.eotest.sensor.ptcTask.ptc_func`,
+    see Astier et al.
+
+    Parameters
+    ----------
+    pars : `array`
+        The parameters (a00, gain, intercept), (3) or (nfit, 3)
+    mean : `array`
+        The mean signals, (npts) or (nfit, npts)
+
+    Returns
+    -------
+    var : `array`
+        The variances
+    """
+    a00, gain, intcpt = [np.asarray(par)[..., np.newaxis] for par in np.asarray(pars).T]
+    return 0.5/(a00*gain*gain)*(1. - np.exp(-2.*a00*mean*gain)) + intcpt/(gain*gain)
+
+
+def ptc_model_jacobian(pars, mean):
+    """The derivatives of the photon transfer curve model w.r.t. its parameters
+
+    Parameters
+    ----------
+    pars : `array`
+        (nfit, 3) array of parameters (a00, gain, intercept)
+    mean : `array`
+        The mean signals, (nfit, npts)
+
+    Returns
+    -------
+    jac : `array`
+        (nfit, npts, 3) array of derivatives
+    """
+    a00, gain, intcpt = [par[:, np.newaxis] for par in pars.T]
+    expval = np.exp(-2.*a00*mean*gain)
+    one_m_exp = 1. - expval
+    return np.stack([-0.5*one_m_exp/(a00*a00*gain*gain) + mean*expval/(a00*gain),
+                     -one_m_exp/(a00*gain*gain*gain) + mean*expval/(gain*gain) -
+                     2.*intcpt/(gain*gain*gain),
+                     np.broadcast_to(1./(gain*gain), mean.shape)], axis=-1)
+
+
+def batched_ptc_fit(mean, var, mask, pars, **kwargs):
+    """Fit the photon transfer curves of many amps at once
+
+    This minimizes the chi**2 with errors sqrt(var) on the variances,
+    as is done with `scipy.optimize.leastsq` in `PTCTask`,
+    optionally iterating to reject outlying points.
+
+    Parameters
+    ----------
+    mean : `array`
+        The mean signals, (nfit, npts)
+    var : `array`
+        The variances, (nfit, npts)
+    mask : `array`
+        True for the points to use in the fits, (nfit, npts)
+    pars : `array`
+        (nfit, 3) array with the starting values of (a00, gain, intercept)
+
+    Keywords
+    --------
+    nsig_clip : `float` or `None`
+        If set, points with fractional residuals larger than this many times
+        the robust RMS of the fractional residuals are rejected and the fit is redone
+    nclip_iter : `int`
+        Maximum number of rejection iterations
+    Other keywords are passed to `batched_levenberg_marquardt`
+
+    Returns
+    -------
+    pars : `array`
+        (nfit, 3) array of fitted parameters
+    covs : `array`
+        (nfit, 3, 3) covariance matrices, NaN if the fit is singular
+    chi2 : `array`
+        The chi**2 of each fit
+    mask : `array`
+        The points used in the final fits
+    converged : `array`
+        Flags for the fits that converged, and had more points than parameters
+    """
+    kwcopy = kwargs.copy()
+    nsig_clip = kwcopy.pop('nsig_clip', None)
+    nclip_iter = kwcopy.pop('nclip_iter', 3)
+
+    mean = np.atleast_2d(np.asarray(mean, dtype=float))
+    var = np.atleast_2d(np.asarray(var, dtype=float))
+    mask = np.array(np.broadcast_to(mask, mean.shape)) & (var > 0) & np.isfinite(mean)
+    errors = np.sqrt(np.where(mask, var, 1.))
+    pars = np.array(pars, dtype=float)
+
+    def residuals_and_jacobian(pars, sel):
+        """Return the residuals and their derivatives w.r.t. the parameters"""
+        weights = mask[sel] / errors[sel]
+        resid = (var[sel] - ptc_model(pars, mean[sel])) * weights
+        jac = -ptc_model_jacobian(pars, mean[sel]) * weights[..., np.newaxis]
+        return np.where(mask[sel], resid, 0.), np.where(mask[sel][..., np.newaxis], jac, 0.)
+
+    for iclip in range(nclip_iter + 1):
+        pars, chi2, jac, converged = batched_levenberg_marquardt(residuals_and_jacobian,
+                                                                 pars, **kwcopy)
+        if nsig_clip is None or iclip == nclip_iter:
+            break
+        model = ptc_model(pars, mean)
+        resid = np.abs(var - model) / np.abs(model)
+        masked_resid = np.ma.masked_array(resid, ~mask)
+        rms = 1.4826 * np.ma.median(masked_resid, axis=1).filled(0.)
+        outliers = mask & (resid > nsig_clip * rms[:, np.newaxis])
+        if not outliers.any():
+            break
+        mask &= ~outliers
+
+    converged &= mask.sum(axis=1) > pars.shape[1]
+    covs = np.full((len(pars), 3, 3), np.nan)
+    jtj = np.einsum('fbi,fbj->fij', jac, jac)
+    scale = np.sqrt(np.diagonal(jtj, axis1=1, axis2=2))
+    scale[scale <= 0.] = 1.
+    scaled = jtj / (scale[:, :, np.newaxis] * scale[:, np.newaxis, :])
+    good = np.isfinite(scaled).all(axis=(1, 2))
+    good[good] = np.linalg.cond(scaled[good]) < 1e12
+    covs[good] = np.linalg.inv(scaled[good]) / \
+        (scale[good][:, :, np.newaxis] * scale[good][:, np.newaxis, :])
+    return pars, covs, chi2, mask, converged
+
+
+def make_profile_hists(xbin_edges, xdata, ydata, **kwargs):
+    """Build many profile historgrams at once
+
+    The points are assigned to bins with `numpy.digitize`, and the sums
+    needed for all the bins of all the profiles are then done with a
+    single `numpy.bincount` each.
 
     Parameters
     ----------
     xbin_edges : `array`
-        The bin edges
+        The bin edges, (nbins+1), or (nprof, nbins+1) for per-profile edges
     xdata : `array`
-        The x-axis data
+        The x-axis data, (nprof, npts), or (npts) if shared by all the profiles
     ydata : `array`
-        The y-axis data
+        The y-axis data, (nprof, npts), or (npts) if shared by all the profiles
 
     Keywords
     --------
@@ -103,40 +416,83 @@ def make_profile_hist(xbin_edges, xdata, ydata, **kwargs):
     Returns
     -------
     x_vals : `array`
-        The x-bin centers
+        The x-bin centers, (nprof, nbins)
     y_vals : `array`
-        The y-bin values
+        The y-bin values, (nprof, nbins)
     y_errs : `array`
-        The y-bin errors
+        The y-bin errors, (nprof, nbins)
     """
     yerrs = kwargs.get('yerrs', None)
     stderr = kwargs.get('stderr', False)
 
-    nbinsx = len(xbin_edges) - 1
-    x_vals = (xbin_edges[0:-1] + xbin_edges[1:])/2.
-    y_vals = np.ndarray((nbinsx))
-    y_errs = np.ndarray((nbinsx))
-
+    xdata, ydata = np.broadcast_arrays(np.atleast_2d(xdata), np.atleast_2d(ydata))
+    nprof = ydata.shape[0]
+    xbin_edges = np.broadcast_to(np.atleast_2d(xbin_edges), (nprof, np.shape(xbin_edges)[-1]))
+    nbinsx = xbin_edges.shape[1] - 1
+    x_vals = (xbin_edges[:, 0:-1] + xbin_edges[:, 1:])/2.
 
     if yerrs is None:
-        weights = np.ones(y_vals.shape)
+        weights = np.ones(ydata.shape)
     else:
-        weights = 1./(yerrs*yerrs)
-
-    y_w = ydata*weights
-
-    for i, (xmin, xmax) in enumerate(zip(xbin_edges[0:-1], xbin_edges[1:])):
-        mask = (xdata >= xmin) * (xdata < xmax)
-        if mask.sum() < 2:
-            y_vals[i] = 0.
-            y_errs[i] = -1.
-            continue
-        y_vals[i] = y_w[mask].sum() / weights[mask].sum()
-        y_errs[i] = ydata[mask].std()
+        weights = np.broadcast_to(1./(yerrs*yerrs), ydata.shape)
+
+    # Bin i of profile j goes to index j*nbinsx + i - 1, points outside the bins are dropped
+    bin_idx = np.vstack([np.digitize(xrow, edges) for xrow, edges in zip(xdata, xbin_edges)])
+    used = (bin_idx > 0) & (bin_idx <= nbinsx)
+    flat_idx = (bin_idx + (nbinsx * np.arange(nprof) - 1)[:, np.newaxis])[used]
+    nbins_tot = nprof * nbinsx
+    y_used = ydata[used]
+
+    counts = np.bincount(flat_idx, minlength=nbins_tot)
+    sum_w = np.bincount(flat_idx, weights=weights[used], minlength=nbins_tot)
+    sum_yw = np.bincount(flat_idx, weights=(ydata*weights)[used], minlength=nbins_tot)
+    sum_y = np.bincount(flat_idx, weights=y_used, minlength=nbins_tot)
+
+    good = counts >= 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y_vals = np.where(good, sum_yw / sum_w, 0.)
+        y_means = sum_y / counts
+        sum_dy2 = np.bincount(flat_idx, weights=(y_used - y_means[flat_idx])**2,
+                              minlength=nbins_tot)
+        y_errs = np.sqrt(sum_dy2 / counts)
         if stderr:
-            y_errs[i] /= np.sqrt(mask.sum())
+            y_errs /= np.sqrt(counts)
+    y_errs = np.where(good, y_errs, -1.)
+
+    return x_vals, y_vals.reshape(nprof, nbinsx), y_errs.reshape(nprof, nbinsx)
 
-    return x_vals, y_vals, y_errs
+
+def make_profile_hist(xbin_edges, xdata, ydata, **kwargs):
+    """Build a profile historgram
+
+    Parameters
+    ----------
+    xbin_edges : `array`
+        The bin edges
+    xdata : `array`
+        The x-axis data
+    ydata : `array`
+        The y-axis data
+
+    Keywords
+    --------
+    yerrs :  `array`
+        The errors on the y-axis points
+
+    stderr : `bool`
+        Set error bars to standard error instead of RMS
+
+    Returns
+    -------
+    x_vals : `array`
+        The x-bin centers
+    y_vals : `array`
+        The y-bin values
+    y_errs : `array`
+        The y-bin errors
+    """
+    x_vals, y_vals, y_errs = make_profile_hists(xbin_edges, xdata, ydata, **kwargs)
+    return x_vals[0], y_vals[0], y_errs[0]
 
 
 def lin_func_1(pars, xvals):
@@ -161,6 +517,88 @@ def chi2_model(pars, xvals, yvals, model):
 
 
 
+def linearity_basis(xvals, model_func_choice):
+    """Return the basis functions of one of the `LINEARITY_FUNC_DICT` models
+
+    The models are linear in their parameters, i.e.,
+    model(pars, xvals) = basis @ pars
+
+    Parameters
+    ----------
+    xvals : `array`
+        The x-axis data
+    model_func_choice : `int`
+        Function choice
+
+    Returns
+    -------
+    basis : `array`
+        The basis functions, with an extra trailing axis for the parameters
+    """
+    xvals = np.asarray(xvals, dtype=float)
+    cols = [xvals, xvals*xvals, np.ones_like(xvals)]
+    return np.stack(cols[0:model_func_choice], axis=-1)
+
+
+def batched_linear_chisq_fit(xdata, ydata, fit_mask, model_func_choice):
+    """Preform linear chi**2 fits to many sets of data at once
+
+    This minimizes the same chi**2 as `chi2_model`, i.e., with the
+    errors set to sqrt(y), but since the models are linear in their
+    parameters it does so in closed form, with a single batched QR
+    decomposition for all the sets of data.
+
+    Parameters
+    ----------
+    xdata : `array`
+        The x-axis data, (nfit, npts), or (npts) if shared by all the fits
+    ydata : `array`
+        The y-axis data, (nfit, npts), or (npts) if shared by all the fits
+    fit_mask : `array` or `None`
+        Array used to mask data, (nfit, npts) or (npts)
+    model_func_choice : `int`
+        Function choice
+
+    Returns
+    -------
+    pars : `array`
+        (nfit, npar) array of fitted parameters
+    covs : `array`
+        (nfit, npar, npar) array of parameter covariances
+    model_yvals : `array`
+        The model values at all the points
+    frac_resid : `array`
+        The fractional residual
+    frac_resid_err : `array`
+        The uncertainty on the fractional residual
+    """
+    xdata, ydata = np.broadcast_arrays(np.atleast_2d(xdata), np.atleast_2d(ydata))
+    if fit_mask is None:
+        fit_mask = np.ones(ydata.shape, bool)
+    fit_mask = np.broadcast_to(fit_mask, ydata.shape)
+
+    basis = linearity_basis(xdata, model_func_choice)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(fit_mask, 1./np.sqrt(ydata), 0.)
+    design = basis * weights[..., np.newaxis]
+
+    # Scale the columns to keep the problem well conditioned
+    scale = np.sqrt((design**2).sum(axis=-2))
+    scale[scale == 0] = 1.
+    q_mat, r_mat = np.linalg.qr(design / scale[:, np.newaxis, :])
+    rhs = np.einsum('fpk,fp->fk', q_mat, ydata * weights)
+    pars = np.linalg.solve(r_mat, rhs[..., np.newaxis])[..., 0] / scale
+
+    r_inv = np.linalg.inv(r_mat)
+    covs = (r_inv @ r_inv.transpose(0, 2, 1)) / (scale[:, :, np.newaxis] * scale[:, np.newaxis, :])
+
+    model_yvals = np.einsum('fpk,fk->fp', basis, pars)
+    frac_resid = (ydata - model_yvals)/model_yvals
+    frac_resid_err = 1./ydata
+
+    return pars, covs, model_yvals, frac_resid, frac_resid_err
+
+
 def perform_linear_chisq_fit(xdata, ydata, fit_mask, model_func_choice):
     """Preform a linear chi**2 fit to data
 
@@ -177,8 +615,8 @@ def perform_linear_chisq_fit(xdata, ydata, fit_mask, model_func_choice):
 
     Returns
     -------
-    results :
-        The x-bin centers
+    results : `tuple`
+        The parameters and covariance, in the same form as `scipy.optimize.leastsq`
     model_yvals : `array`
         The model values at the bins
     frac_resid : `array`
@@ -186,28 +624,278 @@ def perform_linear_chisq_fit(xdata, ydata, fit_mask, model_func_choice):
     frac_resid_err : `array`
         The uncertainty on the fractional residual
     """
-    if fit_mask is not None:
-        xdata_fit = xdata[fit_mask]
-        ydata_fit = ydata[fit_mask]
+    pars, covs, model_yvals, frac_resid, frac_resid_err =\
+        batched_linear_chisq_fit(xdata, ydata, fit_mask, model_func_choice)
+
+    fit_mask = slice(None) if fit_mask is None else fit_mask
+    infodict = dict(fvec=((ydata - model_yvals[0])/np.sqrt(ydata))[fit_mask])
+    results = (pars[0], covs[0], infodict, "Linear least-squares solution", 1)
+
+    return results, model_yvals[0], frac_resid[0], frac_resid_err[0]
+
+
+def flat_pair_stats(data_1, data_2, masks_1=None, masks_2=None, and_mask=0x7FF):
+    """Compute the flat pair statistics for a set of amps
+
+    This gives the same quantities as taking the afw statistics of the
+    ratio and the difference of the two flats, but works directly on the
+    arrays, reusing one scratch array rather than copying the images.
+
+    Parameters
+    ----------
+    data_1 : `list`
+        The arrays for the first flat, one per amp
+    data_2 : `list`
+        The arrays for the second flat, one per amp
+    masks_1 : `list` or `None`
+        The mask plane arrays for the first flat
+    masks_2 : `list` or `None`
+        The mask plane arrays for the second flat
+    and_mask : `int`
+        Mask bits that cause pixels to be ignored
+
+    Returns
+    -------
+    fratio : `array`
+        Mean of the ratio of the two flats, for each amp
+    fmean : `array`
+        Average of the means of the two flats
+    fcorrmean : `array`
+        Average of the means with the second flat scaled by fratio
+    fvar : `array`
+        Half the variance of the difference of the scaled flats
+    fmean1 : `array`
+        Mean of the first flat
+    fmean2 : `array`
+        Mean of the second flat
+    """
+    namps = len(data_1)
+    fmean1 = np.zeros((namps))
+    fmean2 = np.zeros((namps))
+    fratio = np.zeros((namps))
+    fvar = np.zeros((namps))
+    scratch = None
+
+    for i, (arr_1, arr_2) in enumerate(zip(data_1, data_2)):
+        good_1 = ~np.isnan(arr_1)
+        good_2 = ~np.isnan(arr_2)
+        if masks_1 is not None:
+            good_1 &= (masks_1[i] & and_mask) == 0
+        if masks_2 is not None:
+            good_2 &= (masks_2[i] & and_mask) == 0
+        good_12 = good_1 & good_2
+
+        if scratch is None or scratch.shape != arr_1.shape:
+            scratch = np.empty(arr_1.shape, np.float32)
+
+        fmean1[i] = np.mean(arr_1, where=good_1, dtype=np.float64)
+        fmean2[i] = np.mean(arr_2, where=good_2, dtype=np.float64)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(arr_1, arr_2, out=scratch)
+        fratio[i] = np.mean(scratch, where=good_12 & ~np.isnan(scratch), dtype=np.float64)
+
+        np.multiply(arr_2, np.float32(fratio[i]), out=scratch)
+        np.subtract(arr_1, scratch, out=scratch)
+        fvar[i] = np.var(scratch, where=good_12, ddof=1, dtype=np.float64)/2.
+
+    fmean = (fmean1 + fmean2)/2.
+    fcorrmean = (fmean1 + fratio*fmean2)/2.
+    return (fratio, fmean, fcorrmean, fvar, fmean1, fmean2)
+
+
+def sigma_clip_mean(data, nsigma=3., niter=3, good=None):
+    """Compute an iteratively sigma-clipped mean
+
+    This follows the afw MEANCLIP statistic: the clipping starts from the
+    median and the inter-quartile range, and then uses the mean and the
+    standard deviation of the pixels kept at each iteration.
+
+    Parameters
+    ----------
+    data : `array`
+        The data
+    nsigma : `float`
+        Number of standard deviations to clip at
+    niter : `int`
+        Number of clipping iterations
+    good : `array` or `None`
+        Mask of pixels to use, `None` to use all the pixels that are not NaN
+
+    Returns
+    -------
+    mean : `float`
+        The clipped mean
+    keep : `array`
+        Mask of the pixels that were kept
+    """
+    if good is None:
+        good = ~np.isnan(data)
+    vals = data[good]
+    if vals.size == 0:
+        return np.nan, good
+    center = np.median(vals)
+    quartiles = np.percentile(vals, [25., 75.])
+    sigma = 0.741*(quartiles[1] - quartiles[0])
+    keep = good
+    for _ in range(niter):
+        keep = good & (np.abs(data - center) <= nsigma*sigma)
+        vals = data[keep]
+        if vals.size == 0:
+            break
+        center = vals.mean(dtype=np.float64)
+        sigma = vals.std(dtype=np.float64)
+    return center, keep
+
+
+def clipped_background(data, binsize, nsigma=3.):
+    """Model the background of an image from sigma-clipped means in bins
+
+    This follows afw.math.makeBackground with MEANCLIP statistics,
+    interpolated with a cubic spline, the order is reduced if there
+    are too few bins.
+
+    Parameters
+    ----------
+    data : `array`
+        The image data
+    binsize : `int`
+        Size of the bins in pixels
+    nsigma : `float`
+        Number of standard deviations to clip at
+
+    Returns
+    -------
+    background : `array`
+        The background model, with the same shape as the data
+    """
+    n_y, n_x = data.shape
+    y_edges = np.linspace(0, n_y, max(n_y // binsize, 1) + 1).astype(int)
+    x_edges = np.linspace(0, n_x, max(n_x // binsize, 1) + 1).astype(int)
+    means = np.array([[sigma_clip_mean(data[y_0:y_1, x_0:x_1], nsigma)[0]
+                       for x_0, x_1 in zip(x_edges[0:-1], x_edges[1:])]
+                      for y_0, y_1 in zip(y_edges[0:-1], y_edges[1:])])
+    y_cent = (y_edges[0:-1] + y_edges[1:] - 1)/2.
+    x_cent = (x_edges[0:-1] + x_edges[1:] - 1)/2.
+
+    # A single bin along an axis gives a constant along that axis
+    if len(y_cent) == 1:
+        y_cent = np.array([0., n_y - 1.])
+        means = np.vstack([means, means])
+    if len(x_cent) == 1:
+        x_cent = np.array([0., n_x - 1.])
+        means = np.hstack([means, means])
+
+    spline = RectBivariateSpline(y_cent, x_cent, means,
+                                 bbox=[0., n_y - 1., 0., n_x - 1.],
+                                 kx=min(3, len(y_cent) - 1),
+                                 ky=min(3, len(x_cent) - 1))
+    return spline(np.arange(n_y), np.arange(n_x))
+
+
+def fft_covariance(diff, max_lag, **kwargs):
+    """Compute the covariances of an image at small lags with FFTs
+
+    All the lags are computed at once from one zero-padded FFT of the
+    (masked) image and one of the mask, so the cost does not grow with
+    the number of lags.  Outliers are removed by sigma-clipping the image
+    rather than the products of pixels, and each lag uses all the pixel
+    pairs available.
+
+    Parameters
+    ----------
+    diff : `array`
+        The image, typically the difference of two flats
+    max_lag : `int`
+        The largest lag to compute, in each direction
+
+    Keywords
+    --------
+    nsigma : `float` or `None`
+        Number of standard deviations to clip at, `None` for no clipping
+    binsize : `int` or `None`
+        Size of bins used to subtract the background, `None` for no subtraction
+    good : `array` or `None`
+        Mask of pixels to use
+
+    Returns
+    -------
+    cov : `array`
+        (max_lag+1, max_lag+1) array of covariances, indexed as [xlag, ylag]
+    cov_err : `array`
+        The statistical uncertainties on cov/cov[0, 0]
+    npix : `array`
+        The number of pixel pairs used for each lag
+    """
+    nsigma = kwargs.get('nsigma', None)
+    binsize = kwargs.get('binsize', None)
+    good = kwargs.get('good', None)
+
+    data = np.asarray(diff, dtype=float)
+    if good is None:
+        good = ~np.isnan(data)
+    if binsize is not None:
+        data = data - clipped_background(np.where(good, data, np.nan), binsize,
+                                         3. if nsigma is None else nsigma)
+    if nsigma is not None:
+        mean, good = sigma_clip_mean(data, nsigma, good=good)
     else:
-        xdata_fit = xdata
-        ydata_fit = ydata
-    mean_slope = (ydata_fit/xdata_fit).mean()
-
-    model_func = LINEARITY_FUNC_DICT[model_func_choice]
-
-    if model_func_choice == 1:
-        pars = (mean_slope,)
-    elif model_func_choice == 2:
-        pars = (mean_slope, 0.)
-    elif model_func_choice == 3:
-        pars = (mean_slope, 0., 0.)
-    results = scipy.optimize.leastsq(chi2_model, pars,
-                                     full_output=1,
-                                     args=(xdata_fit, ydata_fit, model_func))
-
-    model_yvals = model_func(results[0], xdata)
-    frac_resid = (ydata - model_yvals)/model_yvals
-    frac_resid_err = 1./ydata
+        mean = data[good].mean()
+
+    weights = good.astype(float)
+    centered = np.where(good, data - mean, 0.)
+
+    shape = (scipy.fft.next_fast_len(data.shape[0] + max_lag),
+             scipy.fft.next_fast_len(data.shape[1] + max_lag))
+    lags = (slice(0, max_lag + 1), slice(0, max_lag + 1))
+
+    def autocorrelate(vals):
+        """Sum of vals[y, x] * vals[y + ylag, x + xlag] for the lags we want"""
+        fvals = scipy.fft.rfft2(vals, shape)
+        return scipy.fft.irfft2(fvals * fvals.conj(), shape)[lags]
+
+    npix = np.round(autocorrelate(weights))
+    sum_prod = autocorrelate(centered)
+    sum_prod_sq = autocorrelate(centered**2)
+
+    cov = sum_prod / npix
+    std_prod = np.sqrt(np.clip(sum_prod_sq / npix - cov**2, 0., None))
+    ratio = cov / cov[0, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov_err = (std_prod / cov[0, 0]) / np.sqrt(npix) * np.sqrt((1 + ratio)/(1 - ratio))
+    cov_err[0, 0] = 0.
+    return cov.T, cov_err.T, npix.T
+
+
+def fft_covariance_amps(diffs, max_lag, **kwargs):
+    """Compute the covariances for a set of amps, optionally in parallel
+
+    Parameters
+    ----------
+    diffs : `list`
+        The images, one per amp
+    max_lag : `int`
+        The largest lag to compute, in each direction
+
+    Keywords
+    --------
+    nthreads : `int`
+        Number of amps to process at the same time
+    Other keywords are passed to `fft_covariance`
+
+    Returns
+    -------
+    o_list : `list`
+        The (cov, cov_err, npix) tuples for each amp
+    """
+    kwcopy = kwargs.copy()
+    nthreads = kwcopy.pop('nthreads', 1)
+
+    def process_amp(diff):
+        """Run the covariance calculation for one amp"""
+        return fft_covariance(diff, max_lag, **kwcopy)
 
-    return results, model_yvals, frac_resid, frac_resid_err
+    if nthreads is None or nthreads <= 1:
+        return [process_amp(diff) for diff in diffs]
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        return list(executor.map(process_amp, diffs))
@@ -16,9 +16,8 @@ from lsst.eo_utils.base.data_utils import TableDict, vstack_tables,\
 from lsst.eo_utils.base.butler_utils import make_file_dict
 
 from lsst.eo_utils.base.image_utils import REGION_KEYS, REGION_NAMES,\
-    raw_amp_image, get_readout_freqs_from_ccd, get_raw_image,\
-    get_geom_regions, get_amp_list, get_image_frames_2d, array_struct, unbias_amp,\
-    get_amp_offset
+    get_readout_freqs_from_ccd, get_raw_image, get_geom_regions, get_amp_list,\
+    get_image_frames_2d, array_struct, unbias_amp_images, prepare_superbias
 
 from lsst.eo_utils.base.iter_utils import AnalysisBySlot
 
@@ -76,7 +75,7 @@ class BiasFFTTask(BiasAnalysisTask):
             return None
 
         mask_files = self.get_mask_files()
-        superbias_frame = self.get_superbias_frame(mask_files)
+        superbias_frame = prepare_superbias(self.get_superbias_frame(mask_files))
 
         self.log_info_slot_msg(self.config, "%i files" % len(bias_files))
 
@@ -169,7 +168,7 @@ class BiasFFTTask(BiasAnalysisTask):
             Method to use to construct bias
         std : `bool`
             Used standard deviation instead of mean
-        superbias_frame : `MaskedCCD`
+        superbias_frame : `MaskedCCD` or `PreparedSuperbias`
             The superbias frame to subtract away
         """
         for_whom.safe_update(**kwargs)
@@ -178,19 +177,20 @@ class BiasFFTTask(BiasAnalysisTask):
         slot = kwargs['slot']
         ifile = kwargs.get('ifile', 0)
         nfiles_used = kwargs.get('nfiles_used', 1)
-        superbias_frame = kwargs.get('superbias_frame', None)
+        superbias = prepare_superbias(kwargs.get('superbias_frame', None))
 
         amps = get_amp_list(ccd)
-        offset = get_amp_offset(ccd, superbias_frame)
-
-        for i, amp in enumerate(amps):
-            regions = get_geom_regions(ccd, amp)
-            serial_oscan = regions['serial_overscan']
-            img = get_raw_image(ccd, amp)
-            superbias_im = raw_amp_image(superbias_frame, amp + offset)
-            image = unbias_amp(img, serial_oscan,
-                               bias_type=bias_type,
-                               superbias_im=superbias_im)
+        regions_list = [get_geom_regions(ccd, amp) for amp in amps]
+        if superbias is None:
+            superbias_ims = None
+        else:
+            superbias_ims = superbias.get_amp_images(ccd, amps)
+        images = unbias_amp_images([get_raw_image(ccd, amp) for amp in amps],
+                                   regions_list,
+                                   bias_type=bias_type,
+                                   superbias_ims=superbias_ims)
+
+        for i, (image, regions) in enumerate(zip(images, regions_list)):
             frames = get_image_frames_2d(image, regions)
             key_str = "fftpow_%s_a%02i" % (slot, i)
 
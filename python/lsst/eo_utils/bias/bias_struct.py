@@ -10,7 +10,7 @@ from lsst.eo_utils.base.butler_utils import make_file_dict
 
 from lsst.eo_utils.base.image_utils import REGION_KEYS, REGION_NAMES, REGION_LABELS,\
     get_dimension_arrays_from_ccd, get_raw_image, get_amp_offset,\
-    get_geom_regions, get_amp_list, get_image_frames_2d, array_struct, unbias_amp
+    get_geom_regions, get_amp_list, get_image_frames_2d, array_struct, unbias_amp_images
 
 from lsst.eo_utils.base.iter_utils import AnalysisBySlot
 
@@ -147,20 +147,17 @@ class BiasStructTask(BiasAnalysisTask):
         bias_type = self.get_bias_algo()
         bias_type_col = self.get_bias_col_algo()
         amps = get_amp_list(ccd)
-        for i, amp in enumerate(amps):
-            regions = get_geom_regions(ccd, amp)
-            serial_oscan = regions['serial_overscan']
-            parallel_oscan = regions['parallel_overscan']
-            img = get_raw_image(ccd, amp)
-            if superbias_frame is not None:
-                superbias_im = get_raw_image(superbias_frame, amp + offset)
-            else:
-                superbias_im = None
-            image = unbias_amp(img, serial_oscan,
-                               bias_type=bias_type,
-                               bias_type_col=bias_type_col,
-                               superbias_im=superbias_im,
-                               parallel_oscan=parallel_oscan)
+        regions_list = [get_geom_regions(ccd, amp) for amp in amps]
+        if superbias_frame is not None:
+            superbias_ims = [get_raw_image(superbias_frame, amp + offset) for amp in amps]
+        else:
+            superbias_ims = None
+        images = unbias_amp_images([get_raw_image(ccd, amp) for amp in amps],
+                                   regions_list,
+                                   bias_type=bias_type,
+                                   bias_type_col=bias_type_col,
+                                   superbias_ims=superbias_ims)
+        for i, (image, regions) in enumerate(zip(images, regions_list)):
             frames = get_image_frames_2d(image, regions)
 
             for key, region in zip(REGION_KEYS, REGION_NAMES):
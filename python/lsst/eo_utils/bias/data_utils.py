@@ -6,7 +6,7 @@ from lsst.eo_utils.base.defaults import DEFAULT_BIAS_TYPE
 
 from lsst.eo_utils.base.image_utils import REGION_KEYS, REGION_NAMES,\
     raw_amp_image, get_geom_regions, get_raw_image, get_amp_list,\
-    get_image_frames_2d, array_struct, unbias_amp, get_amp_offset
+    get_image_frames_2d, array_struct, unbias_amp_images, get_amp_offset
 
 
 def stack_by_amps(stack_arrays, ccd, **kwargs):
@@ -37,13 +37,13 @@ def stack_by_amps(stack_arrays, ccd, **kwargs):
     amps = get_amp_list(ccd)
     offset = get_amp_offset(ccd, superbias_frame)
 
-    for i, amp in enumerate(amps):
+    regions_list = [get_geom_regions(ccd, amp) for amp in amps]
+    images = unbias_amp_images([get_raw_image(ccd, amp) for amp in amps],
+                               regions_list, bias_type=bias_type,
+                               superbias_ims=[raw_amp_image(superbias_frame, amp + offset)
+                                              for amp in amps])
 
-        regions = get_geom_regions(ccd, amp)
-        serial_oscan = regions['serial_overscan']
-        img = get_raw_image(ccd, amp)
-        superbias_im = raw_amp_image(superbias_frame, amp + offset)
-        image = unbias_amp(img, serial_oscan, bias_type=bias_type, superbias_im=superbias_im)
+    for i, (image, regions) in enumerate(zip(images, regions_list)):
         frames = get_image_frames_2d(image, regions)
 
         for key, region in zip(REGION_KEYS, REGION_NAMES):
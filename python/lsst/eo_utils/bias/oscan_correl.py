@@ -15,7 +15,8 @@ from lsst.eo_utils.base.data_utils import TableDict
 from lsst.eo_utils.base.butler_utils import make_file_dict
 
 from lsst.eo_utils.base.image_utils import get_raw_image,\
-    get_geom_regions, get_amp_list, unbias_amp
+    get_geom_regions, get_amp_list, unbias_amp,\
+    read_region_arrays, bbox_to_slices
 
 from lsst.eo_utils.base.iter_utils import AnalysisByRaft
 
@@ -76,8 +77,14 @@ class OscanCorrelTask(BiasAnalysisTask):
             mask_files = self.get_mask_files(slot=slot)
             superbias_frame = self.get_superbias_frame(mask_files, slot=slot)
 
-            ccd = self.get_ccd(butler, bias_files[0], [])
-            overscans += self.get_ccd_data(butler, ccd, superbias_frame=superbias_frame)
+            if butler is None:
+                region_arrays = read_region_arrays(bias_files[0],
+                                                   regionlist=['serial_overscan'])
+                overscans += self.get_region_data(region_arrays,
+                                                  superbias_frame=superbias_frame)
+            else:
+                ccd = self.get_ccd(butler, bias_files[0], [])
+                overscans += self.get_ccd_data(butler, ccd, superbias_frame=superbias_frame)
 
         namps = len(overscans)
 
@@ -156,4 +163,38 @@ class OscanCorrelTask(BiasAnalysisTask):
             overscans.append(oscan_data.getArray()[::step_x, ::step_y])
         return overscans
 
+    def get_region_data(self, region_arrays, **kwargs):
+        """Get the serial overscan data from arrays read with `read_region_arrays`
+
+        This gives the same result as `get_ccd_data` for un-Butlerized data,
+        but without reading the imaging regions or building afw images.
+
+        Parameters
+        ----------
+        region_arrays : `dict`
+            The serial overscan arrays, keyed by amp
+
+        Keywords
+        --------
+        superbias_frame : `MaskedCCD`
+            The superbias frame to subtract away
+
+        Returns
+        -------
+        overscans : `list`
+            The overscan data
+        """
+        superbias_frame = kwargs.get('superbias_frame', None)
+        trim = slice(self.boundry, -self.boundry)
+        overscans = []
+        for amp, amp_arrays in sorted(region_arrays.items()):
+            oscan_data = amp_arrays['serial_overscan']
+            if superbias_frame is not None:
+                serial_oscan = get_geom_regions(superbias_frame, amp)['serial_overscan']
+                superbias_im = self.get_superbias_amp_image(None, superbias_frame, amp)
+                oscan_data = oscan_data -\
+                    superbias_im.getImage().getArray()[bbox_to_slices(serial_oscan)]
+            overscans.append(oscan_data[trim, trim])
+        return overscans
+
 EO_TASK_FACTORY.add_task_class('OscanCorrel', OscanCorrelTask)
@@ -4,27 +4,25 @@ import os
 
 import lsst.afw.math as afwMath
 
-import lsst.eotest.image_utils as imutil
-
 from lsst.eo_utils.base.defaults import ALL_SLOTS
 
 from lsst.eo_utils.base.file_utils import makedir_safe,\
     SUPERBIAS_FORMATTER, SUPERBIAS_STAT_FORMATTER
 
-from lsst.eo_utils.base.butler_utils import get_filename_from_id
+from lsst.eo_utils.base.butler_utils import get_filename_from_id, get_file_keys
 
 from lsst.eo_utils.base.defaults import DEFAULT_STAT_TYPE
 
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
 from lsst.eo_utils.base.data_utils import TableDict, stack_summary_table,\
-    get_run_config_table
+    get_run_config_table, DefectIndex
 
 from lsst.eo_utils.base.plot_utils import plot_outlier_summary
 
-from lsst.eo_utils.base.image_utils import flip_data_in_place,\
+from lsst.eo_utils.base.image_utils import write_calib_fits,\
     stack_images, extract_raft_unbiased_images, extract_raft_imaging_data,\
-    outlier_raft_dict, build_defect_dict
+    outlier_raft_dict, build_defect_dict, StackAccumulator, accumulate_images
 
 from lsst.eo_utils.base.iter_utils import AnalysisBySlot
 
@@ -43,6 +41,8 @@ class SuperbiasConfig(BiasAnalysisConfig):
     """Configuration for BiasVRowTask"""
     stat = EOUtilOptions.clone_param('stat')
     bitpix = EOUtilOptions.clone_param('bitpix')
+    compress = EOUtilOptions.clone_param('compress')
+    quantize_level = EOUtilOptions.clone_param('quantize_level')
     skip = EOUtilOptions.clone_param('skip')
     plot = EOUtilOptions.clone_param('plot')
     stats_hist = EOUtilOptions.clone_param('stats_hist')
@@ -50,6 +50,8 @@ class SuperbiasConfig(BiasAnalysisConfig):
     vmin = EOUtilOptions.clone_param('vmin')
     vmax = EOUtilOptions.clone_param('vmax')
     nbins = EOUtilOptions.clone_param('nbins')
+    incremental = EOUtilOptions.clone_param('incremental')
+    stack_nsample = EOUtilOptions.clone_param('stack_nsample')
 
 
 class SuperbiasTask(BiasAnalysisTask):
@@ -136,6 +138,50 @@ class SuperbiasTask(BiasAnalysisTask):
         self.log_progress("Done!")
         return sbias
 
+    def extract_incremental(self, butler, data, accum_file):
+        """Add new bias frames to the running statistics of a superbias frame
+
+        Parameters
+        ----------
+        butler : `Butler`
+            The data butler
+        data : `dict`
+            Dictionary (or other structure) contain the input data
+        accum_file : `str`
+            File with the running statistics, it is read if it exists and
+            rewritten with the new frames added
+
+        Returns
+        -------
+        sbias : `dict`
+            The superbias frames, keyed by amp
+        """
+        stat_type = self.config.stat
+        if stat_type is None:
+            stat_type = DEFAULT_STAT_TYPE
+
+        if os.path.exists(accum_file):
+            accum = StackAccumulator.load(accum_file)
+        else:
+            accum = StackAccumulator(self.config.stack_nsample)
+
+        # Note that we are deliberately skipping the first bias frame
+        bias_files = self.get_input_files(data)[1:]
+        nadded = accumulate_images(accum, butler, bias_files,
+                                   file_keys=get_file_keys(bias_files),
+                                   bias_type=self.get_bias_algo(),
+                                   bias_type_col=self.get_bias_col_algo(),
+                                   log=self.log)
+        self.log_info_slot_msg(self.config, "%i new files, %i total" % (nadded, accum.nframes))
+
+        if accum.nframes < 2:
+            self.log_warn_slot_msg(self.config, "Not enough files to stack %i < 2" % accum.nframes)
+            return None
+
+        if nadded:
+            accum.save(accum_file)
+        return accum.stack(stat_type, nsigma_clip=10.)
+
 
     def make_superbias(self, butler, slot_data, **kwargs):
         """Stack the input data to make superbias frames
@@ -178,7 +224,11 @@ class SuperbiasTask(BiasAnalysisTask):
         makedir_safe(output_file)
 
         if not self.config.skip:
-            out_data = self.extract(butler, slot_data)
+            if self.config.incremental:
+                out_data = self.extract_incremental(butler, slot_data,
+                                                    output_file.replace('.fits', '_accum.fits'))
+            else:
+                out_data = self.extract(butler, slot_data)
             if out_data is None:
                 self.log_warn_slot_msg(self.config, "extract() returned None.")
                 return
@@ -187,9 +237,10 @@ class SuperbiasTask(BiasAnalysisTask):
             else:
                 template_file = get_filename_from_id(butler, data_files[0])
 
-            imutil.writeFits(out_data, output_file, template_file, self.config.bitpix)
-            if butler is not None:
-                flip_data_in_place(output_file)
+            write_calib_fits(out_data, output_file, template_file, self.config.bitpix,
+                             compress=self.config.compress,
+                             quantize_level=self.config.quantize_level,
+                             flip=butler is not None)
 
         try:
             self._superbias_frame = self.get_ccd(None, output_file, mask_files)
@@ -286,6 +337,7 @@ class SuperbiasRaftConfig(SuperbiasRaftTableAnalysisConfig):
     filekey = EOUtilOptions.clone_param('filekey', default='sbias')
     stats_hist = EOUtilOptions.clone_param('stats_hist')
     mosaic = EOUtilOptions.clone_param('mosaic')
+    nthreads = EOUtilOptions.clone_param('nthreads')
 
 
 class SuperbiasRaftTask(SuperbiasRaftTableAnalysisTask):
@@ -349,9 +401,11 @@ class SuperbiasRaftTask(SuperbiasRaftTableAnalysisTask):
         self._sbias_arrays = extract_raft_imaging_data(self._sbias_images, ccd_dict)
         fp_dict = build_defect_dict(self._sbias_images, fp_type='bright', abs_thresh=50)
 
-        out_data = outlier_raft_dict(self._sbias_arrays, 0., 50.)
+        out_data = outlier_raft_dict(self._sbias_arrays, 0., 50.,
+                                     nthreads=self.config.nthreads)
         dtables = TableDict()
         dtables.make_datatable('defects', fp_dict)
+        dtables.add_datatable('defects_index', DefectIndex(dtables['defects']).to_table())
         dtables.make_datatable('outliers', out_data)
         return dtables
 
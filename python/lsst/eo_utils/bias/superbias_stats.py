@@ -15,7 +15,7 @@ from lsst.eo_utils.base.file_utils import SUPERBIAS_STAT_FORMATTER
 
 from lsst.eo_utils.base.butler_utils import make_file_dict
 
-from lsst.eo_utils.base.image_utils import get_raw_image, get_amp_list
+from lsst.eo_utils.base.image_utils import read_calib_amp_array
 
 from lsst.eo_utils.base.factory import EO_TASK_FACTORY
 
@@ -82,14 +82,13 @@ class SuperbiasStatsTask(SuperbiasRaftTableAnalysisTask):
 
             self.log_progress("  %s" % slot)
 
-            mask_files = self.get_mask_files(slot=slot)
-
             try:
-                superbias_frame = self.get_ccd(None, superbias_file, mask_files)
+                superbias_arrays = [read_calib_amp_array(superbias_file, amp)
+                                    for amp in range(1, 17)]
             except Exception:
                 self.log.warn("Skipping %s:%s:%s" % (self.config.run, self.config.raft, slot))
-                superbias_frame = None
-            self.get_superbias_stats(superbias_frame, stats_data, islot)
+                superbias_arrays = None
+            self.get_superbias_stats(superbias_arrays, stats_data, islot)
 
         self.log_progress("Done!")
 
@@ -123,15 +122,13 @@ class SuperbiasStatsTask(SuperbiasRaftTableAnalysisTask):
 
 
     @staticmethod
-    def get_superbias_stats(superbias, stats_data, islot):
+    def get_superbias_stats(superbias_arrays, stats_data, islot):
         """Get the serial overscan data
 
         Parameters
         ----------
-        butler : `Butler`
-            The data butler
-        superbias : `MaskedCCD`
-            The ccd we are getting data from
+        superbias_arrays : `list` or `None`
+            The superbias data arrays, one per amp
         stats_data : `dict`
             The data we are updating
 
@@ -147,18 +144,15 @@ class SuperbiasStatsTask(SuperbiasRaftTableAnalysisTask):
             stats_data['min'] = np.zeros((9, 16))
             stats_data['max'] = np.zeros((9, 16))
 
-        if superbias is None:
+        if superbias_arrays is None:
             return
 
-        amps = get_amp_list(superbias)
-        for i, amp in enumerate(amps):
-
-            img = get_raw_image(superbias, amp).image
-            stats_data['mean'][islot, i] = img.array.mean()
-            stats_data['median'][islot, i] = np.median(img.array)
-            stats_data['std'][islot, i] = img.array.std()
-            stats_data['min'][islot, i] = img.array.min()
-            stats_data['max'][islot, i] = img.array.max()
+        for i, amp_array in enumerate(superbias_arrays):
+            stats_data['mean'][islot, i] = amp_array.mean()
+            stats_data['median'][islot, i] = np.median(amp_array)
+            stats_data['std'][islot, i] = amp_array.std()
+            stats_data['min'][islot, i] = amp_array.min()
+            stats_data['max'][islot, i] = amp_array.max()
 
 
 class SuperbiasSummaryConfig(SuperbiasSummaryAnalysisConfig):
@@ -11,10 +11,9 @@ from lsst.eo_utils.base.config_utils import EOUtilOptions
 from lsst.eo_utils.base.data_utils import TableDict, vstack_tables,\
     get_run_config_table
 
-from lsst.eo_utils.base.stat_utils import gauss_fit
+from lsst.eo_utils.base.stat_utils import batched_histograms, batched_gauss_fit
 
-from lsst.eo_utils.base.image_utils import get_exposure_time,\
-    get_amp_list, get_raw_image, get_geom_regions
+from lsst.eo_utils.base.image_utils import get_exposure_time, ArrayCCD
 
 from lsst.eo_utils.base.factory import EO_TASK_FACTORY
 
@@ -81,44 +80,49 @@ class DarkCurrentTask(DarkRaftTableAnalysisTask):
 
         self.log_info_raft_msg(self.config, "")
 
+        hist_edges = []
+        hist_counts = []
         for islot, slot in enumerate(slots):
 
             self.log_progress("  %s" % slot)
 
-            mask_files = self.get_mask_files(slot=slot)
             superdark_file = data[slot]
 
             if not os.path.exists(superdark_file):
                 self.log.warn("  %s does not exist, skipping" % superdark_file)
                 continue
 
-            superdark_frame = self.get_ccd(None, superdark_file, mask_files)
+            superdark_frame = ArrayCCD(superdark_file)
             exptime = get_exposure_time(superdark_frame)
 
-            amps = get_amp_list(superdark_frame)
-            for iamp, amp in enumerate(amps):
-                regions = get_geom_regions(superdark_frame, amp)
-                imaging = regions['imaging']
-                superdark_im = get_raw_image(superdark_frame, amp).image
-                image_data = superdark_im[imaging].array
-                median = np.median(image_data)
-                stdev = np.std(image_data)
-                hist_bins = np.linspace(median - 5 * stdev, median + 5 * stdev, 101)
-                hist = np.histogram(image_data, bins=hist_bins)
-                fit_result = gauss_fit(hist)
-                fit_pars = fit_result[0]
-                dark_current_data['median'].append(median)
-                dark_current_data['stdev'].append(stdev)
+            image_list = [superdark_frame.get_region(amp, 'imaging')
+                          for amp in superdark_frame.amps()]
+            medians = np.array([np.median(image_data) for image_data in image_list])
+            stdevs = np.array([np.std(image_data) for image_data in image_list])
+            hist_bins = np.linspace(medians - 5 * stdevs, medians + 5 * stdevs, 101, axis=1)
+            hist_edges.append(hist_bins)
+            hist_counts.append(batched_histograms(image_list, hist_bins))
+
+            for iamp, image_data in enumerate(image_list):
+                dark_current_data['median'].append(medians[iamp])
+                dark_current_data['stdev'].append(stdevs[iamp])
                 dark_current_data['mean'].append(np.mean(image_data))
-                dark_current_data['fit_mean'].append(fit_pars[1])
-                dark_current_data['fit_width'].append(fit_pars[2])
-                dark_current_data['fit_dof'].append(0.)
-                dark_current_data['fit_chi2'].append(0.)
                 dark_current_data['exptime'].append(exptime)
-                dark_current_data['current'].append(median/exptime)
+                dark_current_data['current'].append(medians[iamp]/exptime)
                 dark_current_data['slot'].append(islot)
                 dark_current_data['amp'].append(iamp)
 
+            superdark_frame.close()
+
+        # Fit the histograms of all the amps on the raft together
+        if hist_counts:
+            fit_pars, fit_chi2, fit_dof, _ = batched_gauss_fit(np.vstack(hist_edges),
+                                                                np.vstack(hist_counts))
+            dark_current_data['fit_mean'] = fit_pars[:, 1]
+            dark_current_data['fit_width'] = fit_pars[:, 2]
+            dark_current_data['fit_dof'] = np.full(len(fit_chi2), float(fit_dof))
+            dark_current_data['fit_chi2'] = fit_chi2
+
         self.log_progress("Done!")
 
         dtables = TableDict()
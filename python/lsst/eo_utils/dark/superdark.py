@@ -4,8 +4,6 @@ import os
 
 import lsst.afw.math as afwMath
 
-import lsst.eotest.image_utils as imutil
-
 from lsst.eo_utils.base.defaults import ALL_SLOTS
 
 from lsst.eo_utils.base.file_utils import makedir_safe
@@ -17,11 +15,11 @@ from lsst.eo_utils.base.defaults import DEFAULT_STAT_TYPE
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
 from lsst.eo_utils.base.data_utils import TableDict, stack_summary_table,\
-    get_run_config_table
+    get_run_config_table, DefectIndex
 
 from lsst.eo_utils.base.plot_utils import plot_outlier_summary
 
-from lsst.eo_utils.base.image_utils import flip_data_in_place,\
+from lsst.eo_utils.base.image_utils import write_calib_fits,\
     stack_images, extract_raft_unbiased_images, extract_raft_imaging_data,\
     outlier_raft_dict, build_defect_dict
 
@@ -48,6 +46,8 @@ class SuperdarkConfig(DarkAnalysisConfig):
     """Configuration for SuperdarkTask"""
     stat = EOUtilOptions.clone_param('stat')
     bitpix = EOUtilOptions.clone_param('bitpix')
+    compress = EOUtilOptions.clone_param('compress')
+    quantize_level = EOUtilOptions.clone_param('quantize_level')
     skip = EOUtilOptions.clone_param('skip')
     plot = EOUtilOptions.clone_param('plot')
     stats_hist = EOUtilOptions.clone_param('stats_hist')
@@ -154,9 +154,10 @@ class SuperdarkTask(DarkAnalysisTask):
             else:
                 template_file = get_filename_from_id(butler, slot_data['DARK'][0])
 
-            imutil.writeFits(sdark, output_file, template_file, self.config.bitpix)
-            if butler is not None:
-                flip_data_in_place(output_file)
+            write_calib_fits(sdark, output_file, template_file, self.config.bitpix,
+                             compress=self.config.compress,
+                             quantize_level=self.config.quantize_level,
+                             flip=butler is not None)
 
         self._superdark_frame = self.get_ccd(None, output_file, mask_files)
 
@@ -233,6 +234,7 @@ class SuperdarkRaftConfig(DarkAnalysisConfig):
     slots = EOUtilOptions.clone_param('slots')
     stats_hist = EOUtilOptions.clone_param('stats_hist')
     mosaic = EOUtilOptions.clone_param('mosaic')
+    nthreads = EOUtilOptions.clone_param('nthreads')
 
 
 class SuperdarkRaftTask(AnalysisTask):
@@ -300,12 +302,14 @@ class SuperdarkRaftTask(AnalysisTask):
 
         self._sdark_arrays = extract_raft_imaging_data(self._sdark_images, ccd_dict)
 
-        out_data = outlier_raft_dict(self._sdark_arrays, 0., 25.)
+        out_data = outlier_raft_dict(self._sdark_arrays, 0., 25.,
+                                     nthreads=self.config.nthreads)
 
         fp_dict = build_defect_dict(self._sdark_images, fp_type='bright', abs_thresh=50)
 
         dtables = TableDict()
         dtables.make_datatable('defects', fp_dict)
+        dtables.add_datatable('defects_index', DefectIndex(dtables['defects']).to_table())
         dtables.make_datatable('outliers', out_data)
         return dtables
 
@@ -3,8 +3,6 @@
 
 import lsst.afw.math as afwMath
 
-import lsst.eotest.image_utils as imutil
-
 from lsst.eo_utils.base.file_utils import makedir_safe
 
 from lsst.eo_utils.base.butler_utils import get_filename_from_id
@@ -13,7 +11,7 @@ from lsst.eo_utils.base.defaults import DEFAULT_STAT_TYPE
 
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
-from lsst.eo_utils.base.image_utils import flip_data_in_place,\
+from lsst.eo_utils.base.image_utils import write_calib_fits,\
     stack_images
 
 from lsst.eo_utils.base.iter_utils import SummaryAnalysisBySlotIterator
@@ -37,6 +35,8 @@ class SuperdarkStabilityConfig(SuperdarkSlotTableAnalysisConfig):
     vmax = EOUtilOptions.clone_param('vmax')
     nbins = EOUtilOptions.clone_param('nbins')
     bitpix = EOUtilOptions.clone_param('bitpix')
+    compress = EOUtilOptions.clone_param('compress')
+    quantize_level = EOUtilOptions.clone_param('quantize_level')
 
 
 class SuperdarkStabilityTask(SuperdarkSlotTableAnalysisTask):
@@ -149,9 +149,10 @@ class SuperdarkStabilityTask(SuperdarkSlotTableAnalysisTask):
             else:
                 template_file = get_filename_from_id(butler, slot_data[0])
 
-            imutil.writeFits(out_data, output_file, template_file, self.config.bitpix)
-            if butler is not None:
-                flip_data_in_place(output_file)
+            write_calib_fits(out_data, output_file, template_file, self.config.bitpix,
+                             compress=self.config.compress,
+                             quantize_level=self.config.quantize_level,
+                             flip=butler is not None)
 
         try:
             self._superdark_frame = self.get_ccd(None, output_file, mask_files)
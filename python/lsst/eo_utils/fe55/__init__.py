@@ -9,7 +9,11 @@ from .analysis import Fe55AnalysisConfig, Fe55AnalysisTask
 
 from .meta_analysis import Fe55RaftTableAnalysisConfig,\
     Fe55RaftTableAnalysisTask,\
+    Fe55RunTableAnalysisConfig, Fe55RunTableAnalysisTask,\
     Fe55SummaryAnalysisConfig, Fe55SummaryAnalysisTask
 
+from .fe55_clusters import Fe55ClustersConfig, Fe55ClustersTask
+
 from .fe55_gain import Fe55GainStatsConfig, Fe55GainStatsTask,\
+    Fe55GainFocalPlaneConfig, Fe55GainFocalPlaneTask,\
     Fe55GainSummaryConfig, Fe55GainSummaryTask
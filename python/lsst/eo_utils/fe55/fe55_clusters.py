@@ -0,0 +1,254 @@
+"""Class to find the clusters in fe55 frames"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from lsst.eo_utils.base.config_utils import EOUtilOptions
+
+from lsst.eo_utils.base.data_utils import TableDict
+
+from lsst.eo_utils.base.butler_utils import make_file_dict
+
+from lsst.eo_utils.base.image_utils import get_amp_list,\
+    unbiased_ccd_image_dict, prepare_superbias,\
+    summed_area_table, box_sums, find_footprints
+
+from lsst.eo_utils.base.factory import EO_TASK_FACTORY
+
+from .analysis import Fe55AnalysisConfig, Fe55AnalysisTask
+
+
+FE55_CLUSTER_KEYS = ['XPOS', 'YPOS', 'SIGMAX', 'SIGMAY', 'DN', 'DN_SUM',
+                     'MAXDN', 'NPIX', 'XPEAK', 'YPEAK']
+
+
+def find_fe55_clusters(data, **kwargs):
+    """Find the fe55 clusters in an amp image
+
+    The clusters are the footprints of connected pixels above threshold,
+    the signals are taken from boxes centered on the brightest pixel
+    of each footprint, using a summed-area table.
+
+    Parameters
+    ----------
+    data : `array`
+        The unbiased image data
+
+    Keywords
+    --------
+    nsig : `float`
+        Detection threshold, in units of the pixel noise
+    max_npix : `int`
+        Clusters with more pixels above threshold are rejected
+
+    Returns
+    -------
+    o_dict : `dict`
+        Arrays with the cluster quantities, keyed by `FE55_CLUSTER_KEYS`.
+        DN and DN_SUM are the 5x5 and 3x3 sums about the peak,
+        the positions and widths are the moments of the 5x5 box.
+    """
+    nsig = kwargs.get('nsig', 4.)
+    max_npix = kwargs.get('max_npix', 25)
+
+    image = np.asarray(data, float)
+    image = image - np.median(image)
+    noise = 1.4826 * np.median(np.fabs(image))
+
+    labels, _, peaks = find_footprints(image, nsig*noise)
+    npix = np.bincount(labels.ravel(), minlength=len(peaks) + 1)[1:]
+    keep = npix <= max_npix
+    npix = npix[keep]
+    ypeak, xpeak = peaks[keep].T
+
+    # Sums over the 3x3 and 5x5 boxes, truncated at the edges of the image
+    sat = summed_area_table(image)
+    nrow, ncol = image.shape
+    dn_sum = box_sums(sat, (ypeak - 1).clip(0, nrow), (xpeak - 1).clip(0, ncol),
+                      (ypeak + 2).clip(0, nrow), (xpeak + 2).clip(0, ncol))
+    dn_fp = box_sums(sat, (ypeak - 2).clip(0, nrow), (xpeak - 2).clip(0, ncol),
+                     (ypeak + 3).clip(0, nrow), (xpeak + 3).clip(0, ncol))
+
+    # Moments of the positive pixels in the 5x5 boxes
+    offsets = np.arange(-2, 3)
+    padded = np.pad(image, 2)
+    cutouts = padded[(ypeak + 2)[:, np.newaxis, np.newaxis] + offsets[:, np.newaxis],
+                     (xpeak + 2)[:, np.newaxis, np.newaxis] + offsets].clip(0., None)
+    wsum = cutouts.sum(axis=(1, 2))
+    wsum[wsum <= 0.] = 1.
+    yproj = cutouts.sum(axis=2)
+    xproj = cutouts.sum(axis=1)
+    ymean = np.dot(yproj, offsets) / wsum
+    xmean = np.dot(xproj, offsets) / wsum
+    sigmay = np.sqrt((np.dot(yproj, offsets*offsets) / wsum - ymean*ymean).clip(0., None))
+    sigmax = np.sqrt((np.dot(xproj, offsets*offsets) / wsum - xmean*xmean).clip(0., None))
+
+    return dict(XPOS=xpeak + xmean,
+                YPOS=ypeak + ymean,
+                SIGMAX=sigmax,
+                SIGMAY=sigmay,
+                DN=dn_fp,
+                DN_SUM=dn_sum,
+                MAXDN=image[ypeak, xpeak],
+                NPIX=npix,
+                XPEAK=xpeak,
+                YPEAK=ypeak)
+
+
+def find_fe55_clusters_amps(images, **kwargs):
+    """Find the fe55 clusters in a set of amp images
+
+    Parameters
+    ----------
+    images : `list`
+        The unbiased image data for each amp
+
+    Keywords
+    --------
+    nthreads : `int`
+        Number of amps to process at the same time
+    Other keywords are passed to `find_fe55_clusters`
+
+    Returns
+    -------
+    o_list : `list`
+        The `find_fe55_clusters` results for each amp
+    """
+    kwcopy = kwargs.copy()
+    nthreads = kwcopy.pop('nthreads', 1)
+
+    def process_amp(data):
+        """Find the clusters in one amp"""
+        return find_fe55_clusters(data, **kwcopy)
+
+    if nthreads is None or nthreads <= 1:
+        return [process_amp(data) for data in images]
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        return list(executor.map(process_amp, images))
+
+
+class Fe55ClustersConfig(Fe55AnalysisConfig):
+    """Configuration for Fe55ClustersTask"""
+    filekey = EOUtilOptions.clone_param('filekey', default='fe55-clusters')
+    fe55_nsig = EOUtilOptions.clone_param('fe55_nsig')
+    fe55_max_npix = EOUtilOptions.clone_param('fe55_max_npix')
+    nthreads = EOUtilOptions.clone_param('nthreads')
+
+
+class Fe55ClustersTask(Fe55AnalysisTask):
+    """Find the clusters in the fe55 frames"""
+
+    ConfigClass = Fe55ClustersConfig
+    _DefaultName = "Fe55ClustersTask"
+
+    plot_names = ['dn']
+
+    def extract(self, butler, data, **kwargs):
+        """Extract the fe55 clusters
+
+        Parameters
+        ----------
+        butler : `Butler`
+            The data butler
+        data : `dict`
+            Dictionary (or other structure) contain the input data
+        kwargs
+            Used to override default configuration
+
+        Returns
+        -------
+        dtables : `TableDict`
+            Output data tables, one 'ampXX' table per amp,
+            with the same columns as the eotest cluster tables
+        """
+        self.safe_update(**kwargs)
+
+        fe55_files = data['FE55']
+        if self.config.nfiles is not None:
+            fe55_files = fe55_files[0:self.config.nfiles]
+
+        bias_type = self.get_bias_algo()
+        mask_files = self.get_mask_files()
+        superbias_frame = prepare_superbias(self.get_superbias_frame(mask_files))
+
+        self.log_info_slot_msg(self.config, "%i files" % len(fe55_files))
+
+        amp_lists = [{key: [] for key in FE55_CLUSTER_KEYS + ['FRAME']} for _ in range(16)]
+
+        def read_images(fe55_file):
+            """Read and unbias the imaging data of the amps of one file"""
+            ccd = self.get_ccd(butler, fe55_file, mask_files)
+            ccd_ims = unbiased_ccd_image_dict(ccd, bias=bias_type,
+                                              superbias_frame=superbias_frame,
+                                              trim='imaging')
+            return [ccd_ims[amp].image.array for amp in get_amp_list(ccd)]
+
+        # With more than one thread, the next file is read and unbiased
+        # while the clusters are found in the current one
+        nthreads = self.config.nthreads
+        prefetch = nthreads is not None and nthreads > 1 and len(fe55_files) > 0
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            if prefetch:
+                next_images = reader.submit(read_images, fe55_files[0])
+
+            for ifile, fe55_file in enumerate(fe55_files):
+
+                if ifile % 10 == 0:
+                    self.log_progress("  %i" % ifile)
+
+                if prefetch:
+                    images = next_images.result()
+                    if ifile + 1 < len(fe55_files):
+                        next_images = reader.submit(read_images, fe55_files[ifile + 1])
+                else:
+                    images = read_images(fe55_file)
+
+                clusters = find_fe55_clusters_amps(images,
+                                                   nsig=self.config.fe55_nsig,
+                                                   max_npix=self.config.fe55_max_npix,
+                                                   nthreads=nthreads)
+
+                for i, amp_clusters in enumerate(clusters):
+                    for key, val in amp_clusters.items():
+                        amp_lists[i][key].append(val)
+                    amp_lists[i]['FRAME'].append(np.full(len(amp_clusters['DN']), ifile))
+
+        self.log_progress("Done!")
+
+        dtables = TableDict()
+        dtables.make_datatable('files', make_file_dict(butler, fe55_files))
+        for i, amp_list in enumerate(amp_lists):
+            amp_dict = {key: np.concatenate(val) for key, val in amp_list.items() if val}
+            amp_dict['AMPLIFIER'] = np.full(len(amp_dict.get('DN', [])), i+1)
+            dtables.make_datatable('amp%02i' % (i+1), amp_dict)
+
+        return dtables
+
+
+    def plot(self, dtables, figs, **kwargs):
+        """Plot the cluster signals
+
+        Parameters
+        ----------
+        dtables : `TableDict`
+            The data produced by this task
+        figs : `FigureDict`
+            The resulting figures
+        kwargs
+            Used to override default configuration
+        """
+        self.safe_update(**kwargs)
+
+        figs.setup_amp_plots_grid('dn', title="Fe55 cluster signals",
+                                  xlabel="DN (5x5)", ylabel="Clusters")
+        for i in range(16):
+            table = dtables['amp%02i' % (i+1)]
+            if not table:
+                continue
+            signals = table['DN']
+            xmax = 2.*np.median(signals)
+            figs.get_obj('dn', 'axs').flat[i].hist(signals, bins=100, range=(0., xmax))
+
+
+EO_TASK_FACTORY.add_task_class('Fe55Clusters', Fe55ClustersTask)
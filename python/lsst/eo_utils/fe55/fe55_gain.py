@@ -1,7 +1,13 @@
 """Class to analyze the gains from fe55 cluster fitting"""
 
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
+from astropy.io import fits
+
 from lsst.eotest.sensor import Fe55GainFitter
 
 from lsst.eo_utils.base.defaults import ALL_SLOTS
@@ -14,14 +20,185 @@ from lsst.eo_utils.base.factory import EO_TASK_FACTORY
 
 from lsst.eo_utils.fe55.meta_analysis import Fe55RaftTableAnalysisConfig,\
     Fe55RaftTableAnalysisTask,\
+    Fe55RunTableAnalysisConfig, Fe55RunTableAnalysisTask,\
     Fe55SummaryAnalysisConfig, Fe55SummaryAnalysisTask
 
 
+FE55_CLUSTER_COLUMNS = ['DN', 'XPOS', 'XPEAK', 'YPOS', 'YPEAK', 'SIGMAX', 'SIGMAY']
+
+
+def read_fe55_cluster_arrays(filepath, namps=16):
+    """Read the columns needed for the gain fits from a fe55 cluster file
+
+    Parameters
+    ----------
+    filepath : `str`
+        The file with the cluster tables, one 'ampXX' table per amp
+    namps : `int`
+        Number of amps to read
+
+    Returns
+    -------
+    o_list : `list`
+        One `dict` of `np.array` per amp, keyed by column name
+    """
+    o_list = []
+    with fits.open(filepath, memmap=True) as hdulist:
+        for amp in range(namps):
+            hdu_data = hdulist['AMP%02i' % (amp+1)].data
+            o_list.append({col: np.array(hdu_data[col]) for col in FE55_CLUSTER_COLUMNS})
+    return o_list
+
+
+def fe55_good_cluster_mask(amp_arrays, use_all=False):
+    """Select the clusters with a peak close to their centroid
+
+    Parameters
+    ----------
+    amp_arrays : `dict`
+        The cluster columns for one amp
+    use_all : `bool`
+        If True, accept all the clusters
+
+    Returns
+    -------
+    mask : `np.array`
+        True for the clusters used in the gain fit
+    """
+    if use_all:
+        return np.ones(amp_arrays['DN'].shape, bool)
+    return (np.fabs(amp_arrays['XPOS'] - amp_arrays['XPEAK']) < 1) &\
+        (np.fabs(amp_arrays['YPOS'] - amp_arrays['YPEAK']) < 1)
+
+
+def fit_fe55_gain(signals, nbins=100):
+    """Fit the K-alpha line for one amp
+
+    Parameters
+    ----------
+    signals : `np.array`
+        The cluster signals, in DN
+    nbins : `int`
+        Number of histogram bins used in the fit
+
+    Returns
+    -------
+    vals : `tuple`
+        kalpha_peak, kalpha_sigma, gain, gain_error, fit_xmin, fit_xmax, fit_pars
+    """
+    gainfitter = Fe55GainFitter(signals)
+    try:
+        kalpha_peak, kalpha_sigma = gainfitter.fit(bins=nbins)
+        gain = gainfitter.gain
+        gain_error = gainfitter.gain_error
+        pars = gainfitter.pars
+    except Exception:
+        kalpha_peak, kalpha_sigma = (np.nan, np.nan)
+        gain = np.nan
+        gain_error = np.nan
+        pars = np.nan * np.ones((4))
+    xra = gainfitter.xrange
+    if xra is None:
+        xra = (np.nan, np.nan)
+    return (kalpha_peak, kalpha_sigma, gain, gain_error, xra[0], xra[1], pars)
+
+
+def fit_fe55_gains(signal_list, nbins=100, nproc=1):
+    """Fit the K-alpha line for many amps
+
+    Parameters
+    ----------
+    signal_list : `list`
+        The cluster signals for each amp
+    nbins : `int`
+        Number of histogram bins used in the fit
+    nproc : `int`
+        Number of processes used to run the fits
+
+    Returns
+    -------
+    o_list : `list`
+        The `fit_fe55_gain` results for each amp
+    """
+    if nproc is None or nproc <= 1:
+        return [fit_fe55_gain(signals, nbins) for signals in signal_list]
+    chunksize = max(1, len(signal_list) // (4*nproc))
+    with ProcessPoolExecutor(max_workers=nproc) as executor:
+        return list(executor.map(fit_fe55_gain, signal_list,
+                                 len(signal_list)*[nbins], chunksize=chunksize))
+
+
+def fe55_gain_stats(filepaths, **kwargs):
+    """Compute the fe55 gain statistics for a set of CCDs
+
+    The cluster files are read in this process, only the selected
+    signals are sent to the processes running the fits.
+
+    Parameters
+    ----------
+    filepaths : `list`
+        The fe55 cluster files, one per CCD
+
+    Keywords
+    --------
+    use_all : `bool`
+        Use all the clusters, not just the ones with a peak close to their centroid
+    nbins : `int`
+        Number of histogram bins used in the fit
+    nproc : `int`
+        Number of processes used to run the fits
+    namps : `int`
+        Number of amps per CCD
+
+    Returns
+    -------
+    data_dict : `dict`
+        The gain statistics, one entry per amp, ordered by CCD then amp
+    """
+    use_all = kwargs.get('use_all', False)
+    nbins = kwargs.get('nbins', 100)
+    namps = kwargs.get('namps', 16)
+
+    signal_list = []
+    ncluster = []
+    ngood = []
+    sigmax_median = []
+    sigmay_median = []
+    for filepath in filepaths:
+        for amp_arrays in read_fe55_cluster_arrays(filepath, namps):
+            mask = fe55_good_cluster_mask(amp_arrays, use_all)
+            signal_list.append(amp_arrays['DN'][mask])
+            ncluster.append(mask.size)
+            ngood.append(mask.sum())
+            sigmax_median.append(np.median(amp_arrays['SIGMAX']))
+            sigmay_median.append(np.median(amp_arrays['SIGMAY']))
+
+    fit_vals = fit_fe55_gains(signal_list, nbins, kwargs.get('nproc', 1))
+    fit_cols = ['kalpha_peak', 'kalpha_sigma', 'gain', 'gain_error',
+                'fit_xmin', 'fit_xmax', 'fit_pars']
+    fit_dict = {key: [vals[i] for vals in fit_vals] for i, key in enumerate(fit_cols)}
+
+    data_dict = dict(kalpha_peak=fit_dict['kalpha_peak'],
+                     kalpha_sigma=fit_dict['kalpha_sigma'],
+                     ncluster=ncluster,
+                     ngood=ngood,
+                     gain=fit_dict['gain'],
+                     gain_error=fit_dict['gain_error'],
+                     fit_xmin=fit_dict['fit_xmin'],
+                     fit_xmax=fit_dict['fit_xmax'],
+                     fit_pars=fit_dict['fit_pars'],
+                     fit_nbins=len(signal_list)*[float(nbins)],
+                     sigmax_median=sigmax_median,
+                     sigmay_median=sigmay_median)
+    return data_dict
+
+
 class Fe55GainStatsConfig(Fe55RaftTableAnalysisConfig):
     """Configuration for Fe55GainStatsTask"""
     infilekey = EOUtilOptions.clone_param('infilekey', default='fe55-clusters')
     filekey = EOUtilOptions.clone_param('filekey', default='fe55-gain-stats')
     use_all = EOUtilOptions.clone_param('use_all')
+    nproc = EOUtilOptions.clone_param('nproc')
 
 
 class Fe55GainStatsTask(Fe55RaftTableAnalysisTask):
@@ -54,71 +231,13 @@ class Fe55GainStatsTask(Fe55RaftTableAnalysisTask):
         if butler is not None:
             self.log.warn("Ignoring butler")
 
-        use_all = self.config.use_all
-
-        data_dict = dict(kalpha_peak=[],
-                         kalpha_sigma=[],
-                         ncluster=[],
-                         ngood=[],
-                         gain=[],
-                         gain_error=[],
-                         fit_xmin=[],
-                         fit_xmax=[],
-                         fit_pars=[],
-                         fit_nbins=[],
-                         sigmax_median=[],
-                         sigmay_median=[],
-                         slot=[],
-                         amp=[])
-
         self.log_info_raft_msg(self.config, "")
 
-        for islot, slot in enumerate(ALL_SLOTS):
-
-            self.log_progress("  %s" % slot)
-
-            basename = data[slot]
-
-            dtables = TableDict(basename)
-
-            for amp in range(16):
-                table = dtables['amp%02i' % (amp+1)]
-                if use_all:
-                    mask = np.ones((len(table)), bool)
-                else:
-                    mask = (np.fabs(table['XPOS'] - table['XPEAK']) < 1)*\
-                        (np.fabs(table['YPOS'] - table['YPEAK']) < 1)
-                tablevals = table[mask]['DN']
-                gainfitter = Fe55GainFitter(tablevals)
-                try:
-                    kalpha_peak, kalpha_sigma = gainfitter.fit(bins=100)
-                    gain = gainfitter.gain
-                    gain_error = gainfitter.gain_error
-                    pars = gainfitter.pars
-                except Exception:
-                    kalpha_peak, kalpha_sigma = (np.nan, np.nan)
-                    gain = np.nan
-                    gain_error = np.nan
-                    pars = np.nan * np.ones((4))
-                data_dict['kalpha_peak'].append(kalpha_peak)
-                data_dict['kalpha_sigma'].append(kalpha_sigma)
-                data_dict['gain'].append(gain)
-                data_dict['gain_error'].append(gain_error)
-                xra = gainfitter.xrange
-                data_dict['ncluster'].append(mask.size)
-                data_dict['ngood'].append(mask.sum())
-                if xra is None:
-                    data_dict['fit_xmin'].append(np.nan)
-                    data_dict['fit_xmax'].append(np.nan)
-                else:
-                    data_dict['fit_xmin'].append(xra[0])
-                    data_dict['fit_xmax'].append(xra[1])
-                data_dict['fit_pars'].append(pars)
-                data_dict['fit_nbins'].append(100.)
-                data_dict['sigmax_median'].append(np.median(table['SIGMAX']))
-                data_dict['sigmay_median'].append(np.median(table['SIGMAY']))
-                data_dict['slot'].append(islot)
-                data_dict['amp'].append(amp)
+        data_dict = fe55_gain_stats([data[slot] for slot in ALL_SLOTS],
+                                    use_all=self.config.use_all,
+                                    nproc=self.config.nproc)
+        data_dict['slot'] = np.repeat(np.arange(len(ALL_SLOTS)), 16)
+        data_dict['amp'] = np.tile(np.arange(16), len(ALL_SLOTS))
 
         self.log_progress("Done!")
 
@@ -148,6 +267,92 @@ class Fe55GainStatsTask(Fe55RaftTableAnalysisTask):
 
 
 
+class Fe55GainFocalPlaneConfig(Fe55RunTableAnalysisConfig):
+    """Configuration for Fe55GainFocalPlaneTask"""
+    infilekey = EOUtilOptions.clone_param('infilekey', default='fe55-clusters')
+    filekey = EOUtilOptions.clone_param('filekey', default='fe55-gain-fp')
+    use_all = EOUtilOptions.clone_param('use_all')
+    nproc = EOUtilOptions.clone_param('nproc')
+
+
+class Fe55GainFocalPlaneTask(Fe55RunTableAnalysisTask):
+    """Analyze the gains for all the CCDs in a run using the fe55 cluster fit results"""
+
+    ConfigClass = Fe55GainFocalPlaneConfig
+    _DefaultName = "Fe55GainFocalPlaneTask"
+
+    plot_names = ['gain']
+
+    def extract(self, butler, data, **kwargs):
+        """Extract the gains and widths from the fe55 clusters
+
+        Parameters
+        ----------
+        butler : `Butler`
+            The data butler
+        data : `dict`
+            Dictionary (or other structure) contain the input data
+        kwargs
+            Used to override default configuration
+
+        Returns
+        -------
+        dtables : `TableDict`
+            The resulting data
+        """
+        self.safe_update(**kwargs)
+
+        if butler is not None:
+            self.log.warn("Ignoring butler")
+
+        rafts = []
+        slots = []
+        filepaths = []
+        for raft, slot_dict in sorted(data.items()):
+            if not isinstance(slot_dict, dict):
+                self.log.warn("Skipping raft %s, no slot level files" % raft)
+                continue
+            for slot, filepath in sorted(slot_dict.items()):
+                if slot not in ALL_SLOTS or not os.path.exists(filepath):
+                    continue
+                rafts.append(raft)
+                slots.append(ALL_SLOTS.index(slot))
+                filepaths.append(filepath)
+
+        self.log.info("Fitting fe55 gains for %i CCDs" % len(filepaths))
+
+        data_dict = fe55_gain_stats(filepaths,
+                                    use_all=self.config.use_all,
+                                    nproc=self.config.nproc)
+        data_dict['raft'] = np.repeat(rafts, 16)
+        data_dict['slot'] = np.repeat(slots, 16)
+        data_dict['amp'] = np.tile(np.arange(16), len(filepaths))
+
+        self.log_progress("Done!")
+
+        outtables = TableDict()
+        outtables.make_datatable("fe55_gain_fp", data_dict)
+        return outtables
+
+
+    def plot(self, dtables, figs, **kwargs):
+        """Plot the gain results for the focal plane
+
+        Parameters
+        ----------
+        dtables : `TableDict`
+            The data produced by this task
+        figs : `FigureDict`
+            The resulting figures
+        kwargs
+            Used to override default configuration
+        """
+        self.safe_update(**kwargs)
+        figs.plot_amps_data_fp_table('gain', dtables['fe55_gain_fp'], 'gain',
+                                     title="Fe55 Gain", z_range=(0.5, 2.))
+
+
+
 class Fe55GainSummaryConfig(Fe55SummaryAnalysisConfig):
     """Configuration for Fe55GainSummaryTask"""
     infilekey = EOUtilOptions.clone_param('infilekey', default='fe55-gain-stats')
@@ -230,4 +435,5 @@ class Fe55GainSummaryTask(Fe55SummaryAnalysisTask):
 
 
 EO_TASK_FACTORY.add_task_class('Fe55GainStats', Fe55GainStatsTask)
+EO_TASK_FACTORY.add_task_class('Fe55GainFocalPlane', Fe55GainFocalPlaneTask)
 EO_TASK_FACTORY.add_task_class('Fe55GainSummary', Fe55GainSummaryTask)
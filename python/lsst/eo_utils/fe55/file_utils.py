@@ -5,7 +5,7 @@
 """This module contains functions to find files of a particular type in the SLAC directory tree"""
 
 from lsst.eo_utils.base.file_utils import FILENAME_FORMATS,\
-    SLOT_FORMAT_STRING, RAFT_FORMAT_STRING, SUMMARY_FORMAT_STRING
+    SLOT_FORMAT_STRING, RAFT_FORMAT_STRING, RUN_FORMAT_STRING, SUMMARY_FORMAT_STRING
 
 FE55_DEFAULT_FIELDS = dict(testType='fe55')
 
@@ -22,6 +22,12 @@ SLOT_FE55_TABLE_FORMATTER = FILENAME_FORMATS.add_format('slot_fe55_table',
 SLOT_FE55_PLOT_FORMATTER = FILENAME_FORMATS.add_format('slot_fe55_plot',
                                                        SLOT_FORMAT_STRING,
                                                        fileType='plots', **FE55_DEFAULT_FIELDS)
+RUN_FE55_TABLE_FORMATTER = FILENAME_FORMATS.add_format('run_fe55_table',
+                                                       RUN_FORMAT_STRING,
+                                                       fileType='tables', **FE55_DEFAULT_FIELDS)
+RUN_FE55_PLOT_FORMATTER = FILENAME_FORMATS.add_format('run_fe55_plot',
+                                                      RUN_FORMAT_STRING,
+                                                      fileType='plots', **FE55_DEFAULT_FIELDS)
 SUM_FE55_TABLE_FORMATTER = FILENAME_FORMATS.add_format('sum_fe55_table',
                                                        SUMMARY_FORMAT_STRING,
                                                        fileType='tables', **FE55_DEFAULT_FIELDS)
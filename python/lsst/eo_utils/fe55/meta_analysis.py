@@ -3,12 +3,13 @@
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
 from lsst.eo_utils.base.iter_utils import TableAnalysisByRaft,\
-    SummaryAnalysisIterator
+    TableAnalysisByRun, SummaryAnalysisIterator
 
 from lsst.eo_utils.base.analysis import AnalysisConfig, AnalysisTask
 
 from .file_utils import SLOT_FE55_TABLE_FORMATTER,\
     RAFT_FE55_TABLE_FORMATTER, RAFT_FE55_PLOT_FORMATTER,\
+    RUN_FE55_TABLE_FORMATTER, RUN_FE55_PLOT_FORMATTER,\
     SUM_FE55_TABLE_FORMATTER, SUM_FE55_PLOT_FORMATTER
 
 
@@ -35,6 +36,33 @@ class Fe55RaftTableAnalysisTask(AnalysisTask):
     datatype = 'fe55'
 
 
+class Fe55RunTableAnalysisConfig(AnalysisConfig):
+    """Configuration for fe55 analyses over the whole focal plane"""
+    outdir = EOUtilOptions.clone_param('outdir')
+    teststand = EOUtilOptions.clone_param('teststand')
+    run = EOUtilOptions.clone_param('run')
+    calib = EOUtilOptions.clone_param('calib')
+    infilekey = EOUtilOptions.clone_param('infilekey')
+    filekey = EOUtilOptions.clone_param('filekey')
+
+
+class Fe55RunTableAnalysisTask(AnalysisTask):
+    """Simple functor class to tie together fe55 analyses
+    that use all the CCDs in a run
+    """
+
+    # These can overridden by the sub-class
+    ConfigClass = Fe55RunTableAnalysisConfig
+    _DefaultName = "Fe55RunTableAnalysisTask"
+    iteratorClass = TableAnalysisByRun
+
+    intablename_format = SLOT_FE55_TABLE_FORMATTER
+    tablename_format = RUN_FE55_TABLE_FORMATTER
+    plotname_format = RUN_FE55_PLOT_FORMATTER
+
+    datatype = 'fe55'
+
+
 class Fe55SummaryAnalysisConfig(AnalysisConfig):
     """Configurate for bias analyses"""
     dataset = EOUtilOptions.clone_param('dataset')
@@ -6,18 +6,16 @@ import sys
 
 import numpy as np
 
-import lsst.afw.geom as afwGeom
-
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
-from lsst.eo_utils.base.data_utils import TableDict, construct_bbox_dict
+from lsst.eo_utils.base.data_utils import TableDict, DefectIndex
 
 from lsst.eo_utils.base.butler_utils import make_file_dict
 
 from lsst.eo_utils.base.iter_utils import AnalysisBySlot
 
 from lsst.eo_utils.base.image_utils import get_exposure_time, get_mondiode_val,\
-    unbiased_ccd_image_dict
+    unbiased_ccd_image_dict, BBoxPhotometry
 
 from lsst.eo_utils.base.factory import EO_TASK_FACTORY
 
@@ -28,12 +26,11 @@ from lsst.eo_utils.flat.analysis import FlatAnalysisConfig, FlatAnalysisTask
 
 from lsst.eo_utils.sflat.file_utils import RAFT_SFLAT_TABLE_FORMATTER
 
-from lsst.pex.exceptions import LengthError
-
 
 class DustLinearityAnalysisConfig(FlatAnalysisConfig):
     """Configuration for dustLinearityAnalysisTask"""
     filekey = EOUtilOptions.clone_param('filekey', default='dust-lin')
+    max_defects = EOUtilOptions.clone_param('max_defects')
 
 
 class DustLinearityAnalysisTask(FlatAnalysisTask):
@@ -87,11 +84,10 @@ class DustLinearityAnalysisTask(FlatAnalysisTask):
         sflat_table_file = self.get_filename_from_format(RAFT_SFLAT_TABLE_FORMATTER, "sflat.fits")
 
         sflat_tables = TableDict(sflat_table_file)
-        # dictionary of dictionaries of lists of bounding
-        # boxes, keyed by slot, amp
-        bbox_dict = construct_bbox_dict(sflat_tables['defects'])
+        # spatial index of the defect bounding boxes, by slot, amp
+        defect_index = DefectIndex(sflat_tables['defects'],
+                                   sflat_tables.get_table('defects_index'))
 
-        slot_bbox_dict = bbox_dict[slot]
         slot_idx_dict = dict(S00=0, S01=1, S02=2, S10=3, S11=4, S12=5, S20=6, S21=7, S22=8)
 
         # This is a dictionary of dictionaries to store all the
@@ -133,100 +129,56 @@ class DustLinearityAnalysisTask(FlatAnalysisTask):
                                                       bias=bias_type,
                                                       superbias_frame=superbias_frame)
 
-            for iamp, (amp, image) in enumerate(unbiased_images.items()):
+            for iamp, image in enumerate(unbiased_images.values()):
 
-                bbox_list = slot_bbox_dict[iamp]
-                amp_median = np.median(image.array)
+                phot = BBoxPhotometry(image)
+                amp_median = phot.median
                 #fill fp_dict
                 frac_thresh = kwargs.get('frac_thresh', 0.9)
 
                 thresh_float = frac_thresh*amp_median
                 thresh_0p2_float = (1. - (1. - frac_thresh)*0.2)*amp_median
 
-                max_bbox = min(len(bbox_list), 10)
-                #print(i, amp, bbox_list[0:max_bbox])
-                #print(max_bbox)
-                for bbox in bbox_list[0:max_bbox]:
-
-                    try:
-                        cutout = image[bbox].array
-                    except Exception:
-                        print("cutout failed", slot, amp, bbox)
-                        continue
-                    #print(ifile, bbox, cutout)
-
-
-                    ratio_full = np.mean(cutout)/amp_median
-                    cutout_median_full = np.median(cutout)
-
-                    peak_idx = cutout.argmax()
-
-                    peak_x = bbox.getMinX() + int(peak_idx % cutout.shape[1])
-                    peak_y = bbox.getMinY() + int(peak_idx / cutout.shape[1])
-
-                    peak = afwGeom.Point2I(peak_x, peak_y)
-                    extent = afwGeom.Extent2I(1, 1)
-                    bbox_expand = afwGeom.Box2I(peak, extent)
-
-                    #npix = np.array([1, 9, 25, 49])
-                    npix_cumul = np.array([1, 8, 16, 24])
-                    sums = np.zeros((4))
-                    meds = np.zeros((4))
-                    over_thresh = np.zeros((4), int)
-                    over_0p2_thresh = np.zeros((4), int)
-
-                    sums_cumul = np.zeros((4))
-                    meds_cumul = np.zeros((4))
-                    over_thresh_cumul = np.zeros((4), int)
-                    over_0p2_thresh_cumul = np.zeros((4), int)
-
-                    for j in range(4):
-
-                        try:
-                            cuttout_array = image[bbox_expand].array
-                        except LengthError:
-                            break
-
-                        sums[j] = cuttout_array.sum()
-                        meds[j] = np.median(cuttout_array)
-                        over_thresh[j] = (cuttout_array > thresh_float).sum()
-                        over_0p2_thresh[j] = (cuttout_array > thresh_0p2_float).sum()
-
-                        if j > 0:
-                            sums_cumul[j] = sums[j] - sums[j-1]
-                            meds_cumul[j] = meds[j] - meds[j - 1]
-                            over_thresh_cumul[j] = over_thresh[j] - over_thresh[j-1]
-                            over_0p2_thresh_cumul[j] = over_0p2_thresh[j] - over_0p2_thresh[j-1]
-                        else:
-                            sums_cumul[j] = sums[j]
-                            meds_cumul[j] = meds[j]
-                            over_thresh_cumul[j] = over_thresh[j]
-                            over_0p2_thresh_cumul[j] = over_0p2_thresh[j]
-
-                        bbox_expand.grow(1)
-
-                    means_cumul = sums_cumul/(npix_cumul*amp_median)
-
-                    fp_dict['exptime'].append(exptime)
-                    fp_dict['mondiode'].append(mondiode_val)
-                    fp_dict['amp'].append(iamp)
-                    fp_dict['slot'].append(islot)
-                    fp_dict['amp_median'].append(amp_median)
-                    fp_dict['x_corner'].append(bbox.getMinX())
-                    fp_dict['y_corner'].append(bbox.getMinY())
-
-                    fp_dict['x_size'].append(bbox.getWidth())
-                    fp_dict['y_size'].append(bbox.getHeight())
-
-                    fp_dict['med_flux_full'].append(cutout_median_full)
-                    fp_dict['ratio_full'].append(ratio_full)
-
-
-                    for i in range(4):
-                        fp_dict['ratio_%i' % i].append(means_cumul[i])
-                        fp_dict['med_flux_%i' % i].append(meds_cumul[i])
-                        fp_dict['npix_%i' % i].append(over_thresh_cumul[i])
-                        fp_dict['npix_0p2_%i' % i].append(over_0p2_thresh_cumul[i])
+                # darkest defects first
+                rows = defect_index.top_k(slot, iamp, self.config.max_defects,
+                                          'ratio_full', ascending=True)
+                bboxes = defect_index.get_bboxes(rows)
+                _, inside = phot.to_array_coords(bboxes)
+                bboxes = bboxes[inside]
+                nbox = len(bboxes)
+
+                ysize = bboxes[:, 2] - bboxes[:, 0]
+                xsize = bboxes[:, 3] - bboxes[:, 1]
+                ratio_full = phot.box_sums(bboxes)/(xsize*ysize*amp_median)
+                cutout_median_full = phot.box_medians(bboxes)
+
+                #npix = np.array([1, 9, 25, 49])
+                npix_cumul = np.array([1, 8, 16, 24])
+                rings = phot.ring_stats(phot.box_peaks(bboxes), nring=4,
+                                        thresholds=[thresh_float, thresh_0p2_float],
+                                        medians=True)
+
+                means_cumul = rings['sums']/(npix_cumul[:, np.newaxis]*amp_median)
+
+                fp_dict['exptime'] += nbox*[exptime]
+                fp_dict['mondiode'] += nbox*[mondiode_val]
+                fp_dict['amp'] += nbox*[iamp]
+                fp_dict['slot'] += nbox*[islot]
+                fp_dict['amp_median'] += nbox*[amp_median]
+                fp_dict['x_corner'] += bboxes[:, 1].tolist()
+                fp_dict['y_corner'] += bboxes[:, 0].tolist()
+
+                fp_dict['x_size'] += xsize.tolist()
+                fp_dict['y_size'] += ysize.tolist()
+
+                fp_dict['med_flux_full'] += cutout_median_full.tolist()
+                fp_dict['ratio_full'] += ratio_full.tolist()
+
+                for i in range(4):
+                    fp_dict['ratio_%i' % i] += means_cumul[i].tolist()
+                    fp_dict['med_flux_%i' % i] += rings['medians'][i].tolist()
+                    fp_dict['npix_%i' % i] += rings['npix'][0][i].tolist()
+                    fp_dict['npix_0p2_%i' % i] += rings['npix'][1][i].tolist()
 
 
         sys.stdout.write("!\n")
@@ -2,8 +2,6 @@
 
 import lsst.afw.math as afwMath
 
-#from lsst.eotest.sensor.BFTask import crossCorrelate_images
-
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
 from lsst.eo_utils.base.data_utils import TableDict
@@ -13,7 +11,9 @@ from lsst.eo_utils.base.butler_utils import make_file_dict
 from lsst.eo_utils.base.iter_utils import AnalysisBySlot
 
 from lsst.eo_utils.base.image_utils import get_amp_list,\
-    get_geom_regions, unbias_amp, get_raw_image
+    unbiased_ccd_image_dict, prepare_superbias
+
+from lsst.eo_utils.base.stat_utils import fft_covariance_amps
 
 from lsst.eo_utils.base.factory import EO_TASK_FACTORY
 
@@ -26,6 +26,7 @@ class BFConfig(FlatAnalysisConfig):
     maxLag = EOUtilOptions.clone_param('maxLag')
     nSigmaClip = EOUtilOptions.clone_param('nSigmaClip')
     backgroundBinSize = EOUtilOptions.clone_param('backgroundBinSize')
+    nthreads = EOUtilOptions.clone_param('nthreads')
 
 
 class BFTask(FlatAnalysisTask):
@@ -65,7 +66,7 @@ class BFTask(FlatAnalysisTask):
 
         bias_type = self.get_bias_algo()
         mask_files = self.get_mask_files()
-        superbias_frame = self.get_superbias_frame(mask_files)
+        superbias_frame = prepare_superbias(self.get_superbias_frame(mask_files))
 
         self.log_info_slot_msg(self.config, "%i files" % len(flat1_files))
 
@@ -74,6 +75,7 @@ class BFTask(FlatAnalysisTask):
         data_dict = {}
         for i in range(1, 17):
             data_dict['AMP%02i_MEAN' % i] = []
+            data_dict['AMP%02i_COV' % i] = []
             data_dict['AMP%02i_XCORR' % i] = []
             data_dict['AMP%02i_YCORR' % i] = []
             data_dict['AMP%02i_XCORR_ERR' % i] = []
@@ -92,29 +94,25 @@ class BFTask(FlatAnalysisTask):
 
             amps = get_amp_list(flat_1)
 
-            for i, amp in enumerate(amps):
-                regions = get_geom_regions(flat_1, amp)
-                serial_oscan = regions['serial_overscan']
-                imaging = regions['imaging']
-                #imaging.grow(-20)
-                im_1 = get_raw_image(flat_1, amp)
-                im_2 = get_raw_image(flat_2, amp)
-
-                superbias_im = self.get_superbias_amp_image(butler, superbias_frame, amp)
-
-                image_1 = unbias_amp(im_1, serial_oscan, bias_type=bias_type,
-                                     superbias_im=superbias_im, region=imaging).image
-                image_2 = unbias_amp(im_2, serial_oscan, bias_type=bias_type,
-                                     superbias_im=superbias_im, region=imaging).image
+            ccd_1_ims = unbiased_ccd_image_dict(flat_1, bias=bias_type,
+                                                superbias_frame=superbias_frame,
+                                                trim='imaging')
+            ccd_2_ims = unbiased_ccd_image_dict(flat_2, bias=bias_type,
+                                                superbias_frame=superbias_frame,
+                                                trim='imaging')
 
-                avemean = (self.mean(image_1) + self.mean(image_2)) / 2.
+            diffs = [ccd_1_ims[amp].image.array - ccd_2_ims[amp].image.array for amp in amps]
+            covs = fft_covariance_amps(diffs, self.config.maxLag,
+                                       nsigma=self.config.nSigmaClip,
+                                       binsize=self.config.backgroundBinSize,
+                                       nthreads=self.config.nthreads)
 
-                corr, corr_err = crossCorrelate_images(image_1, image_2,
-                                                       self.config.maxLag,
-                                                       self.config.nSigmaClip,
-                                                       self.config.backgroundBinSize)
+            for i, amp in enumerate(amps):
+                avemean = (self.mean(ccd_1_ims[amp].image) + self.mean(ccd_2_ims[amp].image)) / 2.
+                corr, corr_err = covs[i][0:2]
 
                 data_dict['AMP%02i_MEAN' % (i+1)].append(avemean)
+                data_dict['AMP%02i_COV' % (i+1)].append(corr)
                 data_dict['AMP%02i_XCORR' % (i+1)].append(corr[1][0]/corr[0][0])
                 data_dict['AMP%02i_YCORR' % (i+1)].append(corr[0][1]/corr[0][0])
                 data_dict['AMP%02i_XCORR_ERR' % (i+1)].append(corr_err[1][0])
@@ -1,22 +1,21 @@
 """Analyze the flat pairs data"""
 
-import operator
-
 from astropy.io import fits
 
 import lsst.afw.math as afwMath
 
-import lsst.afw.image as afwImage
-
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
 from lsst.eo_utils.base.data_utils import TableDict
 
-from lsst.eo_utils.base.butler_utils import make_file_dict
+from lsst.eo_utils.base.butler_utils import make_file_dict, get_file_keys
+
+from lsst.eo_utils.base.stat_utils import flat_pair_stats
 
 from lsst.eo_utils.base.image_utils import get_amp_list,\
     get_exposure_time, get_mono_slit_b, unbiased_ccd_image_dict,\
-    get_monodiode_val_from_data_id
+    get_monodiode_val_from_data_id, prepare_superbias,\
+    prepare_nonlinearity
 
 from lsst.eo_utils.base.iter_utils import AnalysisBySlot
 
@@ -32,6 +31,7 @@ class FlatPairConfig(FlatAnalysisConfig):
     filekey = EOUtilOptions.clone_param('filekey', default='flat-pair')
     nonlin_spline_ext = EOUtilOptions.clone_param('nonlin_spline_ext')
     nonlin_spline_smooth = EOUtilOptions.clone_param('nonlin_spline_smooth')
+    incremental = EOUtilOptions.clone_param('incremental')
 
 
 class FlatPairTask(FlatAnalysisTask):
@@ -56,29 +56,36 @@ class FlatPairTask(FlatAnalysisTask):
         #return afwMath.makeStatistics(img, afwMath.VARIANCECLIP, self.stat_ctrl).getValue()
         return afwMath.makeStatistics(img, afwMath.VARIANCE, self.stat_ctrl).getValue()
 
-    def get_pair_stats(self, image_1, image_2):
-        """Get the mean and varience from a pair of flats"""
-        fmean1 = self.mean(image_1)
-        fmean2 = self.mean(image_2)
+    def get_pair_stats(self, images_1, images_2):
+        """Get the means and variances from a pair of flats
 
-        fratio_im = afwImage.MaskedImageF(image_1, True)
-        fcopy_im = afwImage.MaskedImageF(image_2, True)
-
-        operator.itruediv(fratio_im, image_2)
-        fratio = self.mean(fratio_im)
-        fcopy_im *= fratio
-        fmean = (fmean1 + fmean2)/2.
-        fcorrmean = (fmean1 + self.mean(fcopy_im))/2.
+        Parameters
+        ----------
+        images_1 : `list`
+            The `MaskedImageF` objects for each amp of the first flat
+        images_2 : `list`
+            The `MaskedImageF` objects for each amp of the second flat
 
-        fdiff = afwImage.MaskedImageF(image_1, True)
-        fdiff -= fcopy_im
-        fvar = self.var(fdiff)/2.
-        return (fratio, fmean, fcorrmean, fvar, fmean1, fmean2)
+        Returns
+        -------
+        fstats : `tuple`
+            Arrays with the ratio, mean, corrected mean, variance
+            and the means of the two flats, for each amp
+        """
+        return flat_pair_stats([image.image.array for image in images_1],
+                               [image.image.array for image in images_2],
+                               [image.mask.array for image in images_1],
+                               [image.mask.array for image in images_2],
+                               and_mask=self.stat_ctrl.getAndMask())
 
 
     def extract(self, butler, data, **kwargs):
         """Extract data
 
+        If config.incremental is set only the pairs that are not listed
+        in the 'files' table of the existing output are processed,
+        and their results are appended to the existing tables.
+
         Parameters
         ----------
         butler : `Butler`
@@ -102,12 +109,30 @@ class FlatPairTask(FlatAnalysisTask):
             flat1_files = data['FLAT0']
             flat2_files = data['FLAT1']
 
+        primary_hdu = fits.PrimaryHDU()
+        primary_hdu.header['NAMPS'] = 16
+        dtables = TableDict(primary=primary_hdu)
+
+        prev_tables = self.read_previous_tables()
+        if prev_tables is not None and 'filename' in prev_tables['files'].colnames:
+            for key, tab in prev_tables.items():
+                dtables.add_datatable(key, tab)
+            done_keys = set(prev_tables['files']['filename'])
+            new_pairs = [(id_1, id_2) for id_1, id_2, key_1 in
+                         zip(flat1_files, flat2_files, get_file_keys(flat1_files))
+                         if key_1 not in done_keys]
+            if not new_pairs:
+                self.log_info_slot_msg(self.config, "No new pairs")
+                return dtables
+            flat1_files = [pair[0] for pair in new_pairs]
+            flat2_files = [pair[1] for pair in new_pairs]
+
         bias_type = self.get_bias_algo()
         mask_files = self.get_mask_files()
 
-        superbias_frame = self.get_superbias_frame(mask_files)
+        superbias_frame = prepare_superbias(self.get_superbias_frame(mask_files))
 
-        nlc = self.get_nonlinearirty_correction()
+        nlc = prepare_nonlinearity(self.get_nonlinearirty_correction())
         #slot_idx = ALL_SLOTS.index(self.config.slot)
 
         self.log_info_slot_msg(self.config, "%i %i files" % (len(flat1_files), len(flat2_files)))
@@ -180,31 +205,29 @@ class FlatPairTask(FlatAnalysisTask):
                                                 superbias_frame=superbias_frame,
                                                 trim='imaging', nonlinearity=nlc)
 
-            for i, amp in enumerate(amps):
-                image_1 = ccd_1_ims[amp]
-                image_2 = ccd_2_ims[amp]
+            fstats = self.get_pair_stats([ccd_1_ims[amp] for amp in amps],
+                                         [ccd_2_ims[amp] for amp in amps])
 
-                fstats = self.get_pair_stats(image_1, image_2)
-                signal = fstats[1]
+            for i in range(len(amps)):
+                signal = fstats[1][i]
                 #if gains is not None:
                 #    signal *= gains[slot_idx][i]
 
-                data_dict['AMP%02i_RATIO' % (i+1)].append(fstats[0])
-                data_dict['AMP%02i_MEAN' % (i+1)].append(fstats[1])
-                data_dict['AMP%02i_CORRMEAN' % (i+1)].append(fstats[2])
-                data_dict['AMP%02i_VAR' % (i+1)].append(fstats[3])
+                data_dict['AMP%02i_RATIO' % (i+1)].append(fstats[0][i])
+                data_dict['AMP%02i_MEAN' % (i+1)].append(fstats[1][i])
+                data_dict['AMP%02i_CORRMEAN' % (i+1)].append(fstats[2][i])
+                data_dict['AMP%02i_VAR' % (i+1)].append(fstats[3][i])
                 data_dict['AMP%02i_SIGNAL' % (i+1)].append(signal)
-                data_dict['AMP%02i_MEAN1' % (i+1)].append(fstats[4])
-                data_dict['AMP%02i_MEAN2' % (i+1)].append(fstats[5])
+                data_dict['AMP%02i_MEAN1' % (i+1)].append(fstats[4][i])
+                data_dict['AMP%02i_MEAN2' % (i+1)].append(fstats[5][i])
 
         self.log_progress("Done!")
 
-        primary_hdu = fits.PrimaryHDU()
-        primary_hdu.header['NAMPS'] = 16
+        file_dict = make_file_dict(butler, flat1_files + flat2_files)
+        file_dict['filename'] = get_file_keys(flat1_files + flat2_files)
 
-        dtables = TableDict(primary=primary_hdu)
-        dtables.make_datatable('files', make_file_dict(butler, flat1_files + flat2_files))
-        dtables.make_datatable('flat', data_dict)
+        dtables.append_datatable('files', file_dict)
+        dtables.append_datatable('flat', data_dict)
 
         return dtables
 
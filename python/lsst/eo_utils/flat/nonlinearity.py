@@ -11,7 +11,8 @@ from lsst.eo_utils.base.data_utils import create_dict_from_guard_rows, append_gu
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
 from lsst.eo_utils.base.factory import EO_TASK_FACTORY
-from lsst.eo_utils.base.stat_utils import perform_linear_chisq_fit, make_profile_hist, LINEARITY_FUNC_DICT
+from lsst.eo_utils.base.stat_utils import batched_linear_chisq_fit, make_profile_hists,\
+    LINEARITY_FUNC_DICT
 
 from .meta_analysis import FlatSlotTableAnalysisConfig, FlatSlotTableAnalysisTask
 
@@ -88,6 +89,27 @@ class NonlinearityTask(FlatSlotTableAnalysisTask):
             offset = 0.
         return ((1 + profile_y) / (1 + offset)) - 1.
 
+    def _log_bins_stack(self, xvals, masks):
+        """Build log-spaced profile bins covering the unmasked values of each row
+
+        Parameters
+        ----------
+        xvals : `array`
+            The x-axis values, (nprof, npts) or (npts)
+        masks : `array`
+            The masks, (nprof, npts)
+
+        Returns
+        -------
+        xbins : `array`
+            (nprof, num_profile_points) array of bin edges
+        """
+        xvals = np.broadcast_to(xvals, masks.shape)
+        xmin = np.where(masks, xvals, np.inf).min(axis=1)
+        xmax = np.where(masks, xvals, -np.inf).max(axis=1)
+        return np.logspace(np.log10(xmin), np.log10(xmax),
+                           self.config.num_profile_points, axis=1)
+
     def extract(self, butler, data, **kwargs):
         """Extract data
 
@@ -166,7 +188,7 @@ class NonlinearityTask(FlatSlotTableAnalysisTask):
                          flux_2=flux_2,
                          monoch_slit_b=slit_widths)
 
-        good_amps = 0
+        amp_data = {}
         for amp in range(1, 17):
 
             # Here you can get the data out for each amp and append it to the
@@ -184,10 +206,6 @@ class NonlinearityTask(FlatSlotTableAnalysisTask):
             amp_vals = np.hstack([amp_val1, amp_val2])
 
             if amp_vals.size == 0:
-                guard_vals_dict['amp'] = amp
-                self.log.warn("No Amp values for amp %i, Writing guard values" % amp)
-                append_guard_row(data_dict, guard_vals_dict)
-                append_guard_row(data_dict_inv, guard_vals_dict)
                 continue
 
             mask = np.ones(amp_vals.shape, bool)
@@ -198,7 +216,41 @@ class NonlinearityTask(FlatSlotTableAnalysisTask):
 
             #mask = amp_vals <= amp_vals.max()
 
-            if not mask.any():
+            amp_data[amp] = (amp_vals, mask)
+
+        # Fit all the amps with good data at once
+        fit_amps = [amp for amp, (_, mask) in amp_data.items() if mask.any()]
+        if fit_amps:
+            amp_stack = np.vstack([amp_data[amp][0] for amp in fit_amps])
+            mask_stack = np.vstack([amp_data[amp][1] for amp in fit_amps])
+            fits = batched_linear_chisq_fit(amp_stack, flux_vals, mask_stack,
+                                            self.model_func_choice)
+            fits_inv = batched_linear_chisq_fit(flux_vals, amp_stack, mask_stack,
+                                                self.model_func_choice)
+            # Correct the error for the conversion to ne
+            frac_resid_err_stack = fits[4] * fits[0][:, 0:1]
+
+            if do_profile:
+                #profile_xbins = np.linspace(0., amp_vals[mask].max(), self.config.num_profile_points)
+                #profile_xbins_inv = np.linspace(0., flux_vals[mask].max(), self.config.num_profile_points)
+                profile_xbins = self._log_bins_stack(amp_stack, mask_stack)
+                profile_xbins_inv = self._log_bins_stack(flux_vals, mask_stack)
+                profs = make_profile_hists(profile_xbins, amp_stack, fits[3],
+                                           yerrs=frac_resid_err_stack, stderr=True)
+                profs_inv = make_profile_hists(profile_xbins_inv, flux_vals, fits_inv[3],
+                                               yerrs=fits_inv[4], stderr=True)
+
+        good_amps = 0
+        for amp in range(1, 17):
+
+            if amp not in amp_data:
+                guard_vals_dict['amp'] = amp
+                self.log.warn("No Amp values for amp %i, Writing guard values" % amp)
+                append_guard_row(data_dict, guard_vals_dict)
+                append_guard_row(data_dict_inv, guard_vals_dict)
+                continue
+
+            if amp not in fit_amps:
                 guard_vals_dict['amp'] = amp
                 self.log.warn("No frames passed cut for amp %i, Writing guard values" % amp)
                 append_guard_row(data_dict, guard_vals_dict)
@@ -210,30 +262,20 @@ class NonlinearityTask(FlatSlotTableAnalysisTask):
             data_dict['amp'].append(amp)
             data_dict_inv['amp'].append(amp)
 
-            results, _, frac_resid, frac_resid_err =\
-                perform_linear_chisq_fit(amp_vals, flux_vals, mask, self.model_func_choice)
-            # Correct the error for the conversion to ne
-            frac_resid_err *= results[0][0]
+            amp_vals = amp_data[amp][0]
+            ifit = fit_amps.index(amp)
 
-            results_inv, _, frac_resid_inv, frac_resid_err_inv =\
-                perform_linear_chisq_fit(flux_vals, amp_vals, mask, self.model_func_choice)
+            pars = fits[0][ifit]
+            frac_resid = fits[3][ifit]
+            frac_resid_err = frac_resid_err_stack[ifit]
 
-            if do_profile:
-                #profile_xbins = np.linspace(0., amp_vals[mask].max(), self.config.num_profile_points)
-                #profile_xbins_inv = np.linspace(0., flux_vals[mask].max(), self.config.num_profile_points)
-                profile_xbins = np.logspace(np.log10(amp_vals[mask].min()),
-                                            np.log10(amp_vals[mask].max()),
-                                            self.config.num_profile_points)
-                profile_xbins_inv = np.logspace(np.log10(flux_vals[mask].min()),
-                                                np.log10(flux_vals[mask].max()),
-                                                self.config.num_profile_points)
+            pars_inv = fits_inv[0][ifit]
+            frac_resid_inv = fits_inv[3][ifit]
+            frac_resid_err_inv = fits_inv[4][ifit]
 
-                profile_x, profile_y, profile_yerr =\
-                    make_profile_hist(profile_xbins, amp_vals, frac_resid,
-                                      yerrs=frac_resid_err, stderr=True)
-                profile_x_inv, profile_y_inv, profile_yerr_inv =\
-                    make_profile_hist(profile_xbins_inv, flux_vals, frac_resid_inv,
-                                      yerrs=frac_resid_err_inv, stderr=True)
+            if do_profile:
+                profile_x, profile_y, profile_yerr = [prof[ifit] for prof in profs]
+                profile_x_inv, profile_y_inv, profile_yerr_inv = [prof[ifit] for prof in profs_inv]
             else:
                 idx_sort = np.argsort(amp_vals)
                 idx_sort_inv = np.argsort(flux_vals)
@@ -258,18 +300,18 @@ class NonlinearityTask(FlatSlotTableAnalysisTask):
             data_dict_inv['prof_y_corr'].append(profile_y_inv)
             data_dict_inv['prof_yerr'].append(profile_yerr_inv)
 
-            data_dict['slope'].append(results[0][0])
-            data_dict_inv['slope'].append(results_inv[0][0])
+            data_dict['slope'].append(pars[0])
+            data_dict_inv['slope'].append(pars_inv[0])
 
             if self.model_func_choice > 1:
-                data_dict['curve'].append(results[0][1])
-                data_dict_inv['curve'].append(results_inv[0][1])
+                data_dict['curve'].append(pars[1])
+                data_dict_inv['curve'].append(pars_inv[1])
             else:
                 data_dict['curve'].append(0.)
                 data_dict_inv['curve'].append(0.)
             if self.model_func_choice > 2:
-                data_dict['offset'].append(results[0][2])
-                data_dict_inv['offset_inv'].append(results_inv[0][2])
+                data_dict['offset'].append(pars[2])
+                data_dict_inv['offset'].append(pars_inv[2])
             else:
                 data_dict['offset'].append(0.)
                 data_dict_inv['offset'].append(0.)
@@ -2,8 +2,6 @@
 
 import os
 
-import scipy.optimize
-
 import numpy as np
 
 from lsst.eotest.sensor.ptcTask import ptc_func
@@ -14,6 +12,8 @@ from lsst.eo_utils.base.config_utils import EOUtilOptions
 
 from lsst.eo_utils.base.data_utils import TableDict, vstack_tables
 
+from lsst.eo_utils.base.stat_utils import batched_ptc_fit
+
 from lsst.eo_utils.base.factory import EO_TASK_FACTORY
 
 from .meta_analysis import FlatSlotTableAnalysisConfig,\
@@ -29,16 +29,13 @@ def model_func_quad(pars, xvals):
     return pars[0] + pars[1]*xvals + pars[2]*xvals*xvals
 
 
-def chi2_model(pars, xvals, yvals, model):
-    """Return the chi2 w.r.t. the model"""
-    return (yvals - model(pars, xvals))/np.sqrt(yvals)
-
-
-
 class PTCConfig(FlatSlotTableAnalysisConfig):
     """Configuration for PTCStatsTask"""
     infilekey = EOUtilOptions.clone_param('infilekey', default='flat-pair')
     filekey = EOUtilOptions.clone_param('filekey', default='ptc')
+    ptc_max_mean = EOUtilOptions.clone_param('ptc_max_mean')
+    ptc_nsig_clip = EOUtilOptions.clone_param('ptc_nsig_clip')
+    incremental = EOUtilOptions.clone_param('incremental')
 
 
 class PTCTask(FlatSlotTableAnalysisTask):
@@ -52,6 +49,9 @@ class PTCTask(FlatSlotTableAnalysisTask):
     def extract(self, butler, data, **kwargs):
         """Extract the PTC summary statistics
 
+        If config.incremental is set only the amps for which the
+        input data have changed are refit.
+
         Parameters
         ----------
         butler : `Butler`
@@ -82,6 +82,8 @@ class PTCTask(FlatSlotTableAnalysisTask):
                          alpha_error=[],
                          gain=[],
                          gain_error=[],
+                         chi2=[],
+                         converged=[],
                          amp=[])
 
         self.log_info_raft_msg(self.config, "")
@@ -99,58 +101,76 @@ class PTCTask(FlatSlotTableAnalysisTask):
             tab = dtables['ptc_stats']
             mean_sfx = "MEAN"
 
-        for amp in range(1, 17):
-            mean = tab["AMP%02i_%s" % (amp, mean_sfx)]
-            var = tab["AMP%02i_VAR" % (amp)]
-            med_gain = np.median(mean/var)
-            try:
-                #index = np.where(frac_resids < 0.2)
-                index = mean < 8.0e4
-                pars = (2.7e-6, med_gain, 25.)
-                #pars = (25., med_gain, 0.)
-
-                results = scipy.optimize.leastsq(chi2_model, pars, full_output=1,
-                                                 args=(mean[index], var[index], ptc_func))
-                pars, cov = results[:2]
-                ptc_a00 = pars[0]
-                ptc_gain = pars[1]
-                ptc_alpha = pars[2]
-                if cov is not None:
-                    ptc_a00_error = np.sqrt(cov[0][0])
-                    ptc_gain_error = np.sqrt(cov[1][1])
-                    ptc_alpha_error = np.sqrt(cov[2][2])
-                else:
-                    ptc_a00_error = -1.
-                    ptc_alpha_error = -1.
-                    ptc_gain_error = -1.
-                nused = len(index)
-            except Exception as eobj:
-                self.log.warn("Exception caught while fitting PTC:")
-                self.log.warn(str(eobj))
-
-                ptc_a00 = 0.
-                ptc_a00_error = -1.
-                ptc_gain = 0.
-                ptc_gain_error = -1.
-                ptc_alpha = 0.
-                ptc_alpha_error = -1.
-                nused = 0
-            data_dict['ptc_mean'].append(mean)
-            data_dict['ptc_var'].append(var)
-            data_dict['npts'].append(mean.size)
-            data_dict['nused'].append(nused)
-            data_dict['med_gain'].append(med_gain)
-            data_dict['a00'].append(ptc_a00)
-            data_dict['a00_error'].append(ptc_a00_error)
-            data_dict['alpha'].append(ptc_alpha)
-            data_dict['alpha_error'].append(ptc_alpha_error)
-            data_dict['gain'].append(ptc_gain)
-            data_dict['gain_error'].append(ptc_gain_error)
-            data_dict['amp'].append(amp-1)
+        means = np.array([tab["AMP%02i_%s" % (amp, mean_sfx)] for amp in range(1, 17)], float)
+        variances = np.array([tab["AMP%02i_VAR" % (amp)] for amp in range(1, 17)], float)
+        med_gains = np.median(means/variances, axis=1)
+
+        pars = np.zeros((16, 3))
+        errors = -np.ones((16, 3))
+        chi2 = np.zeros(16)
+        converged = np.zeros(16, bool)
+        nused = np.zeros(16, int)
+
+        # Only refit the amps with new data
+        refit = np.ones(16, bool)
+        prev_tables = self.read_previous_tables()
+        if prev_tables is not None and 'converged' in prev_tables['ptc'].colnames:
+            prev = prev_tables['ptc']
+            for amp in range(16):
+                if not np.array_equal(prev['ptc_mean'][amp], means[amp]) or\
+                   not np.array_equal(prev['ptc_var'][amp], variances[amp]):
+                    continue
+                refit[amp] = False
+                pars[amp] = (prev['a00'][amp], prev['gain'][amp], prev['alpha'][amp])
+                errors[amp] = (prev['a00_error'][amp], prev['gain_error'][amp],
+                               prev['alpha_error'][amp])
+                chi2[amp] = prev['chi2'][amp]
+                converged[amp] = prev['converged'][amp]
+                nused[amp] = prev['nused'][amp]
+            self.log.info("Refitting %i amps" % refit.sum())
+
+        # Fit all the amps together
+        pars0 = np.stack([np.full(16, 2.7e-6), med_gains, np.full(16, 25.)], axis=1)[refit]
+        fit_pars, covs, fit_chi2, used, fit_converged =\
+            batched_ptc_fit(means[refit], variances[refit],
+                            means[refit] < self.config.ptc_max_mean, pars0,
+                            nsig_clip=self.config.ptc_nsig_clip)
+        fit_errors = np.sqrt(np.diagonal(covs, axis1=1, axis2=2))
+        fit_errors[~np.isfinite(fit_errors)] = -1.
+        fit_nused = used.sum(axis=1)
+
+        failed = (fit_nused < 3) | ~np.isfinite(fit_pars).all(axis=1)
+        if failed.any():
+            self.log.warn("PTC fit failed for amps %s" % (np.flatnonzero(refit)[failed] + 1))
+        fit_pars[failed] = 0.
+        fit_errors[failed] = -1.
+        fit_nused[failed] = 0
+
+        pars[refit] = fit_pars
+        errors[refit] = fit_errors
+        chi2[refit] = fit_chi2
+        converged[refit] = fit_converged
+        nused[refit] = fit_nused
+
+        for amp in range(16):
+            data_dict['ptc_mean'].append(means[amp])
+            data_dict['ptc_var'].append(variances[amp])
+            data_dict['npts'].append(means[amp].size)
+            data_dict['nused'].append(nused[amp])
+            data_dict['med_gain'].append(med_gains[amp])
+            data_dict['a00'].append(pars[amp][0])
+            data_dict['a00_error'].append(errors[amp][0])
+            data_dict['alpha'].append(pars[amp][2])
+            data_dict['alpha_error'].append(errors[amp][2])
+            data_dict['gain'].append(pars[amp][1])
+            data_dict['gain_error'].append(errors[amp][1])
+            data_dict['chi2'].append(chi2[amp])
+            data_dict['converged'].append(converged[amp])
+            data_dict['amp'].append(amp)
 
         self.log_progress("Done!")
 
-        if nused == 0:
+        if not nused.any():
             return None
 
         outtables = TableDict()
@@ -280,8 +300,6 @@ class PTCStatsTask(FlatRaftTableAnalysisTask):
 
         data_dict = dict(npts=[],
                          nused=[],
-                         ptc_mean=[],
-                         ptc_var=[],
                          med_gain=[],
                          a00=[],
                          a00_error=[],
@@ -289,6 +307,8 @@ class PTCStatsTask(FlatRaftTableAnalysisTask):
                          alpha_error=[],
                          gain=[],
                          gain_error=[],
+                         chi2=[],
+                         converged=[],
                          slot=[],
                          amp=[])
 
@@ -298,8 +318,6 @@ class PTCStatsTask(FlatRaftTableAnalysisTask):
         if slot_list is None:
             slot_list = ALL_SLOTS
 
-        remove_cols = ['ptc_mean', 'ptc_var']
-
         for islot, slot in enumerate(slot_list):
 
             basename = data[slot]
@@ -317,12 +335,13 @@ class PTCStatsTask(FlatRaftTableAnalysisTask):
             table = dtables[datakey]
 
 
-            for _ in range(16):
-                for key, val in table.items():
-                    if key in remove_cols:
-                        continue
-                    data_dict[key].append(val)
-                data_dict['slot'].append(islot)
+            for key, val in data_dict.items():
+                if key == 'slot':
+                    val += len(table)*[islot]
+                elif key in table.colnames:
+                    val += list(table[key])
+                else:
+                    val += len(table)*[np.nan]
 
         self.log_progress("Done!")
 
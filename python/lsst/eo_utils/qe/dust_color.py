@@ -2,18 +2,16 @@
 
 import sys
 
-import numpy as np
-
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
-from lsst.eo_utils.base.data_utils import TableDict, construct_bbox_dict
+from lsst.eo_utils.base.data_utils import TableDict, DefectIndex
 
 from lsst.eo_utils.base.butler_utils import make_file_dict
 
 from lsst.eo_utils.base.iter_utils import AnalysisBySlot
 
 from lsst.eo_utils.base.image_utils import get_amp_list,\
-    get_geom_regions, get_raw_image, unbias_amp
+    get_geom_regions, get_raw_image, unbias_amp, BBoxPhotometry
 
 from lsst.eo_utils.base.factory import EO_TASK_FACTORY
 
@@ -25,6 +23,7 @@ from lsst.eo_utils.qe.analysis import QeAnalysisConfig, QeAnalysisTask
 class DustColorConfig(QeAnalysisConfig):
     """Configuration for DustColorTask"""
     filekey = EOUtilOptions.clone_param('filekey', default='dust-color')
+    max_defects = EOUtilOptions.clone_param('max_defects')
 
 
 class DustColorTask(QeAnalysisTask):
@@ -81,8 +80,8 @@ class DustColorTask(QeAnalysisTask):
         sflat_table_file = self.get_filename_from_format(RAFT_SFLAT_TABLE_FORMATTER, "sflat.fits")
 
         sflat_tables = TableDict(sflat_table_file)
-        bbox_dict = construct_bbox_dict(sflat_tables['defects'])
-        slot_bbox_dict = bbox_dict[slot]
+        defect_index = DefectIndex(sflat_tables['defects'],
+                                   sflat_tables.get_table('defects_index'))
 
         # This is a dictionary of dictionaries to store all the
         # data you extract from the qe_files
@@ -101,54 +100,45 @@ class DustColorTask(QeAnalysisTask):
         # Then loop over dust spots CCDs, amplifiers, and QE files to accumulate the output dictionary
         ccd = self.get_ccd(butler, qe_files[0], mask_files)
         amps = get_amp_list(ccd)
-        spot = 0
         for ifile, qe_file in enumerate(qe_files):
             lam = qe_file.split('flat_')[1].split('_')[0]
+            ccd = self.get_ccd(butler, qe_file, mask_files)
             for i, amp in enumerate(amps):
-                bbox_list = slot_bbox_dict[amp]
-
-                if len(bbox_list) > 100:
-                    if i == 0:
-                        self.log.warn("Skipping slot:amp %s:%i with %i defects" % (slot, amp, len(bbox_list)))
-                    continue
+                # darkest defects first
+                rows = defect_index.top_k(slot, i, self.config.max_defects,
+                                          'ratio_full', ascending=True)
 
-                ccd = self.get_ccd(butler, qe_file, mask_files)
                 regions = get_geom_regions(ccd, amp)
                 serial_oscan = regions['serial_overscan']
                 imaging = regions['imaging']
                 img = get_raw_image(ccd, amp)
                 if superbias_frame is not None:
-                    if butler is not None:
-                        superbias_im = get_raw_image(superbias_frame, amp)
-                    else:
-                        superbias_im = get_raw_image(superbias_frame, amp)
+                    superbias_im = get_raw_image(superbias_frame, amp)
                 else:
                     superbias_im = None
 
                 image = unbias_amp(img, serial_oscan, bias_type=bias_type,
                                    superbias_im=superbias_im, region=imaging)
-                for bbox in bbox_list:
-                    if ifile == 0:
-                        data_dict['SLOT'].append(slot)
-                        #data_dict['LAM'].append(lam)
-                        data_dict['AMP'].append(amp)
-                        data_dict['XCORNER'].append(bbox.getBeginX())
-                        data_dict['YCORNER'].append(bbox.getBeginY())
-                        data_dict['XSIZE'].append(bbox.getWidth())
-                        data_dict['YSIZE'].append(bbox.getHeight())
-
-                    try:
-                        cutout = image[bbox]
-                    except Exception:
-                        pass
-                    # Here evaluate the 'flux' of the feature, relative to the median
-                    # value of the amplifier image.  May also want to assemble bounding
-                    # box corners into a ds9 region file, CCD by CCD
-                    med = np.median(image.array)
-                    flux = np.sum(cutout.array) - bbox.getWidth()*bbox.getHeight()*med
-                    spot += 1
-                    #temp_dict[spot].append((lam, flux, med))
-                    temp_list.append((lam, flux, med))
+
+                # Here evaluate the 'flux' of the feature, relative to the median
+                # value of the amplifier image.  May also want to assemble bounding
+                # box corners into a ds9 region file, CCD by CCD
+                bboxes = defect_index.get_bboxes(rows)
+                phot = BBoxPhotometry(image)
+                med = phot.median
+                areas = (bboxes[:, 2] - bboxes[:, 0])*(bboxes[:, 3] - bboxes[:, 1])
+                fluxes = phot.box_sums(bboxes) - areas*med
+
+                if ifile == 0:
+                    nbox = len(bboxes)
+                    data_dict['SLOT'] += nbox*[slot]
+                    data_dict['AMP'] += nbox*[amp]
+                    data_dict['XCORNER'] += bboxes[:, 1].tolist()
+                    data_dict['YCORNER'] += bboxes[:, 0].tolist()
+                    data_dict['XSIZE'] += (bboxes[:, 3] - bboxes[:, 1]).tolist()
+                    data_dict['YSIZE'] += (bboxes[:, 2] - bboxes[:, 0]).tolist()
+
+                temp_list += [(lam, flux, med) for flux in fluxes]
 
         for i, tmp_data in enumerate(temp_list):
             #data_dict['SLOT'].append(temp_dict['SLOT'][i])
@@ -1,5 +1,7 @@
 """Tasks to analyze superflat low/high exposure ratios"""
 
+import os
+
 import numpy as np
 
 from lsst.eo_utils.base.config_utils import EOUtilOptions
@@ -8,8 +10,7 @@ from lsst.eo_utils.base.data_utils import TableDict
 
 from lsst.eo_utils.base.butler_utils import make_file_dict
 
-from lsst.eo_utils.base.image_utils import get_dims_from_ccd,\
-    get_raw_image, get_geom_regions, get_amp_list
+from lsst.eo_utils.base.image_utils import get_dims_from_ccd, ArrayCCD
 
 from lsst.eo_utils.base.factory import EO_TASK_FACTORY
 
@@ -78,19 +79,17 @@ class SflatRatioTask(SflatSlotTableAnalysisTask):
         if butler is not None:
             self.log.warn("Ignoring butler")
 
-        mask_files = self.get_mask_files()
-        superbias_frame = self.get_superbias_frame(mask_files)
         superflat_file = data[0]
 
-        l_frame = self.get_ccd(None,
-                               superflat_file.replace('.fits', '_l.fits'),
-                               mask_files)
-        h_frame = self.get_ccd(None,
-                               superflat_file.replace('.fits', '_h.fits'),
-                               mask_files)
-        ratio_frame = self.get_ccd(None,
-                                   superflat_file.replace('.fits', '_r.fits'),
-                                   mask_files)
+        l_frame = ArrayCCD(superflat_file.replace('.fits', '_l.fits'))
+        h_frame = ArrayCCD(superflat_file.replace('.fits', '_h.fits'))
+        ratio_frame = ArrayCCD(superflat_file.replace('.fits', '_r.fits'))
+        superbias_file = self.get_superbias_file()
+        if self.get_calib_param_from_flavor('superbias') in [False, None, 'none', 'None'] or\
+           not os.path.exists(superbias_file):
+            superbias_frame = None
+        else:
+            superbias_frame = ArrayCCD(superbias_file)
 
         # This is a dictionary of dictionaries to store all the
         # data you extract from the sflat_files
@@ -105,23 +104,15 @@ class SflatRatioTask(SflatSlotTableAnalysisTask):
         # by the analysis
         #
 
-        amps = get_amp_list(ratio_frame)
-        for i, amp in enumerate(amps):
-            dims = get_dims_from_ccd(ratio_frame)
-            regions = get_geom_regions(ratio_frame, amp)
-            imaging = regions['imaging']
-            l_im = get_raw_image(l_frame, amp).image
-            h_im = get_raw_image(h_frame, amp).image
-            ratio_im = get_raw_image(ratio_frame, amp).image
+        dims = get_dims_from_ccd(ratio_frame)
+        for i, amp in enumerate(ratio_frame.amps()):
+            self.low_images[i] = l_frame.get_region(amp, 'imaging')
+            self.high_images[i] = h_frame.get_region(amp, 'imaging')
+            self.ratio_images[i] = ratio_frame.get_region(amp, 'imaging')
             if superbias_frame is not None:
-                superbias_im = get_raw_image(superbias_frame, amp).image
+                self.superbias_images[i] = superbias_frame.get_region(amp, 'imaging')
             else:
-                superbias_im = None
-
-            self.low_images[i] = l_im[imaging].array
-            self.high_images[i] = h_im[imaging].array
-            self.ratio_images[i] = ratio_im[imaging].array
-            self.superbias_images[i] = superbias_im[imaging].array
+                self.superbias_images[i] = np.zeros(self.ratio_images[i].shape)
 
             quality_mask = np.zeros(self.superbias_images[i].shape)
             quality_mask += 1. * np.invert(np.fabs(self.superbias_images[i]) < 10)
@@ -132,7 +123,7 @@ class SflatRatioTask(SflatSlotTableAnalysisTask):
             row_data_dict['l_med_%s_a%02i' % (slot, i)] = np.median(self.low_images[i], 1)
             row_data_dict['h_med_%s_a%02i' % (slot, i)] = np.median(self.high_images[i], 1)
             row_data_dict['r_med_%s_a%02i' % (slot, i)] = np.median(self.ratio_images[i], 1)
-            if superbias_im is not None:
+            if superbias_frame is not None:
                 row_data_dict['sbias_med_%s_a%02i' % (slot, i)] =\
                     np.median(self.superbias_images[i], 1)
 
@@ -140,7 +131,7 @@ class SflatRatioTask(SflatSlotTableAnalysisTask):
             col_data_dict['l_med_%s_a%02i' % (slot, i)] = np.median(self.low_images[i], 0)
             col_data_dict['h_med_%s_a%02i' % (slot, i)] = np.median(self.high_images[i], 0)
             col_data_dict['r_med_%s_a%02i' % (slot, i)] = np.median(self.ratio_images[i], 0)
-            if superbias_im is not None:
+            if superbias_frame is not None:
                 col_data_dict['sbias_med_%s_a%02i' % (slot, i)] =\
                     np.median(self.superbias_images[i], 0)
 
@@ -148,6 +139,9 @@ class SflatRatioTask(SflatSlotTableAnalysisTask):
             amp_data_dict['h_med_%s_a%02i' % (slot, i)] = [np.median(self.high_images[i])]
             amp_data_dict['r_med_%s_a%02i' % (slot, i)] = [np.median(self.ratio_images[i])]
 
+        for frame in [l_frame, h_frame, ratio_frame, superbias_frame]:
+            if frame is not None:
+                frame.close()
 
         dtables = TableDict()
         dtables.make_datatable('files', make_file_dict(None, [slot]))
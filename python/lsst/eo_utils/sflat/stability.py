@@ -12,7 +12,7 @@ from lsst.eo_utils.base.data_utils import TableDict
 
 from lsst.eo_utils.base.butler_utils import make_file_dict
 
-from lsst.eo_utils.base.image_utils import get_amp_list,\
+from lsst.eo_utils.base.image_utils import get_amp_list, get_dims_from_ccd,\
     get_exposure_time, unbiased_ccd_image_dict,\
     get_monodiode_val_from_data_id
 
@@ -117,8 +117,14 @@ class StabilityTask(SflatAnalysisTask):
             data_dict['AMP%02i_FLAT_MEAN' % i] = []
             data_dict['AMP%02i_FLAT_MEDIAN' % i] = []
             data_dict['AMP%02i_FLAT_VAR' % i] = []
-            data_dict['AMP%02i_FLAT_ROWMEAN' % i] = []
-            data_dict['AMP%02i_FLAT_COLMEAN' % i] = []
+
+        # The row and column means are stored in fixed shape (nfiles, npix)
+        # arrays, one table per quantity and one column per amp.
+        # These are allocated once we know the image dimensions.
+        rowmean_dict = {}
+        colmean_dict = {}
+        nfiles = len(sflat_files)
+        nvalid = 0
 
         for ifile, sflat_file in enumerate(sflat_files):
             if ifile % 10 == 0:
@@ -132,6 +138,14 @@ class StabilityTask(SflatAnalysisTask):
             if mondiode is None:
                 continue
 
+            if not rowmean_dict:
+                dims = get_dims_from_ccd(sflat)
+                for amp in get_amp_list(sflat):
+                    rowmean_dict['AMP%02i' % amp] = np.zeros((nfiles, dims['ncol_i']),
+                                                             np.float32)
+                    colmean_dict['AMP%02i' % amp] = np.zeros((nfiles, dims['nrow_i']),
+                                                             np.float32)
+
             flux = exp_time * mondiode
             data_dict['EXPTIME'].append(exp_time)
             data_dict['MONDIODE'].append(mondiode)
@@ -150,17 +164,26 @@ class StabilityTask(SflatAnalysisTask):
                 data_dict['AMP%02i_FLAT_MEAN' % amp].append(fstats[0])
                 data_dict['AMP%02i_FLAT_MEDIAN' % amp].append(fstats[1])
                 data_dict['AMP%02i_FLAT_VAR' % amp].append(fstats[2])
-                data_dict['AMP%02i_FLAT_ROWMEAN' % amp].append(image.image.array.mean(0))
-                data_dict['AMP%02i_FLAT_COLMEAN' % amp].append(image.image.array.mean(1))
+                image.image.array.mean(0, out=rowmean_dict['AMP%02i' % amp][nvalid])
+                image.image.array.mean(1, out=colmean_dict['AMP%02i' % amp][nvalid])
+
+            nvalid += 1
 
         self.log_progress("Done!")
 
+        for key, val in rowmean_dict.items():
+            rowmean_dict[key] = val[0:nvalid]
+        for key, val in colmean_dict.items():
+            colmean_dict[key] = val[0:nvalid]
+
         primary_hdu = fits.PrimaryHDU()
         primary_hdu.header['NAMPS'] = 16
 
         dtables = TableDict(primary=primary_hdu)
         dtables.make_datatable('files', make_file_dict(butler, sflat_files))
         dtables.make_datatable('stability', data_dict)
+        dtables.make_datatable('rowmean', rowmean_dict)
+        dtables.make_datatable('colmean', colmean_dict)
 
         return dtables
 
@@ -187,6 +210,8 @@ class StabilityTask(SflatAnalysisTask):
 
 
         tab_stab = dtables['stability']
+        tab_rowmean = dtables['rowmean']
+        tab_colmean = dtables['colmean']
         figs.setup_amp_plots_grid('delta', xlabel=label_seq, ylabel=label_delta,
                                   ymin=-10, ymax=10)
         figs.setup_amp_plots_grid('delta-hist', xlabel=label_delta, ylabel="Frames/0.1ADU")
@@ -224,8 +249,8 @@ class StabilityTask(SflatAnalysisTask):
             figs.plot('mean', amp-1, xvals, frac_resid)
             figs.plot('std', amp-1, xvals, std_delta)
 
-            rows = ((tab_stab['AMP%02i_FLAT_ROWMEAN'  % amp].T - refs) / flux).T
-            cols = ((tab_stab['AMP%02i_FLAT_COLMEAN'  % amp].T - refs) / flux).T
+            rows = ((tab_rowmean['AMP%02i' % amp].T - refs) / flux).T
+            cols = ((tab_colmean['AMP%02i' % amp].T - refs) / flux).T
 
             axes_scat = figs.get_amp_axes('delta-v-std', amp-1)
             axes_scat.set_xlim(-5., 5.)
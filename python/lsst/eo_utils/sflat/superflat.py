@@ -6,10 +6,6 @@ import numpy as np
 
 import lsst.afw.math as afwMath
 
-import lsst.afw.image as afwImage
-
-import lsst.eotest.image_utils as imutil
-
 from lsst.eo_utils.base.defaults import ALL_SLOTS
 
 from lsst.eo_utils.base.file_utils import makedir_safe
@@ -20,12 +16,12 @@ from lsst.eo_utils.base.defaults import DEFAULT_STAT_TYPE
 
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
-from lsst.eo_utils.base.data_utils import TableDict
+from lsst.eo_utils.base.data_utils import TableDict, DefectIndex
 
-from lsst.eo_utils.base.image_utils import flip_data_in_place,\
-    sort_sflats, stack_images, extract_raft_array_dict,\
+from lsst.eo_utils.base.image_utils import write_calib_fits,\
+    stack_sflats, extract_raft_array_dict,\
     outlier_raft_dict, fill_footprint_dict, extract_raft_imaging_data,\
-    extract_raft_unbiased_images
+    extract_raft_unbiased_images, prepare_nonlinearity
 
 from lsst.eo_utils.base.iter_utils import AnalysisBySlot
 
@@ -46,6 +42,8 @@ class SuperflatConfig(SflatAnalysisConfig):
     """Configuration for SuperflatTask"""
     stat = EOUtilOptions.clone_param('stat')
     bitpix = EOUtilOptions.clone_param('bitpix')
+    compress = EOUtilOptions.clone_param('compress')
+    quantize_level = EOUtilOptions.clone_param('quantize_level')
     skip = EOUtilOptions.clone_param('skip')
     plot = EOUtilOptions.clone_param('plot')
     stats_hist = EOUtilOptions.clone_param('stats_hist')
@@ -113,7 +111,7 @@ class SuperflatTask(SflatAnalysisTask):
         superbias_frame = self.get_superbias_frame(mask_files)
 
         gains = self.get_gains()
-        nlc = self.get_nonlinearirty_correction()
+        nlc = prepare_nonlinearity(self.get_nonlinearirty_correction())
 
         sflat_files = data['SFLAT']
 
@@ -121,46 +119,25 @@ class SuperflatTask(SflatAnalysisTask):
             self.log_warn_slot_msg(self.config, "No superflat files")
             return None
 
-        sflat_files_l, sflat_files_h = sort_sflats(butler, sflat_files, self.exptime_cut)
-
-        if not sflat_files_l:
-            self.log_warn_slot_msg(self.config, "No lo superflat files")
-            return None
-        if not sflat_files_h:
-            self.log_warn_slot_msg(self.config, "No hi superflat files")
-            return None
-
-        self.log_info_slot_msg(self.config, "%i %i %i files" % (len(sflat_files),
-                                                                len(sflat_files_l),
-                                                                len(sflat_files_h)))
-
-
+        self.log_info_slot_msg(self.config, "%i files" % len(sflat_files))
 
         if stat_type.upper() in afwMath.__dict__:
             statistic = afwMath.__dict__[stat_type.upper()]
         else:
             raise ValueError("Can not convert %s to a valid statistic" % stat_type)
 
-        sflat_l = stack_images(butler, sflat_files_l, statistic=statistic,
-                               bias_type=bias_type, bias_type_col=bias_type_col,
-                               superbias_frame=superbias_frame,
-                               gains=gains,
-                               nlc=nlc)
-        sflat_h = stack_images(butler, sflat_files_h, statistic=statistic,
-                               bias_type=bias_type, bias_type_col=bias_type_col,
-                               superbias_frame=superbias_frame,
-                               gains=gains,
-                               nlc=nlc)
-
-        ratio_images = {}
-        for amp in range(1, 17):
-            im_l = sflat_l[amp]
-            im_h = sflat_h[amp]
-            ratio = im_l.array / im_h.array
-            ratio_images[amp] = afwImage.ImageF(ratio)
+        sflats = stack_sflats(butler, sflat_files, statistic=statistic,
+                              exptime_cut=self.exptime_cut,
+                              bias_type=bias_type, bias_type_col=bias_type_col,
+                              superbias_frame=superbias_frame,
+                              gains=gains,
+                              nlc=nlc,
+                              log=self.log)
+        if sflats is None:
+            self.log_warn_slot_msg(self.config, "Missing lo or hi superflat files")
+            return None
 
-        self.log_progress("Done!")
-        return (sflat_l, sflat_h, ratio_images)
+        return sflats
 
 
     def make_superflats(self, butler, data, **kwargs):
@@ -200,16 +177,15 @@ class SuperflatTask(SflatAnalysisTask):
             else:
                 template_file = get_filename_from_id(butler, data['SFLAT'][0])
 
-            imutil.writeFits(sflats[0], output_file + '_l.fits',
-                             template_file, self.config.bitpix)
-            imutil.writeFits(sflats[1], output_file + '_h.fits',
-                             template_file, self.config.bitpix)
-            imutil.writeFits(sflats[2], output_file + '_r.fits',
-                             template_file, self.config.bitpix)
-            if butler is not None:
-                flip_data_in_place(output_file + '_l.fits')
-                flip_data_in_place(output_file + '_h.fits')
-                flip_data_in_place(output_file + '_r.fits')
+            write_kw = dict(compress=self.config.compress,
+                            quantize_level=self.config.quantize_level,
+                            flip=butler is not None)
+            write_calib_fits(sflats[0], output_file + '_l.fits',
+                             template_file, self.config.bitpix, **write_kw)
+            write_calib_fits(sflats[1], output_file + '_h.fits',
+                             template_file, self.config.bitpix, **write_kw)
+            write_calib_fits(sflats[2], output_file + '_r.fits',
+                             template_file, self.config.bitpix, **write_kw)
 
         self._superflat_frame_l = self.get_ccd(None, output_file + '_l.fits', mask_files)
         self._superflat_frame_h = self.get_ccd(None, output_file + '_h.fits', mask_files)
@@ -302,6 +278,7 @@ class SuperflatRaftConfig(SflatRaftTableAnalysisConfig):
     filekey = EOUtilOptions.clone_param('filekey', default='sflat')
     stats_hist = EOUtilOptions.clone_param('stats_hist')
     mosaic = EOUtilOptions.clone_param('mosaic')
+    nthreads = EOUtilOptions.clone_param('nthreads')
 
 
 class SuperflatRaftTask(SflatRaftTableAnalysisTask):
@@ -413,14 +390,16 @@ class SuperflatRaftTask(SflatRaftTableAnalysisTask):
                                                         ccd_dict)
         self._sflat_array_r = extract_raft_array_dict(self._sflat_file_dict_r,
                                                       mask_dict=self._mask_file_dict)
-        out_data_l = outlier_raft_dict(self._sflat_array_l, 1000., 300.)
-        out_data_h = outlier_raft_dict(self._sflat_array_h, 50000., 15000.)
-        out_data_r = outlier_raft_dict(self._sflat_array_r, 0.019, 0.002)
+        nthreads = self.config.nthreads
+        out_data_l = outlier_raft_dict(self._sflat_array_l, 1000., 300., nthreads=nthreads)
+        out_data_h = outlier_raft_dict(self._sflat_array_h, 50000., 15000., nthreads=nthreads)
+        out_data_r = outlier_raft_dict(self._sflat_array_r, 0.019, 0.002, nthreads=nthreads)
 
         fp_dict = SuperflatRaftTask.build_defect_dict(self._sflat_images_h, frac_thresh=0.9)
 
         dtables = TableDict()
         dtables.make_datatable('defects', fp_dict)
+        dtables.add_datatable('defects_index', DefectIndex(dtables['defects']).to_table())
         dtables.make_datatable('outliers_l', out_data_l)
         dtables.make_datatable('outliers_h', out_data_h)
         dtables.make_datatable('outliers_r', out_data_r)
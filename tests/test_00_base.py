@@ -3,17 +3,38 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
+import tempfile
+
+import numpy as np
+
+import scipy.optimize
+
+from astropy.io import fits
+
+import lsst.geom as afwGeom
+
 from lsst.eo_utils.base.file_utils import merge_file_dicts,\
     get_files_for_run, get_raft_names_dc, read_raft_ccd_map,\
     read_runlist
 
-from lsst.eo_utils.base.data_utils import TableDict
+from lsst.eo_utils.base.data_utils import TableDict, DefectIndex
 
 from lsst.eo_utils.base.plot_utils import FigureDict
 
 from lsst.eo_utils.base.config_utils import EOUtilOptions
 
-from .utils import requires_site
+from lsst.eo_utils.base.stat_utils import flat_pair_stats, fft_covariance,\
+    batched_linear_chisq_fit, perform_linear_chisq_fit, make_profile_hist,\
+    batched_histograms, batched_gauss_fit, ptc_model, batched_ptc_fit,\
+    chi2_model, LINEARITY_FUNC_DICT
+
+from lsst.eo_utils.base.image_utils import make_calib_hdu, read_calib_amp_array,\
+    unbias_array_stack, find_footprints, StackAccumulator, classify_sflat,\
+    outlier_stats, outlier_raft_dict, read_region_arrays, get_geom_regions_from_file,\
+    bbox_to_slices, ArrayCCD, get_exposure_time, NonlinearityLUT
+
+from .utils import requires_site, write_test_mef
 
 def test_config_utils():
     """Test the config_utils module"""
@@ -27,6 +48,100 @@ def test_stat_utils():
     """Test the stats_utils module"""
     return
 
+def test_stat_utils_flat_pair():
+    """Test the flat pair statistics against a direct calculation"""
+    flat_1 = np.random.normal(1000., 30., (100, 50)).astype(np.float32)
+    flat_2 = np.random.normal(1010., 30., (100, 50)).astype(np.float32)
+    mask = np.zeros(flat_1.shape, np.int32)
+    mask[10, 10] = 1
+    flat_1[10, 10] = 1.e6
+    fstats = flat_pair_stats([flat_1], [flat_2], [mask], [mask])
+    good = mask == 0
+    ratio = np.mean((flat_1/flat_2)[good])
+    assert np.isclose(fstats[0][0], ratio)
+    assert np.isclose(fstats[4][0], flat_1[good].mean())
+    assert np.isclose(fstats[3][0], np.var((flat_1 - flat_2*ratio)[good], ddof=1)/2.)
+
+
+def test_stat_utils_linear_fit():
+    """Test the batched linear fits against single fits"""
+    xvals = np.linspace(1000., 100000., 50)
+    yvals = np.vstack([slope*xvals + 1.e-7*xvals*xvals + np.random.normal(0., 10., 50)
+                       for slope in [1., 1.5, 2.]])
+    mask = np.ones(yvals.shape, bool)
+    mask[1, 0:10] = False
+    pars, covs = batched_linear_chisq_fit(xvals, yvals, mask, 2)[0:2]
+    for i in range(3):
+        results = perform_linear_chisq_fit(xvals, yvals[i], mask[i], 2)[0]
+        assert np.allclose(pars[i], results[0])
+        assert np.allclose(covs[i], results[1])
+        expected = scipy.optimize.leastsq(chi2_model, [1., 0.],
+                                          args=(xvals[mask[i]], yvals[i][mask[i]],
+                                                LINEARITY_FUNC_DICT[2]),
+                                          full_output=1)
+        assert np.allclose(pars[i], expected[0], rtol=1e-5)
+        assert np.allclose(covs[i], expected[1], rtol=1e-4)
+    assert np.allclose(pars[:, 0], [1., 1.5, 2.], rtol=1e-2)
+
+
+def test_stat_utils_profile_hist():
+    """Test the profile histogram against a bin-by-bin calculation"""
+    xdata = np.random.uniform(0., 10., 500)
+    ydata = np.random.normal(0., 1., 500)
+    yerrs = np.random.uniform(0.5, 1., 500)
+    xbins = np.linspace(0., 11., 12)
+    _, y_vals, y_errs = make_profile_hist(xbins, xdata, ydata, yerrs=yerrs, stderr=True)
+    for i in range(10):
+        mask = (xdata >= xbins[i]) * (xdata < xbins[i+1])
+        weights = 1./(yerrs[mask]*yerrs[mask])
+        assert np.isclose(y_vals[i], (ydata[mask]*weights).sum() / weights.sum())
+        assert np.isclose(y_errs[i], ydata[mask].std() / np.sqrt(mask.sum()))
+    assert y_vals[10] == 0. and y_errs[10] == -1.
+
+
+def test_stat_utils_gauss_fit():
+    """Test fitting Gaussians to many histograms at once"""
+    data_list = [np.random.normal(mean, width, 10000) for mean, width in [(0., 1.), (10., 3.)]]
+    bin_edges = np.array([np.linspace(-5., 5., 51), np.linspace(-5., 25., 51)])
+    counts = batched_histograms(data_list, bin_edges)
+    assert (counts[1] == np.histogram(data_list[1], bins=bin_edges[1])[0]).all()
+    pars, _, dof, converged = batched_gauss_fit(bin_edges, counts)
+    assert converged.all() and dof == 47
+    assert np.allclose(pars[:, 1], [0., 10.], atol=0.1)
+    assert np.allclose(pars[:, 2], [1., 3.], rtol=0.05)
+
+
+def test_stat_utils_ptc_fit():
+    """Test the batched PTC fits against single fits"""
+    means = np.vstack([np.linspace(1000., 100000., 40)]*3)
+    truth = np.array([[2.5e-6, 0.9, 20.], [3.0e-6, 1.1, 30.], [2.0e-6, 1.3, 10.]])
+    variances = ptc_model(truth, means) * np.random.normal(1., 0.01, means.shape)
+    variances[2, 5] *= 1.3
+    mask = means < 8.0e4
+    pars0 = np.array([[2.7e-6, 1., 25.]]*3)
+    pars, covs, chi2, _, converged = batched_ptc_fit(means, variances, mask, pars0)
+    assert converged.all() and np.isfinite(covs).all()
+    assert np.allclose(pars[:, 1], truth[:, 1], rtol=0.05)
+    for i in range(3):
+        def chi_func(pars, i=i):
+            """The residuals for one fit"""
+            return (variances[i][mask[i]] - ptc_model(pars, means[i][mask[i]])) /\
+                np.sqrt(variances[i][mask[i]])
+        results = scipy.optimize.leastsq(chi_func, pars0[i])
+        assert np.isclose(chi2[i], (chi_func(results[0])**2).sum(), rtol=1e-6)
+    used = batched_ptc_fit(means, variances, mask, pars0, nsig_clip=10.)[3]
+    assert not used[2, 5] and used.sum() == mask.sum() - 1
+
+
+def test_stat_utils_fft_covariance():
+    """Test the FFT covariances against a direct sum at one lag"""
+    diff = np.random.normal(0., 10., (200, 100))
+    diff[:, 1:] += 0.3*diff[:, :-1]
+    cov = fft_covariance(diff, 2, nsigma=100., binsize=400)[0]
+    cent = diff - diff.mean()
+    assert np.isclose(cov[1][0], np.mean(cent[:, 1:]*cent[:, :-1]), rtol=1e-3)
+    assert cov[1][0] > 5.*abs(cov[0][1])
+
 
 @requires_site('slac')
 def test_file_utils_get_ts8():
@@ -107,6 +222,161 @@ def test_data_utils():
     tab_dict = TableDict()
     assert tab_dict is not None
 
+def test_data_utils_append_datatable():
+    """Test appending rows to a table"""
+    tab_dict = TableDict()
+    tab_dict.append_datatable('files', dict(filename=['a.fits', 'b.fits']))
+    files = tab_dict.append_datatable('files', dict(filename=['c.fits']))
+    assert list(files['filename']) == ['a.fits', 'b.fits', 'c.fits']
+
+def test_data_utils_defect_index():
+    """Test the spatial index of defects"""
+    tab_dict = TableDict()
+    defects = tab_dict.make_datatable('defects', dict(slot=[0, 0, 0, 1],
+                                                      amp=[2, 2, 2, 2],
+                                                      x_corner=[10, 300, 100, 10],
+                                                      y_corner=[10, 1000, 120, 10],
+                                                      x_size=[5, 100, 2, 5],
+                                                      y_size=[5, 3, 2, 5],
+                                                      ratio_full=[0.5, 0.9, 0.2, 0.5]))
+    index = DefectIndex(defects, DefectIndex(defects).to_table())
+    assert index.rows('S00', 2).tolist() == [0, 1, 2]
+    assert index.query_region(0, 2, (0, 0, 200, 350)).tolist() == [0, 2]
+    assert index.query_region(0, 2, (1000, 390, 1001, 400)).tolist() == [1]
+    assert index.nearest(0, 2, (118, 99)).tolist() == [2]
+    assert index.top_k(0, 2, 2, 'ratio_full', ascending=True).tolist() == [2, 0]
+
+def test_image_utils_calib_io():
+    """Test writing and reading back compressed calibration frames"""
+    data = np.random.normal(1000., 5., (200, 60)).astype(np.float32)
+    hdus = [fits.PrimaryHDU()]
+    hdus += [make_calib_hdu(data, -32, compress='GZIP_2') for _ in range(16)]
+    filepath = os.path.join(tempfile.mkdtemp(), 'calib.fits')
+    fits.HDUList(hdus).writeto(filepath)
+    amp_data = read_calib_amp_array(filepath, 3)
+    assert (amp_data == data).all()
+    assert not amp_data.flags.writeable
+    assert read_calib_amp_array(filepath, 3) is amp_data
+
+def test_image_utils_read_region_arrays():
+    """Test reading the regions of the amps against slicing the full HDUs"""
+    filepath = os.path.join(tempfile.mkdtemp(), 'mef.fits')
+    amp_data = write_test_mef(filepath)
+    regions = get_geom_regions_from_file(filepath)
+    region_arrays = read_region_arrays(filepath, ['imaging', 'serial_overscan'], amps=[2, 9])
+    assert sorted(region_arrays.keys()) == [2, 9]
+    for amp, amp_arrays in region_arrays.items():
+        assert sorted(amp_arrays.keys()) == ['imaging', 'serial_overscan']
+        for key, val in amp_arrays.items():
+            expected = amp_data[amp-1][bbox_to_slices(regions[key])]
+            assert val.dtype == np.float32
+            assert (val == expected).all()
+
+def test_image_utils_array_ccd():
+    """Test reading regions, masks and the exposure time with ArrayCCD"""
+    tempdir = tempfile.mkdtemp()
+    filepath = os.path.join(tempdir, 'mef.fits')
+    amp_data = write_test_mef(filepath, exptime=15.)
+    masks = [np.zeros(data.shape, np.int32) for data in amp_data]
+    masks[2][5, 15] = 1
+    maskpath = os.path.join(tempdir, 'mask.fits')
+    fits.HDUList([fits.PrimaryHDU()] +
+                 [make_calib_hdu(mask, 32) for mask in masks]).writeto(maskpath)
+
+    with ArrayCCD(filepath, mask_files=[maskpath]) as ccd:
+        assert get_exposure_time(ccd) == 15.
+        slices = bbox_to_slices(ccd.amp_geom.imaging)
+        imaging = ccd.get_region(3, 'imaging')
+        assert (imaging == amp_data[2][slices]).all()
+        masked = ccd.get_masked_region(3, 'imaging')
+        assert (masked.data == imaging).all()
+        assert masked.mask.sum() == 1 and masked.mask[5, 5]
+        assert not ccd.get_masked_region(4, 'imaging').mask.any()
+    assert (imaging == amp_data[2][slices]).all()
+
+def test_image_utils_nonlinearity_lut():
+    """Test the tabulated nonlinearity correction against the exact one"""
+
+    def correction(amp, data):
+        """The exact correction, with enough curvature to test the interpolation"""
+        return data*(1. + 1.e-3*amp*data/1.e5) + 50.*np.sin(data/3000.)
+
+    nlc = NonlinearityLUT(correction)
+    data = np.random.uniform(-4000., 200000., (100, 50)).astype(np.float32)
+    data[0, 0:5] = [-5000.5, -8000., 262144.5, 300000., 262144.]
+    outliers = correction(3, data[0, 0:4])
+    exact = correction(3, data.astype(float))
+    corrected = nlc.apply(3, data)
+    assert corrected is data
+    # Linear interpolation on a 1 ADU grid, up to float32 rounding
+    assert np.allclose(data[1:], exact[1:], rtol=0., atol=0.02)
+    assert np.isclose(data[0, 4], exact[0, 4], rtol=0., atol=0.02)
+    # Outside the table range the correction is evaluated directly
+    assert (data[0, 0:4] == outliers).all()
+
+def test_image_utils_unbias_stack():
+    """Test unbiasing a stack of amps against the row-by-row calculation"""
+    stack = np.random.normal(1000., 7., (16, 200, 60)).astype(np.float32)
+    serial_oscan = afwGeom.Box2I(afwGeom.Point2I(40, 0), afwGeom.Extent2I(20, 200))
+    for bias_type in ['row', 'func']:
+        unbiased = unbias_array_stack(stack.copy(), serial_oscan, bias_type)
+        for amp_data, amp_unbiased in zip(stack, unbiased):
+            values = np.array([np.mean(row[45:58]) for row in amp_data])
+            if bias_type == 'func':
+                values = np.polyval(np.polyfit(np.arange(200), values, 1), np.arange(200))
+            expected = amp_data - values.astype(np.float32)[:, np.newaxis]
+            assert np.allclose(amp_unbiased, expected, atol=1e-3)
+
+def test_image_utils_find_footprints():
+    """Test finding footprints and their peaks"""
+    data = np.zeros((50, 40), np.float32)
+    data[10:13, 5:7] = 2.
+    data[13, 7] = 3.
+    data[40, 30] = 5.
+    _, bboxes, peaks = find_footprints(data, 1.)
+    assert np.all(bboxes == [[10, 5, 14, 8], [40, 30, 41, 31]])
+    assert np.all(peaks == [[13, 7], [40, 30]])
+
+def test_image_utils_stack_accumulator():
+    """Test adding frames to saved running statistics against stacking them all"""
+    frames = np.random.normal(1000., 5., (7, 20, 30))
+    accum = StackAccumulator(nsample=11)
+    for i, frame in enumerate(frames[0:4]):
+        accum.add({1: frame}, 1., 'file%i' % i)
+    filepath = os.path.join(tempfile.mkdtemp(), 'accum.fits')
+    accum.save(filepath)
+    accum = StackAccumulator.load(filepath)
+    for i, frame in enumerate(frames[4:]):
+        accum.add({1: frame}, 1., 'file%i' % (i+4))
+    assert accum.nframes == 7
+    assert accum.file_keys == ['file%i' % i for i in range(7)]
+    assert np.allclose(accum.stack_array(1, 'mean'), frames.mean(axis=0))
+    assert np.allclose(accum.stack_array(1, 'stdev'), frames.std(axis=0, ddof=1))
+    assert np.allclose(accum.stack_array(1, 'median'), np.median(frames, axis=0), atol=1e-3)
+
+def test_image_utils_classify_sflat():
+    """Test classifying superflats from the filename or the header"""
+    assert classify_sflat(None, 'sflat_500_flat_L_001.fits') == 'l'
+    assert classify_sflat(None, 'sflat_500_flat_H_001.fits') == 'h'
+    filepath = os.path.join(tempfile.mkdtemp(), 'sflat.fits')
+    fits.PrimaryHDU(header=fits.Header([('EXPTIME', 30.)])).writeto(filepath)
+    assert classify_sflat(None, filepath, 20.) == 'h'
+    assert classify_sflat(None, filepath, 40.) == 'l'
+
+def test_image_utils_outlier_raft_dict():
+    """Test the raft outlier stats against the amp-by-amp calculation"""
+    raft_data = {slot: {amp: np.random.normal(0., 30., (100, 50)).astype(np.float32)
+                        for amp in range(1, 17)} for slot in ['S00', 'S01']}
+    raft_data['S01'][3][:, 20] = 500.
+    raft_data['S02'] = {}
+    out_data = outlier_raft_dict(raft_data, 0., 50., nthreads=2)
+    assert len(out_data['slot']) == 32
+    assert all(len(val) == 32 for val in out_data.values())
+    for i, (slot, amp) in enumerate(zip(out_data['slot'], out_data['amp'])):
+        amp_stats = outlier_stats(raft_data[['S00', 'S01'][slot]][amp+1], 0., 50.)
+        for key, val in amp_stats.items():
+            assert np.allclose(out_data[key][i], val)
+
 def test_plot_utils():
     """Test the plot_utils module"""
     fig_dict = FigureDict()
@@ -3,10 +3,15 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
+import tempfile
+
 from lsst.eo_utils.base.butler_utils import get_butler_by_repo
+from lsst.eo_utils.base.image_utils import read_region_arrays, get_geom_regions_from_file,\
+    bbox_to_slices
 from lsst.eo_utils import bias
 
-from .utils import assert_data_dict, requires_site,\
+from .utils import assert_data_dict, requires_site, write_test_mef,\
     DATA_OPTIONS_TS8_GLOB, DATA_OPTIONS_BOT_GLOB,\
     DATA_OPTIONS_TS8_BUTLER, DATA_OPTIONS_BOT_BUTLER,\
     RUN_TASKS, RUN_OPTIONS, RUN_OPTIONS_NOPLOT, SUMMARY_OPTIONS
@@ -133,6 +138,18 @@ def test_oscan_correl():
     if RUN_TASKS:
         task.run(superbias=None, **RUN_OPTIONS)
 
+def test_oscan_correl_region_data():
+    """Test trimming the serial overscans read with read_region_arrays"""
+    filepath = os.path.join(tempfile.mkdtemp(), 'mef.fits')
+    amp_data = write_test_mef(filepath)
+    serial_oscan = get_geom_regions_from_file(filepath)['serial_overscan']
+    task = bias.OscanCorrelTask()
+    trim = slice(task.boundry, -task.boundry)
+    overscans = task.get_region_data(read_region_arrays(filepath, ['serial_overscan']))
+    assert len(overscans) == 16
+    for data, oscan_data in zip(amp_data, overscans):
+        assert (oscan_data == data[bbox_to_slices(serial_oscan)][trim, trim]).all()
+
 def test_superbias_stdev():
     """Test the SuperbiasTask in stdevclip mode"""
     task = bias.SuperbiasTask()
@@ -3,8 +3,18 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
+import tempfile
+
+import numpy as np
+
+from astropy.io import fits
+
 from lsst.eo_utils.base.butler_utils import get_butler_by_repo
 from lsst.eo_utils import fe55
+from lsst.eo_utils.fe55.fe55_clusters import find_fe55_clusters
+from lsst.eo_utils.fe55.fe55_gain import FE55_CLUSTER_COLUMNS, read_fe55_cluster_arrays,\
+    fe55_good_cluster_mask, fe55_gain_stats
 
 from .utils import assert_data_dict, requires_site,\
     DATA_OPTIONS_TS8_GLOB, DATA_OPTIONS_BOT_GLOB,\
@@ -36,6 +46,54 @@ def test_fe55_butler_utils():
     assert_data_dict(fe55_files_6545, 'R10', 'FE55', (2, 9, 1, 5))
 
 
+def test_fe55_find_clusters():
+    """Test finding fe55 clusters in a simulated image"""
+    data = np.random.normal(0., 5., (200, 100))
+    data[50, 40] += 1000.
+    data[50, 41] += 600.
+    data[120:124, 10:60] += 500.
+    clusters = find_fe55_clusters(data, nsig=5.)
+    assert len(clusters['DN']) == 1
+    assert clusters['XPEAK'][0] == 40 and clusters['YPEAK'][0] == 50
+    assert np.isclose(clusters['DN_SUM'][0], 1600., atol=50.)
+    assert 40. < clusters['XPOS'][0] < 41.
+
+
+def test_fe55_gain_engine():
+    """Test reading cluster tables, the good-cluster cut and the cluster counts"""
+    hdus = [fits.PrimaryHDU()]
+    for amp in range(16):
+        nclus = 200
+        cols = {col: np.random.uniform(10., 500., nclus) for col in FE55_CLUSTER_COLUMNS}
+        cols['DN'] = np.random.normal(1600., 15., nclus)
+        cols['XPEAK'] = np.floor(cols['XPOS'])
+        cols['YPEAK'] = np.floor(cols['YPOS'])
+        cols['XPEAK'][0:amp+10] += 2.
+        hdus.append(fits.BinTableHDU.from_columns([fits.Column(col, 'D', array=val)
+                                                   for col, val in cols.items()],
+                                                  name='AMP%02i' % (amp+1)))
+    filepath = os.path.join(tempfile.mkdtemp(), 'fe55-clusters.fits')
+    fits.HDUList(hdus).writeto(filepath)
+
+    amp_list = read_fe55_cluster_arrays(filepath)
+    assert len(amp_list) == 16
+    assert sorted(amp_list[3].keys()) == sorted(FE55_CLUSTER_COLUMNS)
+    mask = fe55_good_cluster_mask(amp_list[3])
+    assert mask.sum() == 200 - 13 and not mask[0:13].any()
+    assert fe55_good_cluster_mask(amp_list[3], use_all=True).all()
+
+    data_dict = fe55_gain_stats([filepath, filepath])
+    assert data_dict['ncluster'] == 32*[200]
+    assert data_dict['ngood'] == 2*[200 - amp - 10 for amp in range(16)]
+    assert len(data_dict['gain']) == 32
+
+@requires_site('slac')
+def test_fe55_clusters():
+    """Test the Fe55ClustersTask"""
+    task = fe55.Fe55ClustersTask()
+    if RUN_TASKS:
+        task.run(slots=['S00'], **RUN_OPTIONS)
+
 @requires_site('slac')
 def test_fe55_gain_stats():
     """Test the Fe55GainStatsTask"""
@@ -43,6 +101,13 @@ def test_fe55_gain_stats():
     if RUN_TASKS:
         task.run(calib='eotest', **RUN_OPTIONS)
 
+@requires_site('slac')
+def test_fe55_gain_fp():
+    """Test the Fe55GainFocalPlaneTask"""
+    task = fe55.Fe55GainFocalPlaneTask()
+    if RUN_TASKS:
+        task.run(calib='eotest', **RUN_OPTIONS)
+
 @requires_site('slac')
 def test_fe55_gain_sum():
     """Test the Fe55GainSummaryTask"""
@@ -4,10 +4,16 @@
 from __future__ import absolute_import, division, print_function
 
 import os
+
+import numpy as np
+
+from astropy.io import fits
 from astropy.tests.helper import pytest
 
 from lsst.eo_utils.base.defaults import SITE
 
+from lsst.eo_utils.base.image_utils import make_calib_hdu
+
 __all__ = ['requires_file', 'RUN_TASKS']
 
 DATA_OPTIONS_TS8_GLOB = dict(teststand='ts8', data_source='glob')
@@ -23,6 +29,35 @@ RUN_OPTIONS = dict(runs=['6106D'], outdir='test_out', plot='png', teststand='ts8
 RUN_OPTIONS_NOPLOT = dict(runs=['6106D'], outdir='test_out', teststand='ts8')
 SUMMARY_OPTIONS = dict(dataset='tests/test', outdir='test_out', plot='png',  teststand='ts8')
 
+def write_test_mef(filepath, exptime=1., bitpix=-32):
+    """Write a small 16 amp file with the e2v header layout
+
+    Each amp is 80x100 pixels, with 10 prescan columns, a 40x80 imaging region,
+    30 serial overscan columns and 20 parallel overscan rows.
+    The pixel values are different for each pixel and amp.
+
+    Returns
+    -------
+    amp_data : `list`
+        The data arrays, one per amp
+    """
+    primary = fits.PrimaryHDU()
+    primary.header['EXPTIME'] = exptime
+    primary.header['CCD_MANU'] = 'E2V'
+    primary.header['DETSIZE'] = '[1:320,1:160]'
+    hdus = [primary]
+    amp_data = []
+    for amp in range(1, 17):
+        data = np.arange(100*80, dtype=np.float32).reshape(100, 80) + 10000.*amp
+        hdu = make_calib_hdu(data, bitpix)
+        hdu.header['DATASEC'] = '[11:50,1:80]'
+        hdu.header['EXTNAME'] = 'SEGMENT%s' % ('10 11 12 13 14 15 16 17 '
+                                                '07 06 05 04 03 02 01 00'.split()[amp-1])
+        hdus.append(hdu)
+        amp_data.append(data)
+    fits.HDUList(hdus).writeto(filepath, overwrite=True)
+    return amp_data
+
 def requires_file(filepath):
     """Skip test if required file is missing"""
     skip_it = bool(not os.path.isfile(filepath))